@@ -0,0 +1,214 @@
+'''
+Benchmarks of the hot paths of the BEC teaching pipeline on the augmented_taxi2, skateboard2 and colored_tiles domains
+(built from the parameters in params.py) with fixed seeds. Run from the root of the repository, e.g.
+
+    python -m benchmarks.bench_pipeline --output benchmarks/results/baseline.json
+    python -m benchmarks.bench_pipeline --output benchmarks/results/candidate.json --compare benchmarks/results/baseline.json
+
+When comparing, every stage whose median time regressed by more than the tolerance is listed and the exit code is 1
+'''
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+import traceback
+from multiprocessing import Pool
+
+import numpy as np
+
+from simple_rl.planning import ValueIteration
+from simple_rl.utils import make_mdp
+from policy_summarization import BEC_helpers
+from policy_summarization import particle_filter as pf
+from policy_summarization import policy_summarization_helpers as ps_helpers
+from policy_summarization import stage_graph
+from policy_summarization import env_catalog
+
+DOMAINS = ['augmented_taxi2', 'skateboard2', 'colored_tiles']
+
+def load_domain_params(mdp_class, params_filename='params.py'):
+    '''
+    Evaluate params.py for the requested domain (rather than the one it currently selects), so that the benchmarks
+    always use the same parameters as the pipeline
+    '''
+    with open(params_filename, 'r') as f:
+        source = f.read()
+    source = re.sub(r"^mdp_class = .*$", "mdp_class = '{}'".format(mdp_class), source, count=1, flags=re.MULTILINE)
+
+    params = {'__file__': os.path.abspath(params_filename)}
+    exec(compile(source, params_filename, 'exec'), params)
+
+    return params
+
+def time_call(func, setup=None, repeat=5):
+    '''
+    Time func (called with the result of setup(), if provided, which isn't timed) repeat times
+    '''
+    seconds = []
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        start_time = time.perf_counter()
+        func(*args)
+        seconds.append(time.perf_counter() - start_time)
+
+    return {'median': float(np.median(seconds)), 'min': float(np.min(seconds)), 'mean': float(np.mean(seconds)), 'repeat': repeat}
+
+def sample_constraints(weights, n_constraints, rng):
+    '''
+    Random constraints that are all satisfied by the ground truth weights (i.e. whose BEC region is nonempty)
+    '''
+    constraints = []
+    while len(constraints) < n_constraints:
+        constraint = rng.normal(size=(1, weights.shape[1]))
+        if constraint.dot(weights.T) < 0:
+            constraint = -constraint
+        constraints.append(np.round(constraint, 2))
+
+    return constraints
+
+def benchmark_domain(mdp_class, pool, n_envs=4, n_constraints=12, n_particles=200, n_human_models=8, repeat=5, seed=0, summary=True):
+    params = load_domain_params(mdp_class)
+    mdp_parameters = params['mdp_parameters']
+    weights = params['weights']['val']
+    step_cost_flag = params['step_cost_flag']
+    data_loc = 'benchmarks/' + mdp_class
+
+    random.seed(seed)
+    np.random.seed(seed)
+    rng = np.random.default_rng(seed)
+
+    results = {}
+
+    def run(name, func, setup=None, n_repeat=repeat):
+        print('{}: {}'.format(mdp_class, name))
+        try:
+            results[name] = time_call(func, setup=setup, repeat=n_repeat)
+        except Exception as e:
+            traceback.print_exc()
+            results[name] = {'error': repr(e)}
+
+    # a fixed, seeded subset of the domain's environments
+    catalog = env_catalog.EnvCatalog(mdp_class, data_loc, np.expand_dims(weights, axis=0), mdp_parameters)
+    catalog.sample(n_envs - len(catalog), rng=random.Random(seed))
+    catalog.materialize(pool)
+
+    env_mdp_parameters = ps_helpers.configure_mdp_parameters(mdp_class, catalog.codes[0], False, copy.deepcopy(mdp_parameters))
+    env_mdp_parameters['weights'] = weights
+    run('ValueIteration.run_vi', lambda vi: vi.run_vi(),
+        setup=lambda: ValueIteration(make_mdp.make_custom_mdp(mdp_class, env_mdp_parameters), sample_rate=1))
+
+    constraints = sample_constraints(weights, n_constraints, rng)
+    run('remove_redundant_constraints_lp', lambda: BEC_helpers.remove_redundant_constraints_lp(constraints, weights, step_cost_flag))
+    run('calc_solid_angles_batch', lambda: BEC_helpers.calc_solid_angles_batch([constraints[:k] for k in range(1, n_constraints + 1)]))
+    run('sample_human_models_uniform', lambda: BEC_helpers.sample_human_models_uniform(constraints[:3], n_human_models))
+
+    particle_positions = BEC_helpers.sample_human_models_uniform([], n_particles)
+    run('Particles.update', lambda particles: particles.update(constraints), setup=lambda: pf.Particles(particle_positions))
+    run('Particles.calc_info_gain', lambda particles: particles.calc_info_gain(constraints[:3]), setup=lambda: pf.Particles(particle_positions))
+
+    # the remaining stages depend on sage
+    try:
+        from policy_summarization import BEC
+    except ImportError as e:
+        results['BEC.extract_constraints_policy'] = {'error': repr(e)}
+        results['obtain_summary_counterfactual'] = {'error': repr(e)}
+        return results
+
+    run('BEC.extract_constraints_policy', lambda: BEC.extract_constraints_policy((0, data_loc, 1, step_cost_flag)))
+
+    if summary:
+        def summary_iteration(inputs):
+            policy_constraints, min_subset_constraints_record, env_record, traj_record, traj_features_record, reward_record, mdp_features_record, consistent_state_count = inputs[0]
+            min_BEC_constraints, BEC_lengths_record = inputs[1]
+            BEC.obtain_summary_counterfactual(data_loc, 'proposed', min_subset_constraints_record, min_BEC_constraints, env_record, traj_record, mdp_features_record,
+                                              weights, step_cost_flag, pool, n_human_models, consistent_state_count, n_train_demos=1, prior=params['prior'])
+
+        def summary_setup():
+            base_constraints = BEC.extract_constraints(data_loc, 1, step_cost_flag, pool)
+            return base_constraints, BEC.extract_BEC_constraints(base_constraints[0], base_constraints[1], base_constraints[2], weights, step_cost_flag, pool)
+
+        run('obtain_summary_counterfactual', summary_iteration, setup=summary_setup, n_repeat=1)
+
+    return results
+
+def compare_results(baseline, candidate, tolerance=0.2, min_seconds=0.005):
+    '''
+    Return the (domain, stage, baseline seconds, candidate seconds) of every stage whose median time regressed by more than
+    tolerance (a proportion of the baseline) plus min_seconds (so that timer noise in the fastest stages isn't flagged),
+    and of stages that succeeded in the baseline but fail in the candidate
+    '''
+    regressions = []
+    for domain, stages in baseline['results'].items():
+        for stage, baseline_timing in stages.items():
+            candidate_timing = candidate['results'].get(domain, {}).get(stage)
+            if 'error' in baseline_timing or candidate_timing is None:
+                continue
+            if 'error' in candidate_timing:
+                regressions.append((domain, stage, baseline_timing['median'], None))
+            elif candidate_timing['median'] > (1 + tolerance) * baseline_timing['median'] + min_seconds:
+                regressions.append((domain, stage, baseline_timing['median'], candidate_timing['median']))
+
+    return regressions
+
+def print_comparison(baseline, candidate):
+    def format_median(timing):
+        return '{:.4f}'.format(timing['median']) if 'median' in timing else timing.get('error', 'n/a')[:12]
+
+    print('{:<16} {:<32} {:>12} {:>12} {:>8}'.format('domain', 'stage', 'baseline (s)', 'candidate (s)', 'ratio'))
+    for domain, stages in candidate['results'].items():
+        for stage, candidate_timing in stages.items():
+            baseline_timing = baseline['results'].get(domain, {}).get(stage, {})
+            if 'median' in baseline_timing and 'median' in candidate_timing:
+                ratio = '{:.2f}'.format(candidate_timing['median'] / max(baseline_timing['median'], 1e-12))
+            else:
+                ratio = ''
+            print('{:<16} {:<32} {:>12} {:>12} {:>8}'.format(domain, stage, format_median(baseline_timing), format_median(candidate_timing), ratio))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of the BEC teaching pipeline')
+    parser.add_argument('--domains', nargs='+', default=DOMAINS, choices=DOMAINS)
+    parser.add_argument('--output', default='benchmarks/results/latest.json', help='JSON file to write the timings to')
+    parser.add_argument('--compare', default=None, help='JSON file of baseline timings to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown of each stage relative to the baseline')
+    parser.add_argument('--min_seconds', type=float, default=0.005, help='allowed absolute slowdown of each stage (on top of the tolerance)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--n_cpu', type=int, default=os.cpu_count())
+    parser.add_argument('--skip_summary', action='store_true', help='skip the (slow) summary iteration')
+    args = parser.parse_args()
+
+    output = {
+        'metadata': {'code_version': stage_graph.lookup_code_version(['policy_summarization', 'simple_rl']), 'python': platform.python_version(),
+                     'numpy': np.__version__, 'platform': platform.platform(), 'seed': args.seed, 'repeat': args.repeat,
+                     'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'results': {}
+    }
+
+    with Pool(min(args.n_cpu, 64)) as pool:
+        for mdp_class in args.domains:
+            output['results'][mdp_class] = benchmark_domain(mdp_class, pool, repeat=args.repeat, seed=args.seed, summary=not args.skip_summary)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print('Saved the timings to {}'.format(args.output))
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+        print_comparison(baseline, output)
+        regressions = compare_results(baseline, output, tolerance=args.tolerance, min_seconds=args.min_seconds)
+        for domain, stage, baseline_seconds, candidate_seconds in regressions:
+            print('Regression in {} ({}): {:.4f} s -> {}'.format(stage, domain, baseline_seconds,
+                                                               'error' if candidate_seconds is None else '{:.4f} s'.format(candidate_seconds)))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -33,6 +33,9 @@ from simple_rl.utils import mdp_helpers
 import policy_summarization.BEC_helpers as BEC_helpers
 import policy_summarization.BEC_visualization as BEC_viz
 from policy_summarization import particle_filter as pf
+from policy_summarization import stage_graph
+from policy_summarization import env_catalog
+from policy_summarization import instrumentation
 from simple_rl.tasks.taxi import taxi_helpers
 import matplotlib as mpl
 mpl.rcParams['figure.facecolor'] = '1.0'
@@ -62,12 +65,29 @@ def generate_agent(mdp_class, data_loc, mdp_parameters, visualize=False):
         mdp_agent.reset()  # reset the current state to the initial state
         mdp_agent.visualize_interaction()
 
-def obtain_summary(mdp_class, data_loc, mdp_parameters, weights, step_cost_flag, summary_variant, pool, n_train_demos, BEC_depth, n_human_models, n_particles, prior, posterior, obj_func_proportion, hardcode_envs=False, visited_env_traj_idxs=[]):
+# the version of the code computing each stage. bump a stage's version when a change alters its result (e.g. a change
+# to how environments are solved or constraints are extracted) so that its artifacts and those downstream are recomputed
+STAGE_CODE_VERSIONS = {
+    'env_policies': 1,
+    'base_constraints': 1,
+    'BEC_constraints': 1,
+    'BEC_summary': 1,
+}
+
+def obtain_summary(mdp_class, data_loc, mdp_parameters, weights, step_cost_flag, summary_variant, pool, n_train_demos, BEC_depth, n_human_models, n_particles, prior, posterior, obj_func_proportion, hardcode_envs=False, visited_env_traj_idxs=[], n_envs_sampled=None):
+    # each stage is only (re)computed if its inputs, upstream stages, or the code have changed since its artifact was saved
+    stages = stage_graph.StageRunner(data_loc)
+    env_inputs = {'mdp_class': mdp_class, 'mdp_parameters': mdp_parameters, 'weights': weights, 'hardcode_envs': hardcode_envs, 'n_envs_sampled': n_envs_sampled}
+    # the environment policies are resumed from the files that exist, so those of stale inputs are moved aside
+    env_policies_paths = ['gt_policies', 'gt_policies_manifest.json', 'env_catalog.json']
+
     if hardcode_envs:
         # using 4 hardcoded environments
-        ps_helpers.obtain_env_policies(mdp_class, data_loc, np.expand_dims(weights, axis=0), mdp_parameters, pool, hardcode_envs=True)
+        stages.run('env_policies', lambda: ps_helpers.obtain_env_policies(mdp_class, data_loc, np.expand_dims(weights, axis=0), mdp_parameters, pool, hardcode_envs=True),
+                   inputs=env_inputs, owned_paths=env_policies_paths,
+                   code_version=STAGE_CODE_VERSIONS['env_policies'])
 
-        vi_traj_triplets = []
+        env_traj_pairs = []
         for i in range(4):
             env_filename = mp_helpers.lookup_env_filename(data_loc, i)
 
@@ -79,36 +99,38 @@ def obtain_summary(mdp_class, data_loc, mdp_parameters, weights, step_cost_flag,
             weights = mdp.weights
             trajectory = mdp_helpers.rollout_policy(mdp, agent)
 
-            vi_traj_triplets.append((i, agent, trajectory))
+            env_traj_pairs.append((i, trajectory))
+    elif n_envs_sampled is not None:
+        # only solve a random subset of the domain's environments (e.g. for domains too large to enumerate). the sampled
+        # codes are kept in the catalog and the draws are seeded, so rerunning resumes from the same subset. n_envs_sampled
+        # is part of the stage's key though, so changing it moves the previous subset aside and samples a new one
+        def sample_env_policies():
+            catalog = env_catalog.EnvCatalog(mdp_class, data_loc, np.expand_dims(weights, axis=0), mdp_parameters)
+            catalog.sample(n_envs_sampled - len(catalog), rng=random.Random(0))
+            catalog.materialize(pool)
+
+        stages.run('env_policies', sample_env_policies, inputs=env_inputs, owned_paths=env_policies_paths,
+                   code_version=STAGE_CODE_VERSIONS['env_policies'])
+        env_traj_pairs = None
     else:
-        ps_helpers.obtain_env_policies(mdp_class, data_loc, np.expand_dims(weights, axis=0), mdp_parameters, pool)
-
-    try:
-        with open('models/' + data_loc + '/base_constraints.pickle', 'rb') as f:
-            policy_constraints, min_subset_constraints_record, env_record, traj_record, traj_features_record, reward_record, mdp_features_record, consistent_state_count = pickle.load(f)
-    except:
-        if hardcode_envs:
-            # use demo BEC to extract constraints
-            policy_constraints, min_subset_constraints_record, env_record, traj_record, traj_features_record, reward_record, mdp_features_record, consistent_state_count = BEC.extract_constraints(data_loc, BEC_depth, step_cost_flag, pool, vi_traj_triplets=vi_traj_triplets, print_flag=True)
-        else:
-            # use policy BEC to extract constraints
-            policy_constraints, min_subset_constraints_record, env_record, traj_record, traj_features_record, reward_record, mdp_features_record, consistent_state_count = BEC.extract_constraints(data_loc, BEC_depth, step_cost_flag, pool, print_flag=True)
-        with open('models/' + data_loc + '/base_constraints.pickle', 'wb') as f:
-            pickle.dump((policy_constraints, min_subset_constraints_record, env_record, traj_record, traj_features_record, reward_record, mdp_features_record, consistent_state_count), f)
-
-    try:
-        with open('models/' + data_loc + '/BEC_constraints.pickle', 'rb') as f:
-            min_BEC_constraints, BEC_lengths_record = pickle.load(f)
-    except:
-        min_BEC_constraints, BEC_lengths_record = BEC.extract_BEC_constraints(policy_constraints, min_subset_constraints_record, env_record, weights, step_cost_flag, pool)
-
-        with open('models/' + data_loc + '/BEC_constraints.pickle', 'wb') as f:
-            pickle.dump((min_BEC_constraints, BEC_lengths_record), f)
-
-    try:
-        with open('models/' + data_loc + '/BEC_summary.pickle', 'rb') as f:
-            BEC_summary, visited_env_traj_idxs, particles = pickle.load(f)
-    except:
+        # obtain_env_policies() resumes from the environments that have already been solved
+        stages.run('env_policies', lambda: ps_helpers.obtain_env_policies(mdp_class, data_loc, np.expand_dims(weights, axis=0), mdp_parameters, pool),
+                   inputs=env_inputs, owned_paths=env_policies_paths,
+                   code_version=STAGE_CODE_VERSIONS['env_policies'])
+        env_traj_pairs = None
+
+    # use demo BEC (for the hardcoded environments) or policy BEC to extract constraints
+    policy_constraints, min_subset_constraints_record, env_record, traj_record, traj_features_record, reward_record, mdp_features_record, consistent_state_count = stages.run(
+        'base_constraints', lambda: BEC.extract_constraints(data_loc, BEC_depth, step_cost_flag, pool, env_traj_pairs=env_traj_pairs, print_flag=True, checkpoint_dir=stages.checkpoint_dir('base_constraints')),
+        inputs={'BEC_depth': BEC_depth, 'step_cost_flag': step_cost_flag}, depends_on=['env_policies'], artifact='base_constraints.pickle', code_version=STAGE_CODE_VERSIONS['base_constraints'],
+        validate=lambda result: len(result) == 8)
+
+    min_BEC_constraints, BEC_lengths_record = stages.run(
+        'BEC_constraints', lambda: BEC.extract_BEC_constraints(policy_constraints, min_subset_constraints_record, env_record, weights, step_cost_flag, pool),
+        inputs={'weights': weights, 'step_cost_flag': step_cost_flag}, depends_on=['base_constraints'], artifact='BEC_constraints.pickle', code_version=STAGE_CODE_VERSIONS['BEC_constraints'],
+        validate=lambda result: len(result) == 2)
+
+    def compute_summary():
         # SCOT_summary = BEC.obtain_SCOT_summaries(data_loc, summary_variant, min_BEC_constraints, BEC_lengths_record, min_subset_constraints_record, env_record, traj_record, weights, step_cost_flag)
         # initialize particle filter
         particle_positions = BEC_helpers.sample_human_models_uniform([], n_particles)
@@ -117,14 +139,14 @@ def obtain_summary(mdp_class, data_loc, mdp_parameters, weights, step_cost_flag,
         print(colored('entropy: {}'.format(particles.calc_entropy()), 'blue'))
 
         if summary_variant == 'particle_filter':
-            BEC_summary, visited_env_traj_idxs, particles = BEC.obtain_summary_particle_filter(data_loc, particles, summary_variant, min_subset_constraints_record,
+            BEC_summary, summary_visited_env_traj_idxs, particles = BEC.obtain_summary_particle_filter(data_loc, particles, summary_variant, min_subset_constraints_record,
                                            min_BEC_constraints, env_record, traj_record, mdp_features_record, weights, step_cost_flag, pool,
                                            n_human_models, consistent_state_count, visited_env_traj_idxs=visited_env_traj_idxs)
 
         elif summary_variant == 'proposed' or summary_variant == 'counterfactual_only':
-            BEC_summary, visited_env_traj_idxs = BEC.obtain_summary_counterfactual(data_loc, summary_variant, min_subset_constraints_record, min_BEC_constraints, env_record, traj_record, mdp_features_record, weights, step_cost_flag, pool, n_human_models, consistent_state_count, n_train_demos=n_train_demos, prior=prior, obj_func_proportion=obj_func_proportion, visited_env_traj_idxs=visited_env_traj_idxs)
+            BEC_summary, summary_visited_env_traj_idxs = BEC.obtain_summary_counterfactual(data_loc, summary_variant, min_subset_constraints_record, min_BEC_constraints, env_record, traj_record, mdp_features_record, weights, step_cost_flag, pool, n_human_models, consistent_state_count, n_train_demos=n_train_demos, prior=prior, obj_func_proportion=obj_func_proportion, visited_env_traj_idxs=visited_env_traj_idxs)
         elif summary_variant == 'feature_only' or summary_variant == 'baseline':
-            BEC_summary, visited_env_traj_idxs = BEC.obtain_summary(data_loc, summary_variant, min_BEC_constraints, BEC_lengths_record, min_subset_constraints_record, env_record, traj_record, weights, step_cost_flag, n_train_demos=n_train_demos, visited_env_traj_idxs=visited_env_traj_idxs)
+            BEC_summary, summary_visited_env_traj_idxs = BEC.obtain_summary(data_loc, summary_variant, min_BEC_constraints, BEC_lengths_record, min_subset_constraints_record, env_record, traj_record, weights, step_cost_flag, n_train_demos=n_train_demos, visited_env_traj_idxs=visited_env_traj_idxs)
         else:
             raise AssertionError("Unknown summary variant.")
 
@@ -134,9 +156,18 @@ def obtain_summary(mdp_class, data_loc, mdp_parameters, weights, step_cost_flag,
                 for summary in unit:
                     particles.update(summary[3])
 
-        if len(BEC_summary) > 0:
-            with open('models/' + data_loc + '/BEC_summary.pickle', 'wb') as f:
-                pickle.dump((BEC_summary, visited_env_traj_idxs, particles), f)
+        return BEC_summary, summary_visited_env_traj_idxs, particles
+
+    # the summary selection saves partial (summary, visited_env_traj_idxs) tuples along the way, which shouldn't be
+    # mistaken for a completed summary
+    BEC_summary, visited_env_traj_idxs, particles = stages.run(
+        'BEC_summary', compute_summary,
+        inputs={'summary_variant': summary_variant, 'n_train_demos': n_train_demos, 'n_human_models': n_human_models,
+                'n_particles': n_particles, 'prior': prior, 'obj_func_proportion': obj_func_proportion,
+                'visited_env_traj_idxs': visited_env_traj_idxs},
+        depends_on=['BEC_constraints'], artifact='BEC_summary.pickle', code_version=STAGE_CODE_VERSIONS['BEC_summary'], validate=lambda result: len(result) == 3 and len(result[0]) > 0)
+
+    stages.report()
 
     # BEC.visualize_summary(BEC_summary)
     #
@@ -954,7 +985,8 @@ def precompute_counterfactual_constraints(pool, data_loc, mdp_parameters, weight
         precompute = True
 
     if precompute:
-        sample_human_models = BEC_helpers.sample_human_models_uniform([], n_human_models_precomputed)
+        # the reference human models are saved so that they don't need to be regenerated during live sessions
+        sample_human_models, _ = BEC_helpers.load_precomputed_human_models(data_loc, n_human_models_precomputed)
 
         print("Precomputing counterfactual data for {} human models: ".format(n_human_models_precomputed))
         for model_idx, human_model in enumerate(sample_human_models):
@@ -972,9 +1004,25 @@ def precompute_counterfactual_constraints(pool, data_loc, mdp_parameters, weight
                  True) for i in range(n_processed_envs, len(traj_record))]
             _ = list(tqdm(pool.imap(BEC.compute_counterfactuals, args), total=len(args)))
 
+    # tabulate the minimal constraints, solid angles, and normalized constraint keys of every (model, env, traj) so that
+    # remedial demonstrations only need to union the constraints of the selected models online. tables built from a
+    # different set of reference human models (e.g. before the precomputed data was regenerated) are rebuilt
+    n_human_models = len(BEC_helpers.load_precomputed_human_models(data_loc, n_human_models_precomputed)[0])
+    args = [(data_loc, i, n_human_models_precomputed) for i in range(len(traj_record)) if
+            not BEC_helpers.is_precomputed_constraints_table_current(data_loc, i, n_human_models)]
+    if len(args) > 0:
+        print("Tabulating precomputed counterfactual constraints for {} environments: ".format(len(args)))
+        _ = list(tqdm(pool.imap(BEC_helpers.build_precomputed_constraints_table, args), total=len(args)))
+
 
 def run_scripts():
-    pool = Pool(min(params.n_cpu, 64))
+    # instrumentation must be enabled before the workers are created for them to record their spans as well
+    if params.instrumentation['enabled']:
+        instrumentation.enable('models/' + params.data_loc['BEC'] + '/instrumentation', profile_spans=params.instrumentation['profile_spans'])
+
+    # long-lived workers that keep the environments they're assigned cached across tasks and iterations. the pool is
+    # created before the environments are solved, so each worker's cache is filled lazily by its first tasks
+    pool = mp_helpers.AffinityPool(min(params.n_cpu, 64))
     os.makedirs('models/' + params.data_loc['base'], exist_ok=True)
     os.makedirs('models/' + params.data_loc['BEC'], exist_ok=True)
 
@@ -997,7 +1045,8 @@ def run_scripts():
     # b) obtain a BEC summary of the agent's policy
     BEC_summary, visited_env_traj_idxs, particles_summary = obtain_summary(params.mdp_class, params.data_loc['BEC'], params.mdp_parameters, params.weights['val'],
                             params.step_cost_flag, params.BEC['summary_variant'], pool, params.BEC['n_train_demos'], params.BEC['BEC_depth'],
-                            params.BEC['n_human_models'], params.BEC['n_particles'], params.prior, params.posterior, params.BEC['obj_func_proportion'], visited_env_traj_idxs=visited_env_traj_idxs)
+                            params.BEC['n_human_models'], params.BEC['n_particles'], params.prior, params.posterior, params.BEC['obj_func_proportion'], visited_env_traj_idxs=visited_env_traj_idxs,
+                            n_envs_sampled=params.BEC['n_envs_sampled'])
 
     # c) run through the closed-loop teaching framework
     simulate_teaching_loop(params.mdp_class, BEC_summary, visited_env_traj_idxs, particles_summary, pool, params.prior, params.BEC['n_particles'], params.BEC['n_human_models'], params.BEC['n_human_models_precomputed'], params.data_loc['BEC'], params.weights['val'], params.step_cost_flag, params.keys_map, err_ex, visualize_pf_transition=False)
@@ -1047,6 +1096,9 @@ def run_scripts():
     pool.close()
     pool.join()
 
+    if instrumentation.enabled():
+        instrumentation.report()
+
 if __name__ == "__main__":
     os.chdir('..')
     run_scripts()
\ No newline at end of file
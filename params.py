@@ -305,6 +305,9 @@ BEC = {
 
     'n_human_models_precomputed': 2500,         # number of human beliefs to precompute for future quick, real-time inference
 
+    'n_envs_sampled': None,                   # number of environments to randomly sample from the domain when it has too
+                                              # many to enumerate (all environments are solved if None)
+
 }
 
 data_loc = {
@@ -314,6 +317,13 @@ data_loc = {
 
 n_cpu = os.cpu_count()
 
+# opt-in timing instrumentation (see policy_summarization/instrumentation.py). a timing report is saved to
+# models/<data_loc>/instrumentation/ at the end of the run, along with cProfile dumps of the spans in profile_spans
+instrumentation = {
+    'enabled': False,
+    'profile_spans': [],                      # e.g. ['compute_counterfactuals', 'stage.BEC_summary']
+}
+
 # environment and trajectory indices of the tests used in Lee et al. 2022 Reasoning about Counterfactuals to Improve Human Inverse Reinforcement Learning
 test_env_traj_tracers = {
     'augmented_taxi2':
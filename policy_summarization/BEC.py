@@ -1,5 +1,6 @@
 import matplotlib.pyplot as plt
 from simple_rl.utils import mdp_helpers
+from simple_rl.utils.optimal_action_dag import OptimalActionDAG
 from simple_rl.agents import FixedPolicyAgent
 import policy_summarization.BEC_helpers as BEC_helpers
 import numpy as np
@@ -17,20 +18,21 @@ import policy_summarization.multiprocessing_helpers as mp_helpers
 from policy_summarization import policy_summarization_helpers as ps_helpers
 import sage.all
 import sage.geometry.polyhedron.base as Polyhedron
-from spherical_geometry import polygon as sph_polygon
 import policy_summarization.BEC_visualization as BEC_viz
 from policy_summarization import computational_geometry as cg
-from sklearn.metrics.pairwise import haversine_distances
 from policy_summarization import flask_user_study_utils as flask_utils
-import asyncio
-from tqdm import tqdm
+from policy_summarization import particle_filter as pf
+from policy_summarization import stage_graph
+from policy_summarization import instrumentation
 
+@mp_helpers.env_affinity(0)
+@instrumentation.instrumented()
 def extract_constraints_policy(args):
     env_idx, data_loc, BEC_depth, step_cost_flag = args
-    with open(mp_helpers.lookup_env_filename(data_loc, env_idx), 'rb') as f:
-        wt_vi_traj_env = pickle.load(f)
+    wt_vi_traj_env = mp_helpers.load_env(data_loc, env_idx)
 
-    mdp = wt_vi_traj_env[0][1].mdp
+    # the rollouts below update the MDP's current state, so the cached MDP (shared with this worker's other tasks) is copied
+    mdp = copy.deepcopy(wt_vi_traj_env[0][1].mdp)
     agent = FixedPolicyAgent(wt_vi_traj_env[0][1].policy)
     weights = mdp.weights
 
@@ -79,8 +81,11 @@ def extract_constraints_policy(args):
 
     return env_idx, traj_record, traj_features_record, policy_constraints, min_subset_constraints_record, reward_record, mdp_reward_features
 
+@mp_helpers.env_affinity(0)
+@instrumentation.instrumented()
 def extract_constraints_demonstration(args):
-    env_idx, vi, traj_opt, BEC_depth, step_cost_flag = args
+    env_idx, data_loc, traj_opt, BEC_depth, step_cost_flag = args
+    vi = mp_helpers.load_env(data_loc, env_idx)[0][1]
 
     min_subset_constraints_record = []    # minimum BEC constraints conveyed by a trajectory
     policy_constraints = []               # BEC constraints that define a policy (i.e. constraints arising from one action
@@ -89,7 +94,8 @@ def extract_constraints_demonstration(args):
     traj_features_record = []             # reward feature counts of each trajectory
     reward_record = []                    # the rewards associated with the optimal trajectories
 
-    mdp = vi.mdp
+    # the rollouts below update the MDP's current state, so the cached MDP (shared with this worker's other tasks) is copied
+    mdp = copy.deepcopy(vi.mdp)
     agent = FixedPolicyAgent(vi.policy)
     weights = mdp.weights
 
@@ -130,11 +136,15 @@ def extract_constraints_demonstration(args):
     return env_idx, traj_record, traj_features_record, policy_constraints, min_subset_constraints_record, reward_record, mdp_reward_features
 
 
-def extract_constraints(data_loc, BEC_depth, step_cost_flag, pool, vi_traj_triplets=None, print_flag=False):
+def extract_constraints(data_loc, BEC_depth, step_cost_flag, pool, env_traj_pairs=None, print_flag=False, checkpoint_dir=None):
     '''
     :param wt_vi_traj_candidates: Nested list of [weight, value iteration object, trajectory]
     :param weights (numpy array): Ground truth reward weights used by agent to derive its optimal policy
     :param step_cost_flag (bool): Indicates that the last weight element is a known step cost
+    :param env_traj_pairs: if provided, list of (environment index, demonstration) to extract demonstration-driven BEC
+    constraints from instead of policy-driven ones
+    :param checkpoint_dir: if provided, the constraints of each environment are checkpointed there so that an
+    interrupted extraction can be resumed
     :return: min_subset_constraints: List of constraints
 
     Summary: Obtain the minimum BEC constraints for each environment
@@ -151,12 +161,15 @@ def extract_constraints(data_loc, BEC_depth, step_cost_flag, pool, vi_traj_tripl
     n_envs = len(os.listdir('models/' + data_loc + '/gt_policies/'))
 
     print("Extracting the BEC constraints in each environment:")
-    if vi_traj_triplets is None:
+    if env_traj_pairs is None:
         # a) policy-driven BEC: generate constraints by considering the expected feature counts after taking one
         # suboptimal action in every possible state in the state space, then acting optimally afterward. see eq 13, 14
         # of Brown et al. 'Machine Teaching for Inverse Reinforcement Learning: Algorithms and Applications' 2019
         args = [(i, data_loc, BEC_depth, step_cost_flag) for i in range(n_envs)]
-        results = list(tqdm(pool.imap(extract_constraints_policy, args), total=len(args)))
+        if checkpoint_dir is not None:
+            results = list(tqdm(stage_graph.checkpointed_imap(pool, extract_constraints_policy, args, checkpoint_dir, range(n_envs)), total=len(args)))
+        else:
+            results = list(tqdm(pool.imap(extract_constraints_policy, args), total=len(args)))
 
         # determine whether this domain has a consistent set of states between constituent MDPs
         consistent_state_count = True
@@ -181,10 +194,14 @@ def extract_constraints(data_loc, BEC_depth, step_cost_flag, pool, vi_traj_tripl
         # b) demonstration-driven BEC: generate constraints by considering the expected feature counts after taking one
         # suboptimal action in every state along a trajectory (demonstration), then acting optimally afterward.
         # see eq 16 of Brown et al. 'Machine Teaching for Inverse Reinforcement Learning: Algorithms and Applications' 2019
-        # need to specify the environment idx, environment, and corresponding optimal trajectories (first, second, and
-        # third elements of vi_traj_triplet, respectively) that you want to extract constraints from
-        args = [(vi_traj_triplet[0], vi_traj_triplet[1], vi_traj_triplet[2], BEC_depth, step_cost_flag) for vi_traj_triplet in vi_traj_triplets]
-        results = list(tqdm(pool.imap(extract_constraints_demonstration, args), total=len(args)))
+        # need to specify the environment idx and corresponding optimal trajectories (first and second elements of
+        # env_traj_pair, respectively) that you want to extract constraints from. the environments themselves are loaded
+        # by the workers
+        args = [(env_traj_pair[0], data_loc, env_traj_pair[1], BEC_depth, step_cost_flag) for env_traj_pair in env_traj_pairs]
+        if checkpoint_dir is not None:
+            results = list(tqdm(stage_graph.checkpointed_imap(pool, extract_constraints_demonstration, args, checkpoint_dir, range(len(args))), total=len(args)))
+        else:
+            results = list(tqdm(pool.imap(extract_constraints_demonstration, args), total=len(args)))
 
         for result in results:
             env_record.append(result[0])
@@ -215,11 +232,15 @@ def extract_BEC_constraints(policy_constraints, min_subset_constraints_record, e
     if step_cost_flag:
         # calculate the 2D intersection between minimum constraints and L1 norm constraint for each demonstration
         min_subset_constraints_record_flattened = [item for sublist in min_subset_constraints_record for item in sublist]
-        for j, min_subset_constraints in enumerate(min_subset_constraints_record_flattened):
-            BEC_lengths_record.append(BEC_helpers.calculate_BEC_length(min_subset_constraints, weights, step_cost_flag)[0])
+        BEC_lengths_record = list(BEC_helpers.calculate_BEC_lengths_batch(min_subset_constraints_record_flattened, weights, step_cost_flag))
     else:
-        # calculate the solid angle between the minimum constraints for each demonstration
-        BEC_lengths_record = list(tqdm(pool.imap(BEC_helpers.calc_solid_angles, min_subset_constraints_record), total=len(min_subset_constraints_record)))
+        # calculate the solid angle between the minimum constraints for each demonstration (across all environments at
+        # once), then split the solid angles back up by environment
+        min_subset_constraints_record_flattened = [item for sublist in min_subset_constraints_record for item in sublist]
+        solid_angles = BEC_helpers.calc_solid_angles_batch(min_subset_constraints_record_flattened)
+
+        env_boundaries = np.cumsum([len(min_subset_constraints) for min_subset_constraints in min_subset_constraints_record])[:-1]
+        BEC_lengths_record = [list(env_solid_angles) for env_solid_angles in np.split(solid_angles, env_boundaries)]
 
     return min_BEC_constraints, BEC_lengths_record
 
@@ -289,8 +310,11 @@ def obtain_potential_summary_demos(BEC_lengths_record, n_demos, n_clusters, type
 
     return covering_demos_idxs
 
+@mp_helpers.env_affinity(2)
+@instrumentation.instrumented()
 def compute_counterfactuals(args):
     data_loc, model_idx, env_idx, w_human_normalized, env_filename, trajs_opt, particles, min_BEC_constraints_running, step_cost_flag, summary_len, variable_filter, mdp_features, consider_human_models_jointly = args
+    particles = pf.resolve_particles(particles)
 
     skip_env = False
 
@@ -299,8 +323,8 @@ def compute_counterfactuals(args):
         skip_env = True
 
     if not skip_env:
-        with open(env_filename, 'rb') as f:
-            wt_vi_traj_env = pickle.load(f)
+        # the cached environment is shared across this worker's tasks, so it's copied below before being modified
+        wt_vi_traj_env = mp_helpers.load_env_file(env_filename)
 
         agent = wt_vi_traj_env[0][1]
         weights = agent.mdp.weights
@@ -344,20 +368,19 @@ def compute_counterfactuals(args):
                 sas = traj_opt[sas_idx]
                 cur_state = sas[0]
 
-                # obtain all optimal trajectory rollouts according to the human's model (assuming that it's a reasonable policy that has converged)
-                human_opt_trajs = mdp_helpers.rollout_policy_recursive(vi_human.mdp, vi_human, cur_state, [])
+                # consider all optimal trajectory rollouts according to the human's model (assuming that it's a reasonable policy that has converged)
+                human_opt_trajs = OptimalActionDAG(vi_human.mdp, vi_human, cur_state)
 
                 cur_best_reward = float('-inf')
                 best_reward_features = []
                 best_human_traj = []
                 # select the human's possible trajectory that has the highest true reward (i.e. give the human's policy the benefit of the doubt)
-                for traj in human_opt_trajs:
+                traj = human_opt_trajs.best_trajectory(lambda s, a, s_prime, step: (mdp.gamma ** step * weights.dot(mdp.compute_reward_features(s, a, s_prime).T)).item())
+                if traj is not None:
                     mu_sb = mdp.accumulate_reward_features(traj, discount=True)  # the human and agent should be working with identical mdps
-                    reward_hyp = weights.dot(mu_sb.T)
-                    if reward_hyp > cur_best_reward:
-                        cur_best_reward = reward_hyp
-                        best_reward_features = mu_sb
-                        best_human_traj = traj
+                    cur_best_reward = weights.dot(mu_sb.T)
+                    best_reward_features = mu_sb
+                    best_human_traj = traj
 
                 # # todo: for testing how much computation and time I save by not doing a recursive rollout
                 # best_human_traj = mdp_helpers.rollout_policy(vi_human.mdp, vi_human, cur_state, [])
@@ -412,12 +435,15 @@ def compute_counterfactuals(args):
     else:
         return info_gain_env, overlap_in_opt_and_counterfactual_traj_env
 
+@mp_helpers.env_affinity(0)
+@instrumentation.instrumented()
 def combine_limiting_constraints_IG(args):
     '''
     Summary: combine the most limiting constraints across all potential human models for each potential demonstration
     '''
     env_idx, sample_human_model_idxs, data_loc, curr_summary_len, weights, step_cost_flag, variable_filter,\
     mdp_features, trajs_opt, min_BEC_constraints_running, particles, compute_IG_flag, compute_n_diff_constraints_flag = args
+    particles = pf.resolve_particles(particles)
 
     info_gains_record = []
     min_env_constraints_record = []
@@ -432,19 +458,32 @@ def combine_limiting_constraints_IG(args):
         human_counterfactual_trajs = [[] for i in range(len(min_env_constraints_record))]
         # print("skipping environment " + str(env_idx) + " because it contains a variable you don't want to convey")
     else:
-        # jointly consider the constraints generated by suboptimal trajectories by each human model
-        for model_idx in sample_human_model_idxs:
-            with open('models/' + data_loc + '/counterfactual_data_' + str(curr_summary_len) + '/model' + str(
-                    model_idx) + '/cf_data_env' + str(
-                env_idx).zfill(5) + '.pickle', 'rb') as f:
-                constraints_env = pickle.load(f)
-            all_env_constraints.append(constraints_env)
+        precomputed_table = None
+        if curr_summary_len == 'precomputed':
+            precomputed_table = BEC_helpers.load_precomputed_constraints_table(data_loc, env_idx)
+
+        if precomputed_table is not None:
+            # the minimal constraints of each human model were tabulated offline, so they only need to be unioned
+            n_trajs = len(precomputed_table['keys'][0])
+        else:
+            # jointly consider the constraints generated by suboptimal trajectories by each human model
+            for model_idx in sample_human_model_idxs:
+                with open('models/' + data_loc + '/counterfactual_data_' + str(curr_summary_len) + '/model' + str(
+                        model_idx) + '/cf_data_env' + str(
+                    env_idx).zfill(5) + '.pickle', 'rb') as f:
+                    constraints_env = pickle.load(f)
+                all_env_constraints.append(constraints_env)
+
+            all_env_constraints_joint = [list(itertools.chain.from_iterable(i)) for i in zip(*all_env_constraints)]
+            n_trajs = len(all_env_constraints_joint)
 
-        all_env_constraints_joint = [list(itertools.chain.from_iterable(i)) for i in zip(*all_env_constraints)]
         # for each possible demonstration in each environment, find the non-redundant constraints across all human models
         # and use that to calculate the information gain for that demonstration
-        for traj_idx in range(len(all_env_constraints_joint)):
-            if len(all_env_constraints_joint[traj_idx]) > 1:
+        for traj_idx in range(n_trajs):
+            if precomputed_table is not None:
+                min_env_constraints = BEC_helpers.union_precomputed_constraints(precomputed_table, sample_human_model_idxs,
+                                                                                traj_idx, weights, step_cost_flag)
+            elif len(all_env_constraints_joint[traj_idx]) > 1:
                 min_env_constraints = BEC_helpers.remove_redundant_constraints(all_env_constraints_joint[traj_idx],
                                                                                weights, step_cost_flag)
             else:
@@ -531,80 +570,12 @@ def combine_limiting_constraints_IG(args):
 
 def overlap_demo_BEC_and_human_posterior(args):
     '''
-    Summary: combine the most limiting constraints across all potential human models for each potential demonstration
+    Summary: for each possible demonstration in an environment, find the overlap in area between the spherical polygon
+    comprising the posterior (human's model) and the counterfactual constraints created by the demonstration
     '''
     env_idx, n_sample_human_models, min_subset_constraints, prior, posterior, data_loc, counterfactual_folder_idx, weights, step_cost_flag = args
 
-    human_model = posterior
-    human_model = BEC_helpers.remove_redundant_constraints(human_model, weights, step_cost_flag)
-
-    BEC_areas = []
-
-    # obtain spherical polygon comprising the posterior (human's model)
-    posterior_ieqs = BEC_helpers.constraints_to_halfspace_matrix_sage(human_model)
-    posterior_poly = Polyhedron.Polyhedron(ieqs=posterior_ieqs)
-
-    posterior_spherical_polygon_vertices = np.array(BEC_helpers.obtain_sph_polygon_vertices(posterior_poly, add_noise=True))  # add noise to help smooth calculation
-    if len(posterior) > 1:
-        # taking the mean of vertices only works if they're not all lying on a shared plane (else there is
-        # ambiguity)
-        inside_posterior_sph_polygon = cg.compute_average_point(posterior_spherical_polygon_vertices)
-    else:
-        # if there is only a single constraint/plane (i.e. a half sphere), you can simply take the plane normal
-        # as the inside point (with some noise to prevent out of domain issues with trig function)
-        inside_posterior_sph_polygon = human_model[0][0] + np.random.sample(3) * 0.001
-
-    posterior_spherical_polygon_vertices = cg.sort_points_by_angle(posterior_spherical_polygon_vertices, inside_posterior_sph_polygon)
-    posterior_sph_polygon = sph_polygon.SphericalPolygon(posterior_spherical_polygon_vertices, inside=tuple(inside_posterior_sph_polygon))
-
-    # if abs(BEC_helpers.calc_solid_angles([human_model])[0] - posterior_sph_polygon.area()) > 1 or np.isnan(posterior_sph_polygon.area()):
-    #     raise AssertionError("Too much deviation in prior BEC areas")
-
-    # for each possible demonstration in each environment, find the overlap in area between the spherical polygon
-    # comprising the posterior and the counterfactual constraints created by the demonstration
-    for constraint_idx, constraints in enumerate(min_subset_constraints):
-        constraints_copy = constraints.copy()
-
-        if len(constraints_copy) == 0:
-            print(colored("NO CONSTRAINTS", 'red'))
-            BEC_areas.append(posterior_sph_polygon.area())
-        else:
-            if len(constraints_copy) > 1:
-                constraints_copy = BEC_helpers.remove_redundant_constraints(constraints_copy,
-                                                                            weights, step_cost_flag)
-
-            traj_ieqs = BEC_helpers.constraints_to_halfspace_matrix_sage(constraints_copy)
-            traj_poly = Polyhedron.Polyhedron(ieqs=traj_ieqs)  # automatically finds the minimal H-representation
-            traj_spherical_polygon_vertices = np.array(BEC_helpers.obtain_sph_polygon_vertices(traj_poly,
-                                                                                               add_noise=True))  # add noise to help smooth calculation
-            if len(constraints_copy) > 1:
-                # taking the mean of vertices only works if they're not all lying on a shared plane (else there is
-                # ambiguity)
-                inside_traj_sph_polygon = cg.compute_average_point(traj_spherical_polygon_vertices)
-            else:
-                # if there is only a single constraint/plane (i.e. a half sphere), you can simply take the plane normal
-                # as the inside point (with some noise to prevent out of domain issues with trig function)
-                inside_traj_sph_polygon = constraints_copy[0][0] + np.random.sample(3) * 0.001
-
-            traj_spherical_polygon_vertices = cg.sort_points_by_angle(traj_spherical_polygon_vertices,
-                                                                      inside_traj_sph_polygon)
-            traj_sph_polygon = sph_polygon.SphericalPolygon(traj_spherical_polygon_vertices,
-                                                        inside=tuple(inside_traj_sph_polygon))
-
-            # if abs(BEC_helpers.calc_solid_angles([constraints_copy])[0] - traj_sph_polygon.area()) > 1  or np.isnan(traj_sph_polygon.area()):
-            #     print('env: {}, traj: {}'.format(env_idx, traj_idx))
-            #     raise AssertionError("Too much deviation in trajectory BEC areas")
-
-            if traj_sph_polygon.intersects_poly(posterior_sph_polygon):
-                intersected_polygon = traj_sph_polygon.intersection(posterior_sph_polygon)
-                intersected_area = intersected_polygon.area()
-                if intersected_area > 1.05 * min(traj_sph_polygon.area(), posterior_sph_polygon.area()):
-                    # the intersection shouldn't be larger than the smaller of the two constituent areas
-                    print('Env: {}, constraint idx: {}'.format(env_idx, constraint_idx))
-                    raise AssertionError("bad intersection")
-                BEC_areas.append(traj_sph_polygon.intersection(posterior_sph_polygon).area())
-            else:
-                BEC_areas.append(0)
+    BEC_areas = BEC_helpers.calc_cone_intersection_areas(posterior, min_subset_constraints)
 
     return BEC_areas
 
@@ -1056,6 +1027,11 @@ def obtain_summary_particle_filter(data_loc, particles, summary_variant, min_sub
         info_gains_record = []
         overlap_in_opt_and_counterfactual_traj_record = []
 
+        # publish this iteration's particles once for all of the pool tasks below. the shared memory is released as soon
+        # as the last of them has completed. the tasks measure information gain with the particles, so the running BEC
+        # constraints aren't sent along with them
+        shared_particles = pf.SharedParticles(particles)
+
         print("Length of summary: {}".format(len(summary)))
         with open('models/' + data_loc + '/demo_gen_log.txt', 'a') as myfile:
             myfile.write('Length of summary: {}\n'.format(len(summary)))
@@ -1076,13 +1052,13 @@ def obtain_summary_particle_filter(data_loc, particles, summary_variant, min_sub
             cf_data_dir = 'models/' + data_loc + '/counterfactual_data_' + str(len(summary)) + '/model' + str(model_idx)
             os.makedirs(cf_data_dir, exist_ok=True)
             if consider_human_models_jointly:
-                args = [(data_loc, model_idx, i, human_model, mp_helpers.lookup_env_filename(data_loc, env_record[i]), traj_record[i], particles, min_BEC_constraints_running, step_cost_flag, len(summary), variable_filter, mdp_features_record[i], consider_human_models_jointly) for i in range(len(traj_record))]
+                args = [(data_loc, model_idx, i, human_model, mp_helpers.lookup_env_filename(data_loc, env_record[i]), traj_record[i], shared_particles.handle, [], step_cost_flag, len(summary), variable_filter, mdp_features_record[i], consider_human_models_jointly) for i in range(len(traj_record))]
 
                 info_gain_envs = list(tqdm(pool.imap(compute_counterfactuals, args), total=len(args)))
 
                 info_gains_record.append(info_gain_envs)
             else:
-                args = [(data_loc, model_idx, i, human_model, mp_helpers.lookup_env_filename(data_loc, env_record[i]), traj_record[i], particles, min_BEC_constraints_running, step_cost_flag, len(summary), variable_filter, mdp_features_record[i], consider_human_models_jointly) for i in range(len(traj_record))]
+                args = [(data_loc, model_idx, i, human_model, mp_helpers.lookup_env_filename(data_loc, env_record[i]), traj_record[i], shared_particles.handle, [], step_cost_flag, len(summary), variable_filter, mdp_features_record[i], consider_human_models_jointly) for i in range(len(traj_record))]
                 info_gain_envs, overlap_in_opt_and_counterfactual_traj_env = zip(*pool.imap(compute_counterfactuals, tqdm(args), total=len(args)))
 
                 info_gains_record.append(info_gain_envs)
@@ -1106,6 +1082,8 @@ def obtain_summary_particle_filter(data_loc, particles, summary_variant, min_sub
 
         # no need to continue search for demonstrations if none of them will improve the human's understanding
         if no_info_flag:
+            shared_particles.close()
+
             # if no variables had been filtered out, then there are no more informative demonstrations to be found
             if not np.any(variable_filter):
                 break
@@ -1126,10 +1104,11 @@ def obtain_summary_particle_filter(data_loc, particles, summary_variant, min_sub
         #  see obtain_summary_counterfactual() for a more updated version
         print("Combining the most limiting constraints across human models:")
         args = [(i, range(len(sample_human_models)), data_loc, len(summary), weights, step_cost_flag, variable_filter, mdp_features_record[i],
-                 traj_record[i], min_BEC_constraints_running, particles, True, False) for
+                 traj_record[i], [], shared_particles.handle, True, False) for
                 i in range(len(traj_record))]
         info_gains_record, min_env_constraints_record, n_diff_constraints_record, overlap_in_opt_and_counterfactual_traj_avg, human_counterfactual_trajs = zip(
             *pool.imap(combine_limiting_constraints_IG, tqdm(args)))
+        shared_particles.close()
 
         # the possibility that no demonstration provides information gain must be checked for again,
         # in case all limiting constraints involve a masked variable and shouldn't be considered for demonstration yet
@@ -1274,77 +1253,25 @@ def obtain_summary_particle_filter(data_loc, particles, summary_variant, min_sub
 
     return summary, visited_env_traj_idxs, particles
 
-# @socketio.on('connect')
-# def handle_connect():
-#     print("Client connected")
-#
-# @socketio.on('disconnect')
-# def handle_disconnect():
-#     print("Client disconnected")
-
-async def process_and_send_progress(stop_event, pool, args, results_queue):
-    from app import socketio
-
-    arg_length = len(args)
-
-    results = []
-    for i, result in enumerate(tqdm(pool.imap(combine_limiting_constraints_IG, args), total=arg_length)):
-        progress = int(100 * (i + 1) / arg_length)
-        socketio.emit('message', f"{progress}%")
-        results.append(result)
-
-    info_gains_record, min_env_constraints_record, n_diff_constraints_record, overlap_in_opt_and_counterfactual_traj_avg, human_counterfactual_trajs = zip(*results)
-
-    # Add the results to the shared queue
-    await results_queue.put((info_gains_record, min_env_constraints_record, n_diff_constraints_record, overlap_in_opt_and_counterfactual_traj_avg, human_counterfactual_trajs))
-
-    # Notify the client that progress updates are complete
-    socketio.emit('message', "Progress updates complete")
-
-    # Set the stop event to signal the server to stop
-    stop_event.set()
-
-async def combine_limiting_constraints_IG_async(pool, args):
-    # Create an event to signal when the server should stop
-    stop_event = asyncio.Event()
-
-    # Create a queue to store the results
-    results_queue = asyncio.Queue()
-
-    # Start processing and sending progress updates
-    asyncio.ensure_future(process_and_send_progress(stop_event, pool, args, results_queue))
-
-    print("WebSocket server started")
-
-    # Wait for the event to be set (indicating the server should stop)
-    await stop_event.wait()
-
-    print("WebSocket server closed")
-
-    # Get the processed values a and b from the shared queue
-    info_gains_record, min_env_constraints_record, n_diff_constraints_record, overlap_in_opt_and_counterfactual_traj_avg, human_counterfactual_trajs = await results_queue.get()
-
-    return info_gains_record, min_env_constraints_record, n_diff_constraints_record, overlap_in_opt_and_counterfactual_traj_avg, human_counterfactual_trajs
-
-
-def obtain_remedial_demonstrations(data_loc, pool, particles, n_human_models, BEC_constraints, min_subset_constraints_record, env_record, traj_record, traj_features_record, previous_demonstrations, visited_env_traj_idxs, variable_filter, mdp_features_record, consistent_state_count, weights, step_cost_flag, type='training', info_gain_tolerance=0.01, consider_human_models_jointly=True, n_human_models_precomputed=0, fallback='particle_filter', web_based=False):
+def obtain_remedial_demonstrations(data_loc, pool, particles, n_human_models, BEC_constraints, min_subset_constraints_record, env_record, traj_record, traj_features_record, previous_demonstrations, visited_env_traj_idxs, variable_filter, mdp_features_record, consistent_state_count, weights, step_cost_flag, type='training', info_gain_tolerance=0.01, consider_human_models_jointly=True, n_human_models_precomputed=0, fallback='particle_filter', web_based=False, job_manager=None, job_id=None):
+    '''
+    Summary: select a remedial demonstration (or test) that addresses the BEC constraints the human misunderstood. When
+    web_based, the limiting constraints can be combined through a remedial_jobs.RemedialJobManager (using its shared
+    worker pool instead of pool) so that progress is streamed to the participant identified by job_id and the job can be
+    cancelled if they disconnect, in which case concurrent.futures.CancelledError is raised
+    '''
     remedial_demonstrations = []
 
     remedial_demonstration_selected = False
 
     if n_human_models_precomputed != 0:
         # rely on constraints generated via sampled human models from cached particle filter
-        sample_human_models_ref = BEC_helpers.sample_human_models_uniform([], n_human_models_precomputed)
-
         while not remedial_demonstration_selected:
             # the human's incorrect response does not have a direct counterexample, and thus you need to use information gain to obtain the next example
             sample_human_models, model_weights = BEC_helpers.sample_human_models_pf(particles, n_human_models)
 
             # obtain the indices of the reference human models (that have precomputed constraints) that are closest to the sampled human models
-            sample_human_models_ref_latllong = cg.cart2latlong(np.array(sample_human_models_ref).squeeze())
-            sample_human_models_latlong = cg.cart2latlong(np.array(sample_human_models).squeeze())
-            distances = haversine_distances(sample_human_models_latlong, sample_human_models_ref_latllong)
-            min_model_idxs = np.argmin(distances, axis=1)
+            min_model_idxs = BEC_helpers.find_nearest_precomputed_human_models(data_loc, n_human_models_precomputed, sample_human_models)
 
             print("Combining the most limiting constraints across human models:")
             args = [(i, min_model_idxs, data_loc, 'precomputed', weights, step_cost_flag, variable_filter,
@@ -1352,9 +1279,10 @@ def obtain_remedial_demonstrations(data_loc, pool, particles, n_human_models, BE
                      traj_record[i], [], None, False, False) for
                     i in range(len(traj_record))]
 
-            if web_based:
-                # create a socket connection to provide real-time updates to the client on the progress of combining limiting constraints
-                info_gains_record, min_env_constraints_record, n_diff_constraints_record, overlap_in_opt_and_counterfactual_traj_avg, human_counterfactual_trajs = asyncio.run(combine_limiting_constraints_IG_async(pool, args))
+            if web_based and job_manager is not None:
+                # provide real-time updates to the client on the progress of combining limiting constraints
+                info_gains_record, min_env_constraints_record, n_diff_constraints_record, overlap_in_opt_and_counterfactual_traj_avg, human_counterfactual_trajs = zip(
+                    *job_manager.run(combine_limiting_constraints_IG, args, job_id=job_id))
             else:
                 info_gains_record, min_env_constraints_record, n_diff_constraints_record, overlap_in_opt_and_counterfactual_traj_avg, human_counterfactual_trajs = zip(
                     *tqdm(pool.imap(combine_limiting_constraints_IG, args), total=len(args)))
@@ -1404,6 +1332,9 @@ def obtain_remedial_demonstrations(data_loc, pool, particles, n_human_models, BE
             sample_human_models, model_weights = BEC_helpers.sample_human_models_pf(particles, n_human_models)
             info_gains_record = []
 
+            # publish the particles once for all of the pool tasks below
+            shared_particles = pf.SharedParticles(particles)
+
             for model_idx, human_model in enumerate(sample_human_models):
                 print(colored('Model #: {}'.format(model_idx), 'red'))
                 print(colored('Model val: {}'.format(human_model), 'red'))
@@ -1417,7 +1348,7 @@ def obtain_remedial_demonstrations(data_loc, pool, particles, n_human_models, BE
                 os.makedirs(cf_data_dir, exist_ok=True)
 
                 args = [(data_loc, model_idx, i, human_model, mp_helpers.lookup_env_filename(data_loc, env_record[i]),
-                         traj_record[i], particles, [], step_cost_flag, None,
+                         traj_record[i], shared_particles.handle, [], step_cost_flag, None,
                          variable_filter, mdp_features_record[i], consider_human_models_jointly) for i in
                         range(len(traj_record))]
 
@@ -1426,6 +1357,8 @@ def obtain_remedial_demonstrations(data_loc, pool, particles, n_human_models, BE
                 # [# of human models][# of environments]
                 info_gains_record.append(info_gain_envs)
 
+            shared_particles.close()
+
             # make an entry for each environment (averaging over the human models)
             expected_info_gain_envs = []
             for human_model_idx in range(len(info_gains_record)):
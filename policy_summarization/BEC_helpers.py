@@ -10,9 +10,14 @@ import difflib
 from sklearn import metrics
 import itertools
 import pickle
+import os
+from functools import lru_cache
+from sklearn.neighbors import BallTree
 from policy_summarization import probability_utils as p_utils
 
 from policy_summarization import computational_geometry as cg
+from policy_summarization import multiprocessing_helpers as mp_helpers
+from policy_summarization import instrumentation
 
 def normalize_constraints(constraints):
     '''
@@ -81,6 +86,7 @@ def clean_up_constraints(constraints, weights, step_cost_flag):
 
     return min_subset_constraints
 
+@instrumentation.instrumented()
 def remove_redundant_constraints_lp(constraints, weights, step_cost_flag):
     '''
     Summary: Remove redundant constraint that do not change the underlying BEC region (without consideration for
@@ -396,6 +402,48 @@ def calculate_BEC_length(constraints, weights, step_cost_flag, feature=None):
 
     return total_intersection_length, polygon_hull_constraint_idxs
 
+def calculate_BEC_lengths_batch(constraint_sets, weights, step_cost_flag, feature=None):
+    '''
+    :param constraint_sets (list of lists of constraints, corresponding to the A of the form Ax >= 0): constraints that
+        comprise the BEC region of each demonstration
+    :param weights (numpy array): Ground truth reward weights used by agent to derive its optimal policy
+    :param step_cost_flag (bool): Indicates that the last weight element is a known step cost
+    :param feature (int): Whether the intersection length should be computed across all feature dimensions (default)
+           or only across a specified feature dimension
+    :return: total_intersection_lengths (numpy array): total length of the intersection between each BEC region and
+        the L1 constraints
+
+    Summary: Batched equivalent of calculate_BEC_length. Each L1 constraint line segment is clipped directly against
+    the half-planes of every constraint set at once, without computing the polygon hull of the BEC region
+    '''
+    if not step_cost_flag:
+        raise Exception("Not yet implemented.")
+
+    # halfspace matrix (Ax <= b) of each constraint set, padded with trivially satisfied rows of zeros. the L1 boundary
+    # constraints of constraints_to_halfspace_matrix() are unnecessary as the L1 constraints lie within them
+    max_n_constraints = max([len(constraint_set) for constraint_set in constraint_sets] + [1])
+    A = np.zeros((len(constraint_sets), max_n_constraints, 2))
+    b = np.zeros((len(constraint_sets), max_n_constraints))
+    for set_idx, constraint_set in enumerate(constraint_sets):
+        if len(constraint_set) > 0:
+            constraints_stacked = np.vstack(constraint_set)
+            A[set_idx, :len(constraint_set), :] = -constraints_stacked[:, 0:2]
+            b[set_idx, :len(constraint_set)] = constraints_stacked[:, 2] * weights[0, -1]
+
+    # L1 constraints in 2D
+    L1_constraints = np.array([[[-1 + abs(weights[0, -1]), 0], [0, 1 - abs(weights[0, -1])]], [[0, 1 - abs(weights[0, -1])], [1 - abs(weights[0, -1]), 0]],
+                      [[1 - abs(weights[0, -1]), 0], [0, -1 + abs(weights[0, -1])]], [[0, -1 + abs(weights[0, -1])], [-1 + abs(weights[0, -1]), 0]]])
+
+    t_enter, t_exit = cg.clip_segments_by_halfplanes(L1_constraints, A, b)
+
+    if feature is None:
+        L1_constraint_lengths = np.linalg.norm(L1_constraints[:, 1, :] - L1_constraints[:, 0, :], axis=1)
+    else:
+        # limit the computed length to only the dimension corresponding to the desired feature
+        L1_constraint_lengths = abs(L1_constraints[:, 1, feature] - L1_constraints[:, 0, feature])
+
+    return np.sum(np.maximum(t_exit - t_enter, 0) * L1_constraint_lengths, axis=1)
+
 def compute_BEC_midpt(constraints, weights, step_cost_flag):
     '''
     :param constraints (list of constraints, corresponding to the A of the form Ax >= 0): constraints that comprise the
@@ -575,6 +623,46 @@ def obtain_sph_polygon_vertices(polyhedron, add_noise=False):
 
     return spherical_polygon_vertices
 
+@instrumentation.instrumented()
+def calc_solid_angles_batch(constraint_sets, max_chunk_size=100000):
+    '''
+    Summary: Calculate the solid angle of the spherical polygon defined by each of the (ragged) constraint sets at once.
+    Constraint sets with the same number of constraints are stacked and evaluated together in chunks of at most
+    max_chunk_size (number of constraint pairs x number of constraints) elements
+
+    :return: solid_angles (numpy array)
+    '''
+    solid_angles = np.empty(len(constraint_sets))
+    n_constraints_record = np.array([len(constraint_set) for constraint_set in constraint_sets])
+
+    for n_constraints in np.unique(n_constraints_record):
+        set_idxs = np.where(n_constraints_record == n_constraints)[0]
+        if n_constraints == 0:
+            # no constraints, so the full sphere
+            solid_angles[set_idxs] = 4 * np.pi
+            continue
+
+        constraints_stacked = np.array([np.vstack(constraint_sets[set_idx]) for set_idx in set_idxs], dtype=float)
+
+        chunk_size = max(1, int(max_chunk_size / (n_constraints ** 3)))
+        for chunk_start in range(0, len(set_idxs), chunk_size):
+            chunk = slice(chunk_start, chunk_start + chunk_size)
+            solid_angles[set_idxs[chunk]] = cg.cone_solid_angles(constraints_stacked[chunk])
+
+    return solid_angles
+
+def calc_cone_intersection_areas(constraints, constraint_sets):
+    '''
+    Summary: Calculate the area of the intersection between the spherical polygon defined by constraints and each of
+    the spherical polygons defined by constraint_sets (e.g. the BEC of every trajectory in an environment)
+
+    The intersection of two polyhedral cones is itself a polyhedral cone, so the area of the overlap is simply the
+    solid angle of the cone defined by the stacked constraints
+    '''
+    stacked_constraint_sets = [list(constraints) + list(constraint_set) for constraint_set in constraint_sets]
+
+    return list(calc_solid_angles_batch(stacked_constraint_sets))
+
 def sample_human_models_random(constraints, n_models):
     '''
     Summary: sample representative weights that the human could currently attribute to the agent accordingly to a
@@ -886,6 +974,151 @@ def sample_human_models_uniform(constraints, n_models):
 
     return sample_human_models
 
+@lru_cache(maxsize=None)
+def load_precomputed_human_models(data_loc, n_human_models_precomputed):
+    '''
+    Summary: load the reference human models that counterfactual constraints are precomputed for, along with a BallTree
+    (haversine metric) built over them for nearest neighbor queries. The reference models and tree are generated and
+    saved next to counterfactual_data_precomputed the first time they're needed, and are cached per process thereafter
+    '''
+    filename = 'models/' + data_loc + '/counterfactual_data_precomputed_human_models.pickle'
+
+    if os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            n_human_models, sample_human_models_ref, sample_human_models_ref_tree = pickle.load(f)
+
+        if n_human_models == n_human_models_precomputed:
+            return sample_human_models_ref, sample_human_models_ref_tree
+
+        print(colored('Regenerating the reference human models (requested {} but found {})'.format(n_human_models_precomputed, n_human_models), 'red'))
+
+    sample_human_models_ref = sample_human_models_uniform([], n_human_models_precomputed)
+    sample_human_models_ref_latlong = cg.cart2latlong(np.array(sample_human_models_ref).squeeze(axis=1))
+    sample_human_models_ref_tree = BallTree(sample_human_models_ref_latlong, metric='haversine')
+
+    os.makedirs('models/' + data_loc, exist_ok=True)
+    with open(filename, 'wb') as f:
+        pickle.dump((n_human_models_precomputed, sample_human_models_ref, sample_human_models_ref_tree), f)
+
+    return sample_human_models_ref, sample_human_models_ref_tree
+
+def find_nearest_precomputed_human_models(data_loc, n_human_models_precomputed, sample_human_models):
+    '''
+    Summary: obtain the indices of the reference human models (that have precomputed constraints) that are closest to
+    each of the sampled human models
+    '''
+    _, sample_human_models_ref_tree = load_precomputed_human_models(data_loc, n_human_models_precomputed)
+
+    sample_human_models_latlong = cg.cart2latlong(np.array(sample_human_models).reshape(-1, 3))
+    min_model_idxs = sample_human_models_ref_tree.query(sample_human_models_latlong, k=1, return_distance=False)[:, 0]
+
+    return min_model_idxs
+
+def constraint_keys(constraints, decimals=5):
+    '''
+    Summary: hashable keys of the (L2) normalized constraints, such that constraints that are equal up to a positive
+    scaling share a key
+    '''
+    return [tuple(np.round(constraint.flatten() / np.linalg.norm(constraint), decimals)) for constraint in constraints]
+
+@mp_helpers.env_affinity(1)
+def build_precomputed_constraints_table(args):
+    '''
+    Summary: consolidate the counterfactual constraints precomputed by every reference human model for an environment
+    into a single table holding each (model, trajectory)'s minimal constraints, their solid angle, and their normalized
+    constraint keys so that the constraints across models can later simply be unioned
+    '''
+    data_loc, env_idx, n_human_models_precomputed = args
+
+    # generate_equidistributed_points_on_sphere() can return slightly fewer models than requested, so only the models
+    # that counterfactuals were actually precomputed for are tabulated
+    n_human_models = len(load_precomputed_human_models(data_loc, n_human_models_precomputed)[0])
+
+    constraints_table = []
+    for model_idx in range(n_human_models):
+        with open('models/' + data_loc + '/counterfactual_data_precomputed/model' + str(model_idx) + '/cf_data_env' + str(
+                env_idx).zfill(5) + '.pickle', 'rb') as f:
+            constraints_env = pickle.load(f)
+        # the constraints of each trajectory were already reduced to their minimal H-representation by
+        # BEC.compute_counterfactuals()
+        constraints_table.append(constraints_env)
+
+    solid_angles_table = calc_solid_angles_batch(list(itertools.chain.from_iterable(constraints_table)))
+    solid_angles_table = solid_angles_table.reshape(n_human_models, -1)
+    keys_table = [[constraint_keys(constraints) for constraints in constraints_env] for constraints_env in constraints_table]
+
+    precomputed_table = {'constraints': constraints_table, 'solid_angles': solid_angles_table, 'keys': keys_table,
+                         'n_human_models': n_human_models}
+
+    filename = mp_helpers.lookup_precomputed_constraints_table_filename(data_loc, env_idx)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wb') as f:
+        pickle.dump(precomputed_table, f)
+
+    return precomputed_table
+
+def is_precomputed_constraints_table_current(data_loc, env_idx, n_human_models):
+    '''
+    Summary: check whether an environment's table of precomputed counterfactual constraints exists and was built from
+    the current set of n_human_models reference human models (i.e. the precomputed data hasn't since been regenerated)
+    '''
+    precomputed_table = load_precomputed_constraints_table(data_loc, env_idx)
+
+    return precomputed_table is not None and precomputed_table.get('n_human_models') == n_human_models
+
+def load_precomputed_constraints_table(data_loc, env_idx):
+    '''
+    Summary: load the table of precomputed counterfactual constraints for an environment if it has been built
+    '''
+    filename = mp_helpers.lookup_precomputed_constraints_table_filename(data_loc, env_idx)
+    if not os.path.exists(filename):
+        return None
+
+    n_misses = _load_precomputed_constraints_table_file.cache_info().misses
+    precomputed_table = _load_precomputed_constraints_table_file(filename, os.stat(filename).st_mtime_ns)
+    instrumentation.record_cache('precomputed_constraints_table_cache', _load_precomputed_constraints_table_file.cache_info().misses == n_misses)
+
+    return precomputed_table
+
+@lru_cache(maxsize=256)
+def _load_precomputed_constraints_table_file(filename, mtime_ns):
+    # the tables are cached per (long-lived) worker process. keying on the modification time as well ensures that a
+    # table that has since been rebuilt is reloaded rather than served stale
+    with instrumentation.span('pickle_load'), open(filename, 'rb') as f:
+        precomputed_table = pickle.load(f)
+
+    return precomputed_table
+
+def union_precomputed_constraints(precomputed_table, model_idxs, traj_idx, weights, step_cost_flag):
+    '''
+    Summary: union the minimal constraints that the selected human models precomputed for a trajectory. Duplicates are
+    removed using the normalized constraint keys, and redundant constraints only need to be pruned when more than one
+    distinct constraint set contributes to the union
+    '''
+    union_constraints = {}
+    distinct_key_sets = set()
+    for model_idx in np.unique(model_idxs):
+        keys = precomputed_table['keys'][model_idx][traj_idx]
+        if len(keys) > 0:
+            distinct_key_sets.add(frozenset(keys))
+        for key, constraint in zip(keys, precomputed_table['constraints'][model_idx][traj_idx]):
+            union_constraints.setdefault(key, constraint)
+
+    union_constraints = list(union_constraints.values())
+    if len(distinct_key_sets) > 1:
+        facet_mask = None
+        if not step_cost_flag:
+            facet_mask = cg.cone_facet_mask(np.array(union_constraints).reshape(len(union_constraints), -1))
+        if facet_mask is not None:
+            union_constraints = [constraint for constraint, facet in zip(union_constraints, facet_mask) if facet]
+        elif step_cost_flag:
+            # constraints are pruned with respect to their intersection with the L1 constraints, as the online path does
+            union_constraints = remove_redundant_constraints(union_constraints, weights, step_cost_flag)
+        else:
+            union_constraints, _ = remove_redundant_constraints_lp(union_constraints, weights, step_cost_flag)
+
+    return union_constraints
+
 def selectKcities(n, weights, k):
     '''
     Based off of the solution provided below for the K Centers Problem
@@ -916,17 +1149,16 @@ def selectKcities(n, weights, k):
 
 def calculate_information_gain(previous_constraints, new_constraints, weights, step_cost_flag):
     if len(previous_constraints) > 0 and len(new_constraints) > 0:
+        # redundant constraints don't affect the solid angle, so there's no need to find the minimal set of constraints
         hypothetical_constraints = new_constraints.copy()
         hypothetical_constraints.extend(previous_constraints)
-        hypothetical_constraints = remove_redundant_constraints(hypothetical_constraints, weights, step_cost_flag)
 
-        old_BEC = calc_solid_angles([previous_constraints])[0]
-        new_BEC = calc_solid_angles([hypothetical_constraints])[0]
+        old_BEC, new_BEC = calc_solid_angles_batch([previous_constraints, hypothetical_constraints])
 
         ig = old_BEC / new_BEC
     elif len(new_constraints) > 0:
         old_BEC = 4 * np.pi
-        new_BEC = calc_solid_angles([new_constraints])[0]
+        new_BEC = calc_solid_angles_batch([new_constraints])[0]
 
         ig = old_BEC / new_BEC
     else:
@@ -1004,19 +1236,25 @@ def optimize_information_gain(particles, best_env_idxs, best_traj_idxs, min_mode
 
     for env_position, best_env_idx_candidate in enumerate(best_env_idxs):
         # for each candidate environment
+        precomputed_table = load_precomputed_constraints_table(data_loc, best_env_idx_candidate)
+
         for model_position, model_idx in enumerate(min_model_idxs):
             # calculate an expected information gain using each human model and its associated probability
-            with open('models/' + data_loc + '/counterfactual_data_precomputed/model' + str(
-                    model_idx) + '/cf_data_env' + str(
-                best_env_idx_candidate).zfill(5) + '.pickle', 'rb') as f:
-                constraints_env = pickle.load(f)
+            if precomputed_table is not None:
+                # the precomputed constraints are already minimal
+                min_env_constraints = precomputed_table['constraints'][model_idx][best_traj_idxs[env_position]]
+            else:
+                with open('models/' + data_loc + '/counterfactual_data_precomputed/model' + str(
+                        model_idx) + '/cf_data_env' + str(
+                    best_env_idx_candidate).zfill(5) + '.pickle', 'rb') as f:
+                    constraints_env = pickle.load(f)
 
                 if len(constraints_env[best_traj_idxs[env_position]]) > 1:
                     min_env_constraints = remove_redundant_constraints(constraints_env[best_traj_idxs[env_position]], weights, step_cost_flag)
                 else:
                     min_env_constraints = constraints_env[best_traj_idxs[env_position]]
 
-                information_gains[env_position] += model_weights[model_position] * particles.calc_info_gain(min_env_constraints)
+            information_gains[env_position] += model_weights[model_position] * particles.calc_info_gain(min_env_constraints)
 
     if type == 'training':
         # provide the easiest for a remedial demonstration
@@ -167,6 +167,147 @@ def compute_average_point(points):
     average_point = points.mean(axis=0)
     return average_point / np.linalg.norm(average_point)
 
+def spherical_polygon_areas(vertices, n_vertices):
+    '''
+    Areas of a batch of convex spherical polygons given their vertices (unit vectors) in order around each polygon.
+    Each polygon is split into a fan of spherical triangles about its first vertex, and the solid angle of each
+    triangle is calculated using the Van Oosterom-Strackee formula (The Solid Angle of a Plane Triangle, 1983)
+
+    :param vertices: (n_polygons, max_n_vertices, 3) array of ordered vertices, padded at the end of each polygon
+    :param n_vertices: number of (non-padded) vertices of each polygon
+    '''
+    a = vertices[:, np.newaxis, 0, :]
+    b = vertices[:, 1:-1, :]
+    c = vertices[:, 2:, :]
+
+    numerator = abs(np.sum(np.cross(b, c) * a, axis=2))
+    denominator = 1 + np.sum(b * a, axis=2) + np.sum(c * a, axis=2) + np.sum(b * c, axis=2)
+    triangle_areas = 2 * np.arctan2(numerator, denominator)
+
+    # only consider the triangles formed by the non-padded vertices of each polygon
+    valid_triangles = np.arange(triangle_areas.shape[1]) < (n_vertices[:, np.newaxis] - 2)
+
+    return np.sum(np.where(valid_triangles, triangle_areas, 0), axis=1)
+
+def _degenerate_cone_solid_angle(normals, rank):
+    '''
+    Solid angle of the polyhedral cone {x : normals x >= 0} when the (unit) normals don't span all three dimensions
+    '''
+    if rank == 0:
+        return 4 * np.pi
+    elif rank == 1:
+        # all normals are parallel, yielding either a hemisphere or a great circle (if any two normals are opposing)
+        if np.all(normals.dot(normals[0]) > 0):
+            return 2 * np.pi
+        return 0.
+
+    # all normals lie in a shared plane, yielding a lune with vertices along the normal of that plane. its area is
+    # twice the angle of the feasible wedge, which is pi minus the smallest arc containing all of the normals
+    _, _, vh = np.linalg.svd(normals)
+    normals_2d = normals.dot(vh[:2].T)
+    angles = np.sort(np.arctan2(normals_2d[:, 1], normals_2d[:, 0]))
+    gaps = np.diff(np.append(angles, angles[0] + 2 * np.pi))
+    smallest_arc = 2 * np.pi - np.max(gaps)
+
+    return 2 * max(np.pi - smallest_arc, 0.)
+
+def cone_solid_angles(normals, eps=1e-8):
+    '''
+    Solid angles of a batch of polyhedral cones {x : normals[i] x >= 0}, i.e. the areas of the corresponding spherical
+    polygons on the unit 2-sphere
+
+    The vertices of each spherical polygon are the feasible directions along which two of the constraint planes
+    intersect. Since redundant constraints simply don't contribute any feasible vertices, the normals don't need to
+    be a minimal H-representation (e.g. the constraints of two cones can be stacked to find the area of their
+    intersection)
+
+    :param normals: (n_cones, n_constraints, 3) array of constraint normals. Cones with fewer constraints can be padded
+        with zero normals
+    '''
+    norms = np.linalg.norm(normals, axis=2, keepdims=True)
+    normals = np.where(norms > eps, normals / np.where(norms > eps, norms, 1), 0)
+    solid_angles = np.zeros(normals.shape[0])
+
+    # cones whose normals don't span all three dimensions are hemispheres, lunes or degenerate
+    singular_values = np.linalg.svd(normals, compute_uv=False)
+    ranks = np.sum(singular_values > eps * np.maximum(singular_values[:, :1], eps), axis=1)
+    for cone_idx in np.where(ranks < 3)[0]:
+        cone_normals = normals[cone_idx][norms[cone_idx, :, 0] > eps]
+        solid_angles[cone_idx] = _degenerate_cone_solid_angle(cone_normals, ranks[cone_idx])
+
+    pointed = np.where(ranks == 3)[0]
+    if len(pointed) == 0:
+        return solid_angles
+    normals = normals[pointed]
+
+    # pairwise intersections of the constraint planes (in both directions) are candidate vertices
+    idxs_i, idxs_j = np.triu_indices(normals.shape[1], k=1)
+    candidates = np.cross(normals[:, idxs_i], normals[:, idxs_j])
+    candidate_norms = np.linalg.norm(candidates, axis=2, keepdims=True)
+    candidates = candidates / np.where(candidate_norms > eps, candidate_norms, 1)
+    candidates = np.concatenate((candidates, -candidates), axis=1)
+    candidate_norms = np.concatenate((candidate_norms, candidate_norms), axis=1)[:, :, 0]
+
+    feasible = (candidate_norms > eps) & np.all(np.einsum('ijk,ilk->ijl', candidates, normals) >= -eps, axis=2)
+    n_vertices = np.sum(feasible, axis=1)
+
+    # order the vertices around an interior point of each (convex) spherical polygon, placing infeasible candidates
+    # at the end. duplicate vertices (i.e. where more than two constraint planes intersect) simply contribute
+    # triangles with no area
+    centers = np.sum(candidates * feasible[:, :, np.newaxis], axis=1)
+    centers = centers / np.maximum(np.linalg.norm(centers, axis=1, keepdims=True), eps)
+    helpers = np.eye(3)[np.argmin(abs(centers), axis=1)]
+    basis_u = np.cross(centers, helpers)
+    basis_u = basis_u / np.maximum(np.linalg.norm(basis_u, axis=1, keepdims=True), eps)
+    basis_v = np.cross(centers, basis_u)
+    angles = np.arctan2(np.einsum('ijk,ik->ij', candidates, basis_v), np.einsum('ijk,ik->ij', candidates, basis_u))
+    angles[~feasible] = np.inf
+    order = np.argsort(angles, axis=1)
+    vertices = np.take_along_axis(candidates, order[:, :, np.newaxis], axis=1)
+
+    # cones that are empty or degenerate (i.e. a ray or a planar wedge) have fewer than three vertices
+    areas = spherical_polygon_areas(vertices, n_vertices)
+    solid_angles[pointed] = np.where(n_vertices >= 3, areas, 0.)
+
+    return solid_angles
+
+def cone_solid_angle(normals, eps=1e-8):
+    '''
+    Solid angle of the polyhedral cone {x : normals x >= 0} (see cone_solid_angles())
+    '''
+    return cone_solid_angles(normals[np.newaxis], eps=eps)[0]
+
+def cone_facet_mask(normals, eps=1e-8, tol=1e-6):
+    '''
+    Indicate which constraints of a pointed polyhedral cone {x : normals x >= 0} define one of its facets, i.e. belong
+    to its minimal H-representation. Each facet (i.e. edge of the spherical polygon) is bounded by two distinct
+    vertices, while a redundant constraint is active at one vertex at most
+
+    Returns None if the cone isn't pointed (or is empty), in which case the minimal H-representation should be found
+    using an LP or polyhedron library instead
+    '''
+    normals = normals / np.linalg.norm(normals, axis=1, keepdims=True)
+    if np.linalg.matrix_rank(normals, tol=eps) < 3:
+        return None
+
+    idxs_i, idxs_j = np.triu_indices(normals.shape[0], k=1)
+    candidates = np.cross(normals[idxs_i], normals[idxs_j])
+    candidate_norms = np.linalg.norm(candidates, axis=1)
+    candidates = candidates[candidate_norms > eps] / candidate_norms[candidate_norms > eps, np.newaxis]
+    candidates = np.vstack((candidates, -candidates))
+
+    vertices = candidates[np.all(candidates.dot(normals.T) >= -tol, axis=1)]
+    if len(vertices) == 0:
+        return None
+    # merge duplicate vertices (i.e. where more than two constraint planes intersect)
+    distances = np.linalg.norm(vertices[:, np.newaxis] - vertices[np.newaxis], axis=2)
+    vertices = vertices[~np.any(np.tril(distances <= 1e-5, k=-1), axis=1)]
+    if len(vertices) < 3:
+        return None
+
+    n_active_vertices = np.sum(abs(vertices.dot(normals.T)) <= tol, axis=0)
+
+    return n_active_vertices >= 2
 
 '''
 2D polar geometry
@@ -311,6 +452,39 @@ def cyrus_beck_2D(polygon, lines):
 
     return clipped_lines
 
+def clip_segments_by_halfplanes(segments, A, b):
+    '''
+    :param segments (numpy array of shape (n_segments, 2, 2)): line segments [[x1, y1], [x2, y2]] to clip
+    :param A, b (numpy arrays of shapes (n_sets, n_halfplanes, 2) and (n_sets, n_halfplanes)): a batch of half-plane
+        sets of the form Ax <= b. Sets with fewer half-planes can be padded with rows of zeros in both A and b
+    :return: t_enter, t_exit (numpy arrays of shape (n_sets, n_segments)): the portion along each segment (P0 + t(P1 - P0))
+        that lies within the intersection of each set of half-planes. segments that don't intersect have t_enter > t_exit
+
+    Summary: Run the Cyrus Beck algorithm for a batch of line segments directly against the half-planes (rather than
+    the edges of the convex polygon that they form, which would first require the polygon's vertices)
+    '''
+    P0 = segments[:, 0, :]
+    P1_P0 = segments[:, 1, :] - segments[:, 0, :]
+
+    # A(P0 + t(P1 - P0)) <= b  ->  t * denominator <= numerator
+    denominator = np.einsum('ijk,lk->ijl', A, P1_P0)
+    numerator = b[:, :, np.newaxis] - np.einsum('ijk,lk->ijl', A, P0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = numerator / denominator
+
+    # t value for exiting the polygon
+    t_exit = np.min(np.where(denominator > 0, t, 1.), axis=1, initial=1.)
+    # t value for entering the polygon
+    t_enter = np.max(np.where(denominator < 0, t, 0.), axis=1, initial=0.)
+
+    # segments that are parallel to and outside of a half-plane don't intersect at all
+    outside = np.any((denominator == 0) & (numerator < 0), axis=1)
+    t_enter[outside] = 1.
+    t_exit[outside] = 0.
+
+    return t_enter, t_exit
+
 def compute_lengths(lines, query_dim=None):
     lengths = np.zeros(len(lines))
     n = 0
@@ -0,0 +1,135 @@
+import copy
+import dill as pickle
+import json
+import os
+import random
+from collections import OrderedDict
+
+from policy_summarization import policy_summarization_helpers as ps_helpers
+from policy_summarization import multiprocessing_helpers as mp_helpers
+from policy_summarization import stage_graph
+
+class EnvCatalog():
+    '''
+    Environments of a domain that are only materialized (i.e. solved and saved to models/<data_loc>/gt_policies/) when
+    they are first needed, for domains whose 2^k codes are too many to enumerate. Environments are identified by their
+    codes, which are assigned contiguous environment indices in the order that they join the catalog (recorded in
+    env_catalog.json), so the rest of the pipeline (e.g. BEC.extract_constraints(), summary and test selection) can run
+    unchanged over a sampled or streaming subset of the code space
+
+    :param cache_size: maximum number of solved environments (weights, value iteration, trajectory, ...) kept in memory
+    '''
+    def __init__(self, mdp_class, data_loc, wt_candidates, mdp_parameters, hardcode_envs=False, cache_size=64):
+        self.mdp_class = mdp_class
+        self.data_loc = data_loc
+        self.wt_candidates = wt_candidates
+        self.mdp_parameters = mdp_parameters
+        self.hardcode_envs = hardcode_envs
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+        self.code_length = ps_helpers.lookup_mdp_code_length(mdp_class, mdp_parameters, hardcode_envs)
+        self.catalog_filename = 'models/' + data_loc + '/env_catalog.json'
+
+        self.codes = []
+        if os.path.exists(self.catalog_filename):
+            with open(self.catalog_filename, 'r') as f:
+                catalog = json.load(f)
+            if catalog['mdp_class'] == mdp_class and catalog['code_length'] == self.code_length:
+                self.codes = catalog['codes']
+        elif os.path.exists('models/' + data_loc + '/gt_policies/'):
+            # environments solved by enumerating the code space (see obtain_env_policies()) are indexed in the order of
+            # itertools.product(), which the catalog continues from
+            n_solved_envs = 0
+            while os.path.exists(mp_helpers.lookup_env_filename(data_loc, n_solved_envs)):
+                n_solved_envs += 1
+            self.codes = [ps_helpers.lookup_mdp_code(env_idx, self.code_length) for env_idx in range(n_solved_envs)]
+        self.env_idxs = {tuple(code): env_idx for env_idx, code in enumerate(self.codes)}
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def n_codes(self):
+        return 2 ** self.code_length
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.catalog_filename), exist_ok=True)
+        stage_graph.atomic_json_dump({'mdp_class': self.mdp_class, 'code_length': self.code_length, 'codes': self.codes},
+                                     self.catalog_filename)
+
+    def add(self, codes):
+        '''
+        Add codes to the catalog (without solving them), returning their environment indices
+        '''
+        env_idxs = []
+        for code in codes:
+            code = [int(bit) for bit in code]
+            if len(code) != self.code_length:
+                raise ValueError("Expected a code of length {}, got {}".format(self.code_length, code))
+            if tuple(code) not in self.env_idxs:
+                self.env_idxs[tuple(code)] = len(self.codes)
+                self.codes.append(code)
+            env_idxs.append(self.env_idxs[tuple(code)])
+        self.save()
+
+        return env_idxs
+
+    def lookup_env_idx(self, code):
+        return self.add([code])[0]
+
+    def sample(self, n_envs, rng=None):
+        '''
+        Add n_envs codes drawn uniformly at random (without replacement) from the codes that aren't yet in the catalog,
+        returning their environment indices. The code space is never enumerated
+        '''
+        rng = random.Random() if rng is None else rng
+
+        n_envs = min(n_envs, self.n_codes - len(self.codes))
+        env_idxs = []
+        while len(env_idxs) < n_envs:
+            code = ps_helpers.lookup_mdp_code(rng.randrange(self.n_codes), self.code_length)
+            if tuple(code) not in self.env_idxs:
+                env_idxs.extend(self.add([code]))
+
+        return env_idxs
+
+    def stream(self, rng=None):
+        '''
+        Yield (environment index, solved environment) for new uniformly sampled codes until the code space is exhausted
+        '''
+        while len(self.codes) < self.n_codes:
+            env_idx = self.sample(1, rng=rng)[0]
+            yield env_idx, self[env_idx]
+
+    def materialize(self, pool, env_idxs=None):
+        '''
+        Solve the catalog's environments (or those up to the largest of env_idxs) that haven't been solved yet, in parallel
+        '''
+        n_envs = len(self.codes) if env_idxs is None else max(env_idxs) + 1
+        ps_helpers.obtain_env_policies(self.mdp_class, self.data_loc, self.wt_candidates, self.mdp_parameters, pool,
+                                       hardcode_envs=self.hardcode_envs, mdp_codes=self.codes[:n_envs])
+
+    def __getitem__(self, env_idx):
+        '''
+        The (weights, value iteration, trajectory, mdp parameters) records of an environment, which is solved if it hasn't
+        been yet. The returned objects are shared and should be deep copied before being modified
+        '''
+        if env_idx in self.cache:
+            self.cache.move_to_end(env_idx)
+            return self.cache[env_idx]
+
+        filename = mp_helpers.lookup_env_filename(self.data_loc, env_idx)
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                wt_vi_traj_env = pickle.load(f)
+        else:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            wt_vi_traj_env = ps_helpers.solve_policy((env_idx, self.codes[env_idx], self.mdp_class, self.hardcode_envs,
+                                                      copy.deepcopy(self.mdp_parameters), self.wt_candidates, self.data_loc))
+
+        self.cache[env_idx] = wt_vi_traj_env
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return wt_vi_traj_env
@@ -2,6 +2,7 @@ import difflib
 import dill as pickle
 import policy_summarization.multiprocessing_helpers as mp_helpers
 from simple_rl.utils import mdp_helpers
+from simple_rl.utils.optimal_action_dag import OptimalActionDAG, contains_action_seq
 
 def normalize_trajectories(trajectory, actions, trajectory_counterfactual, actions_counterfactual):
     '''
@@ -111,6 +112,13 @@ def obtain_constraint(data_loc, mdp_parameters, opt_traj, opt_traj_features):
 
     return constraint
 
+def is_optimal_action_seq(mdp_dict, action_seq):
+    '''
+    Summary: whether a sequence of actions (e.g. a human's answer to a test) is one of the optimal trajectories of an
+    mdp_dict produced by extract_mdp_dict()
+    '''
+    return contains_action_seq(mdp_dict['opt_actions_dag'], action_seq)
+
 def extract_mdp_dict(vi, mdp, optimal_traj, mdp_dict, data_loc, element=-1, test_difficulty='none', env_traj_idxs=None, variable_filter=None, constraints=None):
     '''
     Extract the MDP information from a demonstration / test tuple (e.g. to be later put into a json)
@@ -183,13 +191,9 @@ def extract_mdp_dict(vi, mdp, optimal_traj, mdp_dict, data_loc, element=-1, test
     # or if it's a test demonstration whose normalized trajectory should be shown (-2), or a diagnostic test (-3)
     mdp_dict['tag'] = element
 
-    # also obtain all possible optimal trajectories if value iteration object is provided
-    all_opt_trajs = mdp_helpers.rollout_policy_recursive(mdp, vi, optimal_traj[0][0], [])
-    # extract all of the actions
-    all_opt_actions = []
-    for opt_traj in all_opt_trajs:
-        all_opt_actions.append([sas[1] for sas in opt_traj])
-    mdp_dict['all_opt_actions'] = all_opt_actions
+    # also store all possible optimal trajectories, compactly as a graph of the optimal actions (see
+    # is_optimal_action_seq() for checking whether a sequence of actions is optimal)
+    mdp_dict['opt_actions_dag'] = OptimalActionDAG(mdp, vi, optimal_traj[0][0]).to_dict()
 
     # create placeholders for normalized trajectories actions (for user study)
     mdp_dict['normalized_opt_actions'] = []
@@ -0,0 +1,205 @@
+'''
+Opt-in timing instrumentation of the BEC pipeline. Named spans record the wall and CPU time and the number of calls of
+the hot paths (e.g. value iteration, constraint extraction, redundancy removal, solid angles, pickle I/O, particle
+updates, and pool dispatch), and counters record events such as cache hits. Instrumentation is disabled (and nearly free)
+unless enable() is called or the BEC_INSTRUMENTATION_DIR environment variable is set.
+
+Each process (including pool workers, which inherit the setting) periodically saves its statistics to the run directory,
+and report() aggregates them into a per-run timing report. Spans named in profile_spans are additionally run under
+cProfile, with the stats dumped to the run directory (e.g. for inspection with pstats or snakeviz)
+'''
+
+import cProfile
+import functools
+import glob
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from multiprocessing import util
+
+RUN_DIR_VARIABLE = 'BEC_INSTRUMENTATION_DIR'
+PROFILE_SPANS_VARIABLE = 'BEC_PROFILE_SPANS'
+
+class _State():
+    def __init__(self):
+        self.run_dir = os.environ.get(RUN_DIR_VARIABLE)
+        self.profile_spans = set(filter(None, os.environ.get(PROFILE_SPANS_VARIABLE, '').split(',')))
+        self.flush_interval = 1.
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.spans = defaultdict(lambda: {'calls': 0, 'wall': 0., 'cpu': 0.})
+        self.counters = defaultdict(int)
+        self.depth = 0
+        self.n_profiles = 0
+        self.last_flush = time.time()
+        self.finalizer = None
+
+_state = _State()
+
+def enabled():
+    return _state.run_dir is not None
+
+def enable(run_dir, profile_spans=(), flush_interval=1.):
+    '''
+    Start recording spans and counters in this process and in any process (e.g. pool worker) created afterward
+
+    :param run_dir: directory that each process's statistics (and any cProfile dumps) are saved to. Statistics from a
+        previous run in the same directory are cleared
+    :param profile_spans: names of the spans to run under cProfile
+    '''
+    os.makedirs(run_dir, exist_ok=True)
+    for filename in glob.glob(os.path.join(run_dir, 'stats_*.json')):
+        os.remove(filename)
+
+    os.environ[RUN_DIR_VARIABLE] = run_dir
+    os.environ[PROFILE_SPANS_VARIABLE] = ','.join(profile_spans)
+    _state.run_dir = run_dir
+    _state.profile_spans = set(profile_spans)
+    _state.flush_interval = flush_interval
+    _state.reset()
+
+def disable():
+    flush()
+    os.environ.pop(RUN_DIR_VARIABLE, None)
+    os.environ.pop(PROFILE_SPANS_VARIABLE, None)
+    _state.run_dir = None
+
+def _current_state():
+    # forked processes inherit the statistics of their parent, which they shouldn't report again
+    if _state.pid != os.getpid():
+        _state.reset()
+    if _state.finalizer is None and _state.run_dir is not None:
+        _state.finalizer = util.Finalize(_state, flush, exitpriority=10)
+
+    return _state
+
+@contextmanager
+def span(name):
+    '''
+    Record the wall and CPU time of the enclosed block under name
+    '''
+    if _state.run_dir is None:
+        yield
+        return
+
+    state = _current_state()
+    profiler = None
+    if name in state.profile_spans:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    state.depth += 1
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        record = state.spans[name]
+        record['calls'] += 1
+        record['wall'] += time.perf_counter() - wall_start
+        record['cpu'] += time.process_time() - cpu_start
+        state.depth -= 1
+
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(state.run_dir, '{}_{}_{}.prof'.format(name, os.getpid(), state.n_profiles)))
+            state.n_profiles += 1
+
+        if state.depth == 0 and time.time() - state.last_flush > state.flush_interval:
+            flush()
+
+def instrumented(name=None):
+    '''
+    Decorator recording each call of a function as a span (named after the function by default)
+    '''
+    def decorator(func):
+        span_name = func.__qualname__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _state.run_dir is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+def count(name, n=1):
+    if _state.run_dir is not None:
+        _current_state().counters[name] += n
+
+def record_cache(name, hit):
+    '''
+    Record a cache lookup, from which report() computes the cache's hit rate
+    '''
+    count(name + '.hits' if hit else name + '.misses')
+
+def flush():
+    '''
+    Save this process's statistics to the run directory
+    '''
+    if _state.run_dir is None or _state.pid != os.getpid():
+        return
+
+    filename = os.path.join(_state.run_dir, 'stats_{}.json'.format(os.getpid()))
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump({'spans': _state.spans, 'counters': _state.counters}, f)
+    os.replace(tmp_filename, filename)
+    _state.last_flush = time.time()
+
+def aggregate(run_dir=None):
+    '''
+    Combine the statistics saved by each process of a run
+    '''
+    run_dir = _state.run_dir if run_dir is None else run_dir
+    spans = defaultdict(lambda: {'calls': 0, 'wall': 0., 'cpu': 0.})
+    counters = defaultdict(int)
+
+    for filename in sorted(glob.glob(os.path.join(run_dir, 'stats_*.json'))):
+        with open(filename, 'r') as f:
+            stats = json.load(f)
+        for name, record in stats['spans'].items():
+            for key, value in record.items():
+                spans[name][key] += value
+        for name, value in stats['counters'].items():
+            counters[name] += value
+
+    cache_hit_rates = {}
+    for name in counters:
+        if name.endswith('.hits') or name.endswith('.misses'):
+            cache = name.rsplit('.', 1)[0]
+            hits, misses = counters.get(cache + '.hits', 0), counters.get(cache + '.misses', 0)
+            cache_hit_rates[cache] = hits / (hits + misses) if hits + misses > 0 else None
+
+    return {'spans': dict(spans), 'counters': dict(counters), 'cache_hit_rates': cache_hit_rates}
+
+def report(run_dir=None, print_report=True):
+    '''
+    Aggregate the statistics of a run, save them to timing_report.json in the run directory, and print a summary. Wall
+    and CPU times are summed over processes (so the CPU time of spans run by pool workers can exceed the run's duration)
+    '''
+    run_dir = _state.run_dir if run_dir is None else run_dir
+    flush()
+    stats = aggregate(run_dir)
+
+    with open(os.path.join(run_dir, 'timing_report.json'), 'w') as f:
+        json.dump(stats, f, indent=2)
+
+    if print_report:
+        print('{:<48} {:>8} {:>12} {:>12} {:>12}'.format('span', 'calls', 'wall (s)', 'cpu (s)', 'wall/call (s)'))
+        for name, record in sorted(stats['spans'].items(), key=lambda item: -item[1]['wall']):
+            print('{:<48} {:>8} {:>12.2f} {:>12.2f} {:>12.4f}'.format(name, record['calls'], record['wall'], record['cpu'],
+                                                                      record['wall'] / max(record['calls'], 1)))
+        for name, value in sorted(stats['counters'].items()):
+            print('{:<48} {:>8}'.format(name, value))
+        for name, hit_rate in sorted(stats['cache_hit_rates'].items()):
+            print('{:<48} {:>8}'.format(name + ' hit rate', 'n/a' if hit_rate is None else '{:.1%}'.format(hit_rate)))
+
+    return stats
@@ -1,4 +1,9 @@
 import os
+import dill as pickle
+from collections import deque
+from functools import lru_cache
+from multiprocessing import Pool
+from policy_summarization import instrumentation
 
 def lookup_env_filename(data_loc, env_idx):
     save_dir = 'models/' + data_loc + '/gt_policies/'
@@ -11,3 +16,104 @@ def list_env_filenames(data_loc):
     filenames = sorted(os.listdir(save_dir))
 
     return filenames
+
+def lookup_precomputed_constraints_table_filename(data_loc, env_idx):
+    save_dir = 'models/' + data_loc + '/counterfactual_data_precomputed_table/'
+    filename = save_dir + 'cf_table_env' + str(env_idx).zfill(5) + '.pickle'
+
+    return filename
+
+def load_env_file(filename):
+    '''
+    Load the (weights, value iteration, trajectory, ...) records of an environment, caching them per process so that
+    long-lived workers don't unpickle the same environment for every task. The cache is keyed on the file's
+    modification time as well, so an environment that has since been re-solved is reloaded rather than served stale.
+    The returned objects are shared between tasks and mustn't be modified (e.g. copy the MDP before rolling out in it)
+    '''
+    return _load_env_file(filename, os.stat(filename).st_mtime_ns)
+
+@lru_cache(maxsize=256)
+def _load_env_file(filename, mtime_ns):
+    with instrumentation.span('pickle_load'), open(filename, 'rb') as f:
+        wt_vi_traj_env = pickle.load(f)
+
+    return wt_vi_traj_env
+
+def load_env(data_loc, env_idx):
+    if not instrumentation.enabled():
+        return load_env_file(lookup_env_filename(data_loc, env_idx))
+
+    n_misses = _load_env_file.cache_info().misses
+    wt_vi_traj_env = load_env_file(lookup_env_filename(data_loc, env_idx))
+    instrumentation.record_cache('env_cache', _load_env_file.cache_info().misses == n_misses)
+
+    return wt_vi_traj_env
+
+def env_affinity(env_idx_position):
+    '''
+    Mark which element of a task function's argument tuple holds the environment index, so that an AffinityPool can
+    always route the tasks of an environment to the same worker
+    '''
+    def decorator(func):
+        func.env_idx_position = env_idx_position
+        return func
+
+    return decorator
+
+class AffinityPool():
+    '''
+    A pool of long-lived single-process workers where the tasks of each environment are always sent to the same worker
+    (for functions marked with env_affinity()), keeping that worker's env cache warm across tasks and iterations. Other
+    tasks are distributed round-robin. Supports the subset of the multiprocessing.Pool interface used in this repo
+    '''
+    def __init__(self, processes, initializer=None, initargs=()):
+        self.workers = [Pool(1, initializer=initializer, initargs=initargs) for _ in range(processes)]
+
+    def worker_for(self, func, args, task_idx):
+        env_idx_position = getattr(func, 'env_idx_position', None)
+        key = task_idx if env_idx_position is None else int(args[env_idx_position])
+
+        return self.workers[key % len(self.workers)]
+
+    def imap(self, func, iterable, chunksize=1, max_in_flight=None):
+        '''
+        :param max_in_flight: maximum number of tasks that have been sent to the workers but whose results haven't been
+            yielded yet (a few per worker by default), so that long task lists are streamed to the workers rather than
+            all pickled and queued up front
+        '''
+        if max_in_flight is None:
+            max_in_flight = 4 * len(self.workers)
+
+        # the span covers the time from dispatching the tasks to receiving the last of their results
+        with instrumentation.span('pool_dispatch.' + func.__name__):
+            results = deque()
+            n_tasks = 0
+            for task_idx, args in enumerate(iterable):
+                if len(results) >= max_in_flight:
+                    yield results.popleft().get()
+                results.append(self.worker_for(func, args, task_idx).apply_async(func, (args,)))
+                n_tasks += 1
+            instrumentation.count('pool_tasks.' + func.__name__, n_tasks)
+            while len(results) > 0:
+                yield results.popleft().get()
+
+    def map(self, func, iterable, chunksize=None):
+        return list(self.imap(func, iterable))
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+    def join(self):
+        for worker in self.workers:
+            worker.join()
+
+    def terminate(self):
+        for worker in self.workers:
+            worker.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.terminate()
@@ -7,18 +7,31 @@ import matplotlib.pyplot as plt
 from termcolor import colored
 from spherical_geometry import great_circle_arc as gca
 import copy
+import os
+import sys
+import uuid
+import weakref
+from multiprocessing import resource_tracker, shared_memory
 from numpy.random import uniform
 from MeanShift import mean_shift as ms
 from scipy.stats import norm
+from scipy import special
 
 import policy_summarization.BEC_helpers as BEC_helpers
 import policy_summarization.BEC_visualization as BEC_viz
 import policy_summarization.computational_geometry as cg
 from policy_summarization import probability_utils as p_utils
+from policy_summarization import instrumentation
 
 fs = 16
 
 class Particles():
+    # attributes that are identical across all particle filters (i.e. the spherical discretizations). they're built once
+    # per process and aren't pickled along with the particles (e.g. when sent to pool workers)
+    static_attributes = ('ele_bin_edges', 'azi_bin_edges', 'azi_bin_offset', 'azi_bin_edges_flat', 'n_bins',
+                         'ele_bin_edges_20', 'azi_bin_edges_20', 'bin_neighbor_mapping', 'bin_neighbor_mapping_20')
+    static_tables = None
+
     def __init__(self, positions, eps=1e-5):
         self.positions = np.array(positions)
         self.weights = np.ones(len(positions)) / len(positions)
@@ -129,6 +142,13 @@ class Particles():
                            3.4906585, 4.1887902, 4.88692191, 5.58505361, 6.28318531]),
              17: np.array([0., 2.0943951, 4.1887902, 6.28318531])}
 
+        # azimuth bin edges of all elevation bins concatenated into one sorted array (each elevation bin is offset by
+        # 4pi), which allows many particles to be binned with a single call to np.digitize (see bin_ids())
+        self.azi_bin_offset = 4 * np.pi
+        self.azi_bin_edges_flat = np.concatenate([self.azi_bin_edges[ele_bin] + self.azi_bin_offset * ele_bin
+                                                  for ele_bin in range(len(self.azi_bin_edges))])
+        self.n_bins = len(self.azi_bin_edges_flat) - len(self.azi_bin_edges)
+
         self.ele_bin_edges_20 = np.array([0, np.pi/4, np.pi/2, 3 * np.pi/4, np.pi + eps])
 
         self.azi_bin_edges_20 = \
@@ -143,8 +163,13 @@ class Particles():
         self.cluster_weights = None
         self.cluster_assignments = None
 
-        self.bin_neighbor_mapping = self.initialize_bin_neighbor_mapping()
-        self.bin_neighbor_mapping_20 = self.initialize_bin_neighbor_mapping_20()
+        if Particles.static_tables is None:
+            self.bin_neighbor_mapping = self.initialize_bin_neighbor_mapping()
+            self.bin_neighbor_mapping_20 = self.initialize_bin_neighbor_mapping_20()
+            Particles.static_tables = {attribute: getattr(self, attribute) for attribute in self.static_attributes}
+        else:
+            self.bin_neighbor_mapping = Particles.static_tables['bin_neighbor_mapping']
+            self.bin_neighbor_mapping_20 = Particles.static_tables['bin_neighbor_mapping_20']
         self.bin_particle_mapping = None
         self.bin_weight_mapping = None
 
@@ -152,6 +177,28 @@ class Particles():
         self.integral_prob_VMF = 0.3018381546031181       # the total probability on the VMF half of the custom uniform + VMF distribution
         self.VMF_kappa = 2                                # the concentration parameter of the VMF distribution
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attribute in self.static_attributes:
+            state.pop(attribute, None)
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.update(Particles.get_static_tables())
+
+    @staticmethod
+    def get_static_tables():
+        '''
+        Return the spherical discretization tables shared by all particle filters, building them if this process hasn't
+        yet (e.g. in a freshly started pool worker)
+        '''
+        if Particles.static_tables is None:
+            Particles(np.array([[[0., 0., 1.]]]))
+
+        return Particles.static_tables
+
     def reinitialize(self, positions):
         self.positions = np.array(positions)
         self.weights = np.ones(len(positions)) / len(positions)
@@ -455,6 +502,20 @@ class Particles():
 
         return bin_particle_mapping, bin_weight_mapping
 
+    def bin_ids(self, positions):
+        '''
+        Return the flat index (0 to 405) of the cell in the 406-cell discretization of the 2-sphere that each of the
+        provided positions falls into. Cells are numbered by elevation bin first, then azimuth bin (i.e. in the same
+        order as the keys and values of bin_weight_mapping in bin_particles())
+        '''
+        positions_spherical = cg.cart2sph(positions.reshape(-1, 3))
+
+        elevation_bins = np.digitize(positions_spherical[:, 0], self.ele_bin_edges) - 1
+        flat_azimuths = positions_spherical[:, 1] + self.azi_bin_offset * elevation_bins
+
+        # each preceding elevation bin contributes one more edge than it has cells
+        return np.digitize(flat_azimuths, self.azi_bin_edges_flat) - elevation_bins - 1
+
     def meanshift_plusplus_neighbors(self, query_point, points, weights):
         '''
         Implement "MeanShift++: Extremely Fast Mode-Seeking With Applications to Segmentation and Object Tracking" by
@@ -511,11 +572,15 @@ class Particles():
     def reweight(self, constraints):
         '''
         :param constraints: normal of constraints / mean direction of VMF
-        :param k: concentration parameter of VMF
-        :return: probability of x under this composite distribution (uniform + VMF)
+        :return: log of the total weight of the particles after reweighting by the probability of each particle under
+        the composite distribution (uniform + VMF). The weights themselves are renormalized to sum to one in log space,
+        so that many small likelihoods do not underflow to zero
         '''
-        for j, x in enumerate(self.positions):
-            self.weights[j] = self.weights[j] * self.observation_probability(x, constraints, self.VMF_kappa)
+        log_weights = np.log(self.weights) + self.observation_log_probability(self.positions, constraints, self.VMF_kappa)
+        log_sum_weights = special.logsumexp(log_weights)
+        self.weights = np.exp(log_weights - log_sum_weights)
+
+        return log_sum_weights
 
     def plot(self, centroid=None, fig=None, ax=None, cluster_centers=None, cluster_weights=None,
                        cluster_assignments=None, plot_prev=False):
@@ -661,49 +726,56 @@ class Particles():
     def KLD_resampling(self, k=0, epsilon=.15, N_min=20, N_max=1000, delta=0.01):
         '''
         An implementation of 'Adapting sample size in particle filters through KLD-resampling' (2013) by Li et al.
+
+        Candidates are drawn a block at a time (one systematic resampling of the current weights per block). The bins
+        of the whole block are computed at once, and the point at which the sample size bound is first met is found
+        from the cumulative count of newly occupied bins, instead of updating the bound one particle at a time.
         :return: A list of particle indexes to resample
         '''
 
         z = norm.ppf(1 - delta)
-        candidate_indexes = []
         resample_indexes = []
+        n_resampled = 0
         N = N_min
 
-        # todo: I should probably move this somewhere else and get rid of the _20 versions
-        # dictionary with keys based on elevation, and values based on associated number of azimuth bins
-        bin_occupancy = {0: np.zeros(3), 1: np.zeros(9), 2: np.zeros(15), 3: np.zeros(20), 4: np.zeros(24),
-                         5: np.zeros(30),
-                         6: np.zeros(30), 7: np.zeros(36), 8: np.zeros(36), 9: np.zeros(36), 10: np.zeros(36),
-                         11: np.zeros(30), 12: np.zeros(30), 13: np.zeros(24), 14: np.zeros(20),
-                         15: np.zeros(15),
-                         16: np.zeros(9), 17: np.zeros(3)}
-
-        while len(resample_indexes) <= N and len(resample_indexes) <= N_max or len(resample_indexes) < N_min:
+        bin_occupancy = np.zeros(self.n_bins, dtype=bool)
+
+        while True:
+            # get another set of candidate indexes using systematic resampling. candidates are consumed from the back
+            # of the shuffled set and the set is replenished once a single candidate remains
+            candidate_indexes = p_utils.systematic_resample(self.weights)
+            np.random.shuffle(candidate_indexes)
             if len(candidate_indexes) > 1:
-                index = candidate_indexes.pop()
-            else:
-                # get another set of candidate indexes using systematic resampling
-                candidate_indexes = p_utils.systematic_resample(self.weights)
-                np.random.shuffle(candidate_indexes)
-                candidate_indexes = list(candidate_indexes)
-                index = candidate_indexes.pop()
+                candidate_indexes = candidate_indexes[:0:-1]
 
-            resample_indexes.append(index)
+            # flag the candidates that are the first to occupy a bin
+            candidate_bins = self.bin_ids(self.positions[candidate_indexes])
+            unique_bins, first_occurrences = np.unique(candidate_bins, return_index=True)
+            first_occurrences = first_occurrences[~bin_occupancy[unique_bins]]
+            newly_occupied = np.zeros(len(candidate_indexes), dtype=int)
+            newly_occupied[first_occurrences] = 1
 
-            position_spherical = cg.cart2sph(self.positions[index])
-            elevation = position_spherical[0][0]
-            azimuth = position_spherical[0][1]
+            # number of occupied bins and the resulting sample size bound after each candidate has been resampled
+            ks = k + np.cumsum(newly_occupied)
+            ks_minus_one = np.maximum(ks - 1, 1)
+            Ns = np.where(ks > 1, ks_minus_one / (2 * epsilon) * (1 - 2 / (9 * ks_minus_one) + np.sqrt(2 / (9 * ks_minus_one)) * z) ** 3, N)
 
-            elevation_bin = np.digitize(elevation, self.ele_bin_edges)
-            azimuth_bin = np.digitize(azimuth, self.azi_bin_edges[elevation_bin - 1])
+            # keep resampling while the sample size is within the bound (and N_max), or until N_min is reached
+            n_resampled_after = n_resampled + np.arange(1, len(candidate_indexes) + 1)
+            keep_going = ((n_resampled_after <= Ns) & (n_resampled_after <= N_max)) | (n_resampled_after < N_min)
+            stops = np.flatnonzero(~keep_going)
+            n_taken = stops[0] + 1 if len(stops) > 0 else len(candidate_indexes)
 
-            if bin_occupancy[elevation_bin - 1][azimuth_bin - 1] == 0:
-                k += 1
-                bin_occupancy[elevation_bin - 1][azimuth_bin - 1] = 1
-                if k > 1:
-                    N = (k - 1) / (2 * epsilon) * (1 - 2 / (9 * (k - 1)) + np.sqrt(2 / (9 * (k - 1))) * z) ** 3
+            resample_indexes.append(candidate_indexes[:n_taken])
+            bin_occupancy[candidate_bins[:n_taken]] = True
+            n_resampled += n_taken
+            k = ks[n_taken - 1]
+            N = Ns[n_taken - 1]
 
-        return np.array(resample_indexes)
+            if len(stops) > 0:
+                break
+
+        return np.concatenate(resample_indexes)
 
 
     def reset(self, constraint):
@@ -733,19 +805,18 @@ class Particles():
 
         print(colored('Performed a reset', 'red'))
 
+    @instrumentation.instrumented()
     def update(self, constraints, c=0.5, reset_threshold_prob=0.001):
         self.weights_prev = self.weights.copy()
         self.positions_prev = self.positions.copy()
 
         for constraint in constraints:
-            self.reweight(constraint)
+            log_sum_weights = self.reweight(constraint)
 
-            if sum(self.weights) < reset_threshold_prob:
+            if log_sum_weights < np.log(reset_threshold_prob):
                 self.reset(constraint)
             else:
-                # normalize weights and update particles
-                self.weights /= sum(self.weights)
-
+                # weights are already normalized by reweight(), so update particles
                 n_eff = self.calc_n_eff(self.weights)
                 # print('n_eff: {}'.format(n_eff))
                 if n_eff < c * len(self.weights):
@@ -761,29 +832,181 @@ class Particles():
 
     @staticmethod
     def observation_probability(x, constraints, k):
-        prob = 1
-        p = x.shape[1]
+        return np.exp(Particles.observation_log_probability(x, constraints, k))
 
-        for constraint in constraints:
-            dot = constraint.dot(x.T)
+    @staticmethod
+    def observation_log_probability(positions, constraints, k):
+        '''
+        :param positions: particle positions (n x 1 x p)
+        :param constraints: normal of constraints / mean direction of VMF
+        :param k: concentration parameter of VMF
+        :return: log probability of each position under this composite distribution (uniform + VMF), summed over
+        the constraints
+        '''
+        p = positions.shape[-1]
+        positions = positions.reshape(-1, p)
+        constraints = np.array(constraints).reshape(-1, p)
 
-            # use the scaled pdfs for both uniform and VMF distributions (determined by the kappa value of the VMF),
-            # which ensures that the integral of the custom pdf is 1
-            if dot >= 0:
-                # use the uniform dist
-                prob *= 0.11109015027  # self.integral_prob_uniform / (2 * np.pi)
-            else:
-                # use the VMF dist
-                # x1 * x2 * self.integral_prob_VMF (see uniform_VMF_dist.py for values of x1 and x2 for k = 2)
-                prob *= 1.8134302039235095 * 1.396323690793764 * p_utils.VMF_pdf(constraint, k, p, x, dot=dot)
+        dots = positions.dot(constraints.T)
 
-        return prob
+        # use the scaled pdfs for both uniform and VMF distributions (determined by the kappa value of the VMF),
+        # which ensures that the integral of the custom pdf is 1
+        # uniform dist: self.integral_prob_uniform / (2 * np.pi)
+        # VMF dist: x1 * x2 * self.integral_prob_VMF (see uniform_VMF_dist.py for values of x1 and x2 for k = 2)
+        log_probs = np.where(dots >= 0, np.log(0.11109015027),
+                             np.log(1.8134302039235095 * 1.396323690793764) + p_utils.VMF_logpdf(None, k, p, None, dot=dots))
+
+        return np.sum(log_probs, axis=1)
 
     @staticmethod
     def calc_n_eff(weights):
         return 1. / np.sum(np.square(weights))
 
 
+class SharedParticles():
+    '''
+    Publish the positions and weights of a particle filter into shared memory (e.g. once per iteration) so that pool
+    tasks only need to be sent a lightweight SharedParticlesHandle instead of the pickled particle filter
+    '''
+    def __init__(self, particles):
+        self.shms = []
+        self.handle = None
+        self.finalizer = None
+        self.publish(particles)
+
+    def publish(self, particles):
+        self.close()
+
+        arrays = {}
+        for name in ('positions', 'weights'):
+            array = np.ascontiguousarray(getattr(particles, name), dtype=float)
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=float, buffer=shm.buf)[...] = array
+            self.shms.append(shm)
+            arrays[name] = (shm.name, array.shape)
+
+        # the remaining (small) state is sent along with the handle. the previous positions and weights and any cached
+        # binning are left out since they're not needed for evaluating information gain
+        state = particles.__getstate__()
+        for name in ('positions', 'weights', 'positions_prev', 'weights_prev', 'bin_particle_mapping', 'bin_weight_mapping'):
+            state.pop(name, None)
+        state['binned'] = False
+
+        self.handle = SharedParticlesHandle(str(uuid.uuid4()), arrays, state, lookup_resource_tracker_id())
+        # release the shared memory even if close() isn't explicitly called
+        self.finalizer = weakref.finalize(self, SharedParticles.release, list(self.shms))
+
+    @staticmethod
+    def release(shms):
+        for shm in shms:
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        if self.finalizer is not None:
+            self.finalizer()
+        self.shms = []
+        self.handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def lookup_resource_tracker_id():
+    '''
+    Identify the resource tracker that this process registers shared memory with (by the pipe to it), which processes
+    started through multiprocessing share with the process that started them. None where segments aren't tracked
+    '''
+    if sys.version_info >= (3, 13) or os.name != 'posix':
+        return None
+
+    resource_tracker.ensure_running()
+    stat = os.fstat(resource_tracker._resource_tracker._fd)
+
+    return stat.st_dev, stat.st_ino
+
+def attach_shared_memory(shm_name, owner_tracker_id):
+    '''
+    Attach to a shared memory segment owned (and eventually unlinked) by another process without leaving it tracked by
+    this process's resource tracker, which would otherwise unlink it or warn about it leaking when this process exits
+
+    :param owner_tracker_id: lookup_resource_tracker_id() of the process that created the segment
+    '''
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=shm_name, track=False)
+
+    # before Python 3.13 attaching always registers the segment. pool workers share the owner's resource tracker, where
+    # the segment is already registered (and unregistering it would drop the owner's registration), so it's only
+    # unregistered from a resource tracker of this process's own
+    shm = shared_memory.SharedMemory(name=shm_name)
+    if owner_tracker_id is not None and lookup_resource_tracker_id() != owner_tracker_id:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+    return shm
+
+class SharedParticlesHandle():
+    '''
+    Picklable, read-only reference to a particle filter published with SharedParticles
+    '''
+    # the particle filter most recently attached to in this process
+    attached = (None, None, None)
+
+    def __init__(self, publication_id, arrays, state, tracker_id=None):
+        self.publication_id = publication_id
+        self.tracker_id = tracker_id
+        self.arrays = arrays
+        self.state = state
+
+    def attach(self):
+        '''
+        Return a Particles object whose positions and weights are read-only views into the shared memory. The object is
+        reused by subsequent tasks of the same publication in this process (e.g. so that its entropy is only computed once)
+        '''
+        publication_id, particles, shms = SharedParticlesHandle.attached
+        if publication_id == self.publication_id:
+            return particles
+
+        # detach from the previous publication
+        SharedParticlesHandle.attached = (None, None, None)
+        del particles
+        for shm in shms or []:
+            try:
+                shm.close()
+            except BufferError:
+                # the previous particles are still referenced elsewhere, so leave the mapping to be garbage collected
+                pass
+
+        shms = []
+        state = dict(self.state)
+        for name, (shm_name, shape) in self.arrays.items():
+            shm = attach_shared_memory(shm_name, self.tracker_id)
+            array = np.ndarray(shape, dtype=float, buffer=shm.buf)
+            array.flags.writeable = False
+            shms.append(shm)
+            state[name] = array
+        state['positions_prev'] = state['positions']
+        state['weights_prev'] = state['weights']
+
+        particles = Particles.__new__(Particles)
+        particles.__setstate__(state)
+        SharedParticlesHandle.attached = (self.publication_id, particles, shms)
+
+        return particles
+
+def resolve_particles(particles):
+    '''
+    Attach to particles that were sent to a pool task as a SharedParticlesHandle (other values are returned as is)
+    '''
+    if isinstance(particles, SharedParticlesHandle):
+        return particles.attach()
+
+    return particles
+
 def IROS_demonstrations():
     w = np.array([[-3, 3.5, -1]])  # toll, hotswap station, step cost
     w_normalized = w / (np.linalg.norm(w[0, :], ord=2) - np.linalg.norm(w[0, :], ord=2) * 0.05)
@@ -9,6 +9,7 @@ from sklearn.cluster import KMeans
 import os
 from tqdm import tqdm
 from collections import defaultdict
+import json
 
 # Other imports
 from simple_rl.planning import ValueIteration
@@ -16,6 +17,8 @@ from simple_rl.utils import mdp_helpers
 from policy_summarization import BEC_helpers
 from simple_rl.utils import make_mdp
 from policy_summarization import multiprocessing_helpers as mp_helpers
+from policy_summarization import stage_graph
+from policy_summarization import instrumentation
 
 def sample_wt_candidates(data_loc, weights, step_cost_flag, n_samples, sample_radius):
     '''
@@ -111,9 +114,10 @@ def discretize_wt_candidates(data_loc, weights, weights_lb, weights_ub, step_cos
 
     return wt_uniform_sampling
 
-def solve_policy(args):
-    env_idx, mdp_code, mdp_class, hardcode_envs, mdp_parameters, wt_candidates, data_loc = args
-
+def configure_mdp_parameters(mdp_class, mdp_code, hardcode_envs, mdp_parameters):
+    '''
+    Summary: fill in the objects of mdp_parameters (e.g. tolls, walls, or crumbs) that are toggled by mdp_code
+    '''
     if mdp_class == 'augmented_taxi':
         # note that this is specially accommodates the four hand-designed environments
         if hardcode_envs:
@@ -181,6 +185,13 @@ def solve_policy(args):
     else:
         raise Exception("Unknown MDP class.")
 
+    return mdp_parameters
+
+def solve_policy(args):
+    env_idx, mdp_code, mdp_class, hardcode_envs, mdp_parameters, wt_candidates, data_loc = args
+
+    mdp_parameters = configure_mdp_parameters(mdp_class, mdp_code, hardcode_envs, mdp_parameters)
+
     # a per-environment tuple of corresponding reward weight, optimal policy, and optimal trajectory
     wt_vi_traj_env = []
     wt_counter = 0
@@ -190,50 +201,207 @@ def solve_policy(args):
 
         # parameters tailored to the 4x3 Augmented Taxi Domain
         vi_candidate = ValueIteration(mdp_candidate, sample_rate=1)
-        iterations, value_of_init_state = vi_candidate.run_vi()
+        with instrumentation.span('ValueIteration.run_vi'):
+            iterations, value_of_init_state = vi_candidate.run_vi()
         trajectory = mdp_helpers.rollout_policy(mdp_candidate, vi_candidate)
         wt_vi_traj_env.append([wt_candidate, vi_candidate, trajectory, mdp_parameters.copy()])
 
         wt_counter += 1
 
-    with open(mp_helpers.lookup_env_filename(data_loc, env_idx), 'wb') as f:
-        pickle.dump(wt_vi_traj_env, f)
+    stage_graph.atomic_pickle_dump(wt_vi_traj_env, mp_helpers.lookup_env_filename(data_loc, env_idx))
+
+    return wt_vi_traj_env
 
-def obtain_env_policies(mdp_class, data_loc, wt_candidates, mdp_parameters, pool, hardcode_envs=False):
+def canonical_mdp_key(mdp):
     '''
-    Summary: come up with an optimal policy for each of the candidates
+    Summary: hash the effective layout of an MDP, i.e. its reachable states along with the successor and reward
+    features of every action. Environments whose codes only differ in objects that can never affect the agent (e.g. a
+    toll placed on a wall) share a key, and thus share the same optimal values. Only a single outcome of each action is
+    observed, so MDPs with stochastic transitions (slip_prob > 0) aren't canonicalized and None is returned instead
+    '''
+    if getattr(mdp, 'slip_prob', 0) > 0:
+        return None
+
+    mdp._compute_reachable_state_space()
+
+    transitions = []
+    for state in mdp.states:
+        for action in mdp.actions:
+            next_state = mdp.transition_func(copy.deepcopy(state), action)
+            if hasattr(mdp, 'compute_reward_features'):
+                reward = tuple(np.round(np.array(mdp.compute_reward_features(state, action, next_state), dtype=float).flatten(), 8))
+            else:
+                reward = round(float(mdp.reward_func(state, action, next_state)), 8)
+            transitions.append((str(state), state.is_terminal(), action, str(next_state), next_state.is_terminal(), reward))
+    transitions.sort()
+
+    return stage_graph.content_hash((type(mdp).__name__, str(mdp.init_state), mdp.gamma, getattr(mdp, "weights", None), transitions))
+
+def canonicalize_env(args):
+    '''
+    Summary: obtain the canonical key of an environment (for the first weight candidate)
+    '''
+    env_idx, mdp_code, mdp_class, hardcode_envs, mdp_parameters, wt_candidates, data_loc = args
+
+    mdp_parameters = configure_mdp_parameters(mdp_class, mdp_code, hardcode_envs, mdp_parameters)
+    mdp_parameters['weights'] = wt_candidates[0]
+
+    return env_idx, canonical_mdp_key(make_mdp.make_custom_mdp(mdp_class, mdp_parameters))
+
+def transfer_policy(vi_solved, mdp):
+    '''
+    Summary: provide an MDP with the value function already solved for an equivalent MDP (see canonical_mdp_key())
+    '''
+    vi = ValueIteration(mdp, sample_rate=vi_solved.sample_rate)
+    mdp.states = set(vi_solved.mdp.states)
+    mdp.reachability_done = True
+    vi.trans_dict = vi_solved.trans_dict
+    vi.has_computed_matrix = True
+    vi.value_func = copy.copy(vi_solved.value_func)
+    vi.bellman_backups = vi_solved.bellman_backups
+    vi.has_planned = vi_solved.has_planned
+    vi.stabilized = vi_solved.stabilized
+
+    return vi
+
+def solve_policy_equivalence_class(args):
+    '''
+    Summary: solve for the optimal policy of the first environment of an equivalence class (or load it if it has
+    already been solved), then transfer it to the remaining environments of the class
+    '''
+    env_idxs, mdp_codes, mdp_class, hardcode_envs, mdp_parameters, wt_candidates, data_loc, solved_env_idx = args
+
+    if solved_env_idx is not None:
+        wt_vi_traj_solved = mp_helpers.load_env(data_loc, solved_env_idx)
+    else:
+        wt_vi_traj_solved = solve_policy((env_idxs[0], mdp_codes[0], mdp_class, hardcode_envs, copy.deepcopy(mdp_parameters), wt_candidates, data_loc))
+        env_idxs, mdp_codes = env_idxs[1:], mdp_codes[1:]
+
+    for env_idx, mdp_code in zip(env_idxs, mdp_codes):
+        env_mdp_parameters = configure_mdp_parameters(mdp_class, mdp_code, hardcode_envs, copy.deepcopy(mdp_parameters))
+
+        wt_vi_traj_env = []
+        for wt_candidate, (_, vi_solved, _, _) in zip(wt_candidates, wt_vi_traj_solved):
+            env_mdp_parameters['weights'] = wt_candidate
+            mdp_candidate = make_mdp.make_custom_mdp(mdp_class, env_mdp_parameters)
+            vi_candidate = transfer_policy(vi_solved, mdp_candidate)
+            trajectory = mdp_helpers.rollout_policy(mdp_candidate, vi_candidate)
+            wt_vi_traj_env.append([wt_candidate, vi_candidate, trajectory, env_mdp_parameters.copy()])
+
+        stage_graph.atomic_pickle_dump(wt_vi_traj_env, mp_helpers.lookup_env_filename(data_loc, env_idx))
+
+    return len(env_idxs)
+
+def lookup_mdp_code_length(mdp_class, mdp_parameters, hardcode_envs=False):
+    '''
+    Summary: the number of binary objects (e.g. tolls, walls, or crumbs) that are toggled by an environment's code
     '''
     if hardcode_envs:
         # each of the domains has four possible hard-coded environments
-        mdp_codes = list(map(list, itertools.product([0, 1], repeat=2)))
+        return 2
+
+    if mdp_class == 'augmented_taxi':
+        return len(mdp_parameters['available_tolls'])
+    elif mdp_class == 'two_goal' or mdp_class == 'two_goal2':
+        return len(mdp_parameters['available_walls'])
+    elif mdp_class == 'skateboard':
+        return len(mdp_parameters['available_walls'])
+    elif mdp_class == 'skateboard2':
+        return 6
+    elif mdp_class == 'cookie_crumb':
+        return len(mdp_parameters['available_crumbs'])
+    elif mdp_class == 'augmented_taxi2':
+        return len(mdp_parameters['available_tolls']) + 1
+    elif mdp_class == 'colored_tiles':
+        return len(mdp_parameters['available_A_tiles']) + len(mdp_parameters['available_B_tiles'])
+    elif mdp_class == 'augmented_navigation':
+        # gravel, grass, roads, hotswap station, skateboard, and car are each toggled as a group (see make_mdp_obj())
+        return 6
     else:
+        raise Exception("Unknown MDP class.")
+
+def lookup_mdp_code(code_idx, code_length):
+    '''
+    Summary: the code at position code_idx of itertools.product([0, 1], repeat=code_length), without enumerating the
+    preceding codes
+    '''
+    return [(code_idx >> (code_length - 1 - bit)) & 1 for bit in range(code_length)]
+
+def obtain_env_policies(mdp_class, data_loc, wt_candidates, mdp_parameters, pool, hardcode_envs=False, mdp_codes=None):
+    '''
+    Summary: come up with an optimal policy for each of the candidates
+
+    :param mdp_codes: codes of the environments to solve, in the order of their environment indices. Every code of the
+        domain is enumerated if None (see EnvCatalog for working with a subset of a domain's codes)
+    '''
+    if mdp_codes is None:
         # generate codes that govern the binary status of available tolls, walls, or crumbs
-        if mdp_class == 'augmented_taxi':
-            mdp_codes = list(map(list, itertools.product([0, 1], repeat=len(mdp_parameters['available_tolls']))))
-        elif mdp_class == 'two_goal' or mdp_class == 'two_goal2':
-            mdp_codes = list(map(list, itertools.product([0, 1], repeat=len(mdp_parameters['available_walls']))))
-        elif mdp_class == 'skateboard':
-            mdp_codes = list(map(list, itertools.product([0, 1], repeat=len(mdp_parameters['available_walls']))))
-        elif mdp_class == 'skateboard2':
-            mdp_codes = list(map(list, itertools.product([0, 1], repeat=6)))
-        elif mdp_class == 'cookie_crumb':
-            mdp_codes = list(map(list, itertools.product([0, 1], repeat=len(mdp_parameters['available_crumbs']))))
-        elif mdp_class == 'augmented_taxi2':
-            mdp_codes = list(map(list, itertools.product([0, 1], repeat=len(mdp_parameters['available_tolls'])+1)))
-        elif mdp_class == 'colored_tiles':
-            mdp_codes = list(map(list, itertools.product([0, 1], repeat=len(mdp_parameters['available_A_tiles'])+len(mdp_parameters['available_B_tiles']))))
-        elif mdp_class == 'augmented_navigation':
-            mdp_codes = list(map(list, itertools.product([0, 1], repeat=6)))  # todo: make this a variable
-        else:
-            raise Exception("Unknown MDP class.")
+        mdp_codes = list(map(list, itertools.product([0, 1], repeat=lookup_mdp_code_length(mdp_class, mdp_parameters, hardcode_envs))))
 
     policy_dir = 'models/' + data_loc + '/gt_policies/'
     os.makedirs(policy_dir, exist_ok=True)
-    n_processed_envs = len(os.listdir(policy_dir))
 
-    print("Solving for the optimal policy in each environment:")
-    args = [(i, mdp_codes[i], mdp_class, hardcode_envs, mdp_parameters, wt_candidates, data_loc) for i in range(n_processed_envs, len(mdp_codes))]
-    list(tqdm(pool.imap(solve_policy, args), total=len(args)))
+    # the manifest records the code and canonical key of each environment. since environment files are written
+    # atomically, an environment has been solved if and only if its file exists
+    manifest_filename = 'models/' + data_loc + '/gt_policies_manifest.json'
+    if os.path.exists(manifest_filename):
+        with open(manifest_filename, 'r') as f:
+            recorded_envs = json.load(f).get('envs', {})
+    else:
+        # environments solved before the manifest existed were solved by enumerating the code space and are indexed in
+        # the order of itertools.product() (as EnvCatalog also assumes), so they're adopted rather than re-solved
+        code_length = lookup_mdp_code_length(mdp_class, mdp_parameters, hardcode_envs)
+        recorded_envs = {str(i): {'code': lookup_mdp_code(i, code_length), 'key': None} for i in range(len(mdp_codes))
+                         if os.path.exists(mp_helpers.lookup_env_filename(data_loc, i))}
+    # environments beyond mdp_codes (e.g. a catalog's that are outside of this run's subset) are kept as they are
+    envs = {env_idx: env for env_idx, env in recorded_envs.items() if int(env_idx) >= len(mdp_codes) or env['code'] == list(mdp_codes[int(env_idx)])}
+    manifest = {'mdp_class': mdp_class, 'envs': envs}
+
+    # an environment file is only trusted if the manifest records that it was solved for the same code. files left by
+    # a different assignment of codes to indices (e.g. a sampled EnvCatalog vs. full enumeration) are moved to
+    # models/<data_loc>/stale/gt_policies/ and re-solved
+    pending_env_idxs = []
+    for i in range(len(mdp_codes)):
+        env_filename = mp_helpers.lookup_env_filename(data_loc, i)
+        if str(i) not in envs:
+            if os.path.exists(env_filename):
+                recorded_code = recorded_envs[str(i)]['code'] if str(i) in recorded_envs else None
+                stale_dir = 'models/' + data_loc + '/stale/gt_policies/' + ('unrecorded' if recorded_code is None else 'code' + ''.join(map(str, recorded_code)))
+                os.makedirs(stale_dir, exist_ok=True)
+                shutil.move(env_filename, os.path.join(stale_dir, os.path.basename(env_filename)))
+                print(colored('Moved {} (solved for code {}) to {}'.format(env_filename, recorded_code, stale_dir), 'red'))
+            pending_env_idxs.append(i)
+        elif not os.path.exists(env_filename):
+            pending_env_idxs.append(i)
+    if len(pending_env_idxs) == 0:
+        if not os.path.exists(manifest_filename):
+            stage_graph.atomic_json_dump(manifest, manifest_filename)
+        return
+
+    # group the environments whose reachable MDPs are identical so that value iteration is only run once per group
+    print("Canonicalizing the environments:")
+    args = [(i, mdp_codes[i], mdp_class, hardcode_envs, mdp_parameters, wt_candidates, data_loc) for i in pending_env_idxs if str(i) not in envs]
+    for env_idx, env_key in tqdm(pool.imap(canonicalize_env, args), total=len(args)):
+        envs[str(env_idx)] = {'code': list(mdp_codes[env_idx]), 'key': env_key}
+    stage_graph.atomic_json_dump(manifest, manifest_filename)
+
+    pending = set(pending_env_idxs)
+    solved_env_idxs = {}
+    for env_idx, env in envs.items():
+        # adopted (or stochastic) environments have no canonical key, so policies can't be transferred from them
+        if int(env_idx) not in pending and env['key'] is not None:
+            solved_env_idxs.setdefault(env['key'], int(env_idx))
+
+    equivalence_classes = defaultdict(list)
+    for env_idx in pending_env_idxs:
+        env_key = envs[str(env_idx)]['key']
+        # environments without a canonical key (see canonical_mdp_key()) are solved on their own
+        equivalence_classes[env_key if env_key is not None else 'env' + str(env_idx)].append(env_idx)
+
+    print("Solving for the optimal policy in each of {} unique environments ({} environments in total):".format(len(equivalence_classes), len(pending_env_idxs)))
+    args = [(env_idxs, [mdp_codes[i] for i in env_idxs], mdp_class, hardcode_envs, mdp_parameters, wt_candidates, data_loc, solved_env_idxs.get(env_key))
+            for env_key, env_idxs in equivalence_classes.items()]
+    list(tqdm(pool.imap(solve_policy_equivalence_class, args), total=len(args)))
 
 def _in_summary(mdp, summary, initial_state):
     '''
@@ -260,9 +428,7 @@ def optimize_visuals(data_loc, best_env_idxs, best_traj_idxs, chunked_traj_recor
             # reset the visual dissimilarity dictionary for a new MDP
             average_dissimilarity_dict = {}
 
-            filename = mp_helpers.lookup_env_filename(data_loc, best_env_idx)
-            with open(filename, 'rb') as f:
-                wt_vi_traj_env = pickle.load(f)
+            wt_vi_traj_env = mp_helpers.load_env(data_loc, best_env_idx)
             best_mdp = wt_vi_traj_env[0][1].mdp
 
         if len(summary) >= 1:
@@ -1,4 +1,5 @@
 import numpy as np
+from functools import lru_cache
 from scipy import special
 from numpy.random import random
 from scipy.linalg import null_space
@@ -183,6 +184,27 @@ def rand_von_mises_fisher(mu, kappa, N=1, halfspace=False):
 
     return samples
 
+@lru_cache(maxsize=None)
+def VMF_normalizer(k, p):
+    '''
+    :param k: concentration parameter
+    :param p: dimensionality of the distribution (i.e. lies on the p-1 sphere)
+
+    :return: normalizing constant of the VMF distribution (cached per (k, p) pair)
+    '''
+    return (k ** (p / 2 - 1)) / (special.iv((p / 2 - 1), k) * (2 * np.pi) ** (p / 2))
+
+@lru_cache(maxsize=None)
+def VMF_log_normalizer(k, p):
+    '''
+    :param k: concentration parameter
+    :param p: dimensionality of the distribution (i.e. lies on the p-1 sphere)
+
+    :return: log of the normalizing constant of the VMF distribution (cached per (k, p) pair). The exponentially scaled
+    Bessel function is used so that large concentration parameters do not overflow
+    '''
+    return (p / 2 - 1) * np.log(k) - (np.log(special.ive((p / 2 - 1), k)) + k) - (p / 2) * np.log(2 * np.pi)
+
 def VMF_pdf(mu, k, p, x, dot=None):
     '''
     :param mu: mean direction
@@ -196,7 +218,22 @@ def VMF_pdf(mu, k, p, x, dot=None):
     if dot is None:
         dot = x.dot(mu)
 
-    return (k ** (p / 2 - 1)) / (special.iv((p / 2 - 1), k) * (2 * np.pi) ** (p / 2)) * np.exp(k * dot)
+    return VMF_normalizer(k, p) * np.exp(k * dot)
+
+def VMF_logpdf(mu, k, p, x, dot=None):
+    '''
+    :param mu: mean direction
+    :param k: concentration parameter
+    :param p: dimensionality of the distribution (i.e. lies on the p-1 sphere)
+    :param x: queried unit vectors
+    :param dot: dot product between the mean direction and queried unit vector
+
+    :return: log probability density at queried unit vectors
+    '''
+    if dot is None:
+        dot = x.dot(mu)
+
+    return VMF_log_normalizer(k, p) + k * dot
 
 def systematic_resample(weights, N=None):
     """ Performs the systemic resampling algorithm used by particle filters.
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+class RemedialJob():
+    '''
+    A single request (e.g. from one participant of the web study) to evaluate a function over a list of per-environment
+    arguments. Partial results are streamed through an asyncio.Queue as (env position, result) tuples as they complete
+    '''
+    def __init__(self, job_id, n_envs):
+        self.job_id = job_id
+        self.n_envs = n_envs
+        self.results = [None] * n_envs
+        self.n_completed = 0
+        self.queue = None                 # created on the manager's loop once the job starts
+        self.future = None                # concurrent.futures.Future of the coroutine running on the manager's loop
+
+    @property
+    def progress(self):
+        return int(100 * self.n_completed / self.n_envs) if self.n_envs > 0 else 100
+
+class RemedialJobManager():
+    '''
+    Run remedial demonstration selection jobs for the web study server without blocking its event loop. A single
+    worker pool is shared by all concurrent participants, each job streams its per-environment results as they
+    complete, and a job can be cancelled (e.g. when its participant disconnects)
+
+    :param socketio: object exposing emit(event, data, to=None) (e.g. a flask_socketio.SocketIO or an in-process stand-in
+        for testing) used to send progress updates to the client in the room named by the job id. Progress isn't sent if None
+    :param executor: concurrent.futures executor to run the jobs on. A ProcessPoolExecutor with max_workers is created
+        (and owned) by the manager if None
+    '''
+    def __init__(self, socketio=None, executor=None, max_workers=None, progress_event='message'):
+        self.socketio = socketio
+        self.progress_event = progress_event
+        self.owns_executor = executor is None
+        self.executor = ProcessPoolExecutor(max_workers=max_workers) if executor is None else executor
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+        # the jobs are coordinated on a dedicated event loop so that both synchronous (e.g. flask request handlers)
+        # and asynchronous callers can submit them
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+
+    def emit(self, message, job_id):
+        if self.socketio is not None:
+            self.socketio.emit(self.progress_event, message, to=job_id)
+
+    async def run_job(self, job, function, args, on_result=None):
+        '''
+        Evaluate function on each of the args in the shared executor, streaming each result into the job's queue as it
+        completes. Cancelling this coroutine cancels all of the job's pending work. If function raises on any of the args,
+        the job's remaining work is cancelled and the exception is raised (so that job.future fails)
+        '''
+        loop = asyncio.get_running_loop()
+
+        async def evaluate(position, arg):
+            try:
+                result = await loop.run_in_executor(self.executor, function, arg)
+            except Exception as exc:
+                # hand the failure to the consumer below, which would otherwise wait on the queue forever
+                await job.queue.put((position, None, exc))
+                return
+            await job.queue.put((position, result, None))
+
+        tasks = [asyncio.ensure_future(evaluate(position, arg)) for position, arg in enumerate(args)]
+
+        try:
+            while job.n_completed < job.n_envs:
+                position, result, exc = await job.queue.get()
+                if exc is not None:
+                    for task in tasks:
+                        task.cancel()
+                    self.emit("Progress updates failed", job.job_id)
+                    raise exc
+
+                job.results[position] = result
+                job.n_completed += 1
+
+                if on_result is not None:
+                    on_result(position, result)
+                self.emit(f"{job.progress}%", job.job_id)
+
+            self.emit("Progress updates complete", job.job_id)
+        except asyncio.CancelledError:
+            # work that hasn't been started by the executor is dropped. work that is already running finishes, but its
+            # results are discarded
+            for task in tasks:
+                task.cancel()
+            self.emit("Progress updates cancelled", job.job_id)
+            raise
+
+        return job.results
+
+    def submit(self, function, args, job_id=None, on_result=None):
+        '''
+        Submit a job and return it immediately. Its results can be waited on through job.future, and on_result(position,
+        result) is called (on the manager's loop) as each environment's result comes in
+        '''
+        job = RemedialJob(str(uuid.uuid4()) if job_id is None else job_id, len(args))
+
+        # the queue must be bound to the loop that will consume it
+        async def start():
+            job.queue = asyncio.Queue()
+            return await self.run_job(job, function, args, on_result=on_result)
+
+        with self.lock:
+            if job.job_id in self.jobs:
+                raise ValueError("Job {} is already running".format(job.job_id))
+            self.jobs[job.job_id] = job
+            job.future = asyncio.run_coroutine_threadsafe(start(), self.loop)
+        job.future.add_done_callback(lambda _: self.release(job.job_id))
+
+        return job
+
+    def run(self, function, args, job_id=None, on_result=None):
+        '''
+        Submit a job and block until it completes. Raises concurrent.futures.CancelledError if the job is cancelled
+        '''
+        return self.submit(function, args, job_id=job_id, on_result=on_result).future.result()
+
+    async def run_async(self, function, args, job_id=None, on_result=None):
+        '''
+        Submit a job and await its completion from another event loop (e.g. the web server's)
+        '''
+        return await asyncio.wrap_future(self.submit(function, args, job_id=job_id, on_result=on_result).future)
+
+    def release(self, job_id):
+        with self.lock:
+            self.jobs.pop(job_id, None)
+
+    def cancel(self, job_id):
+        '''
+        Cancel a running job (e.g. from a socketio disconnect handler). Returns whether there was a job to cancel
+        '''
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return False
+
+        return job.future.cancel()
+
+    def shutdown(self):
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        if self.owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.loop.call_soon_threadsafe(self.loop.stop)
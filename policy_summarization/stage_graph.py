@@ -0,0 +1,249 @@
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import time
+import dill as pickle
+import numpy as np
+from termcolor import colored
+from policy_summarization import instrumentation
+
+def content_hash(obj):
+    '''
+    Stable hash of (nested) stage inputs. NumPy arrays are hashed by dtype, shape and contents, dicts irrespective of
+    key order, and scalars (None, bools, numbers, strings) by their repr. Other types raise a TypeError, since their
+    repr isn't guaranteed to be stable across runs (e.g. it may contain a memory address)
+    '''
+    hasher = hashlib.sha256()
+
+    def update(obj):
+        if isinstance(obj, np.ndarray):
+            hasher.update('ndarray{}{}'.format(obj.dtype.str, obj.shape).encode())
+            hasher.update(np.ascontiguousarray(obj).tobytes())
+        elif isinstance(obj, dict):
+            hasher.update(b'dict')
+            for key in sorted(obj, key=repr):
+                update(key)
+                update(obj[key])
+        elif isinstance(obj, (list, tuple)):
+            hasher.update('{}{}'.format(type(obj).__name__, len(obj)).encode())
+            for item in obj:
+                update(item)
+        elif obj is None or isinstance(obj, (bool, int, float, complex, str, bytes, np.generic)):
+            hasher.update(repr(obj).encode())
+        else:
+            raise TypeError('Cannot content hash an object of type {}'.format(type(obj).__name__))
+
+    update(obj)
+
+    return hasher.hexdigest()
+
+def lookup_code_version(modules):
+    '''
+    Hash of the source files of modules (module objects or dotted names. packages contribute every .py file under them),
+    including uncommitted edits, e.g. to record which code a benchmark was run with
+    '''
+    filenames = set()
+    for module in modules:
+        # dotted names are located without being imported
+        filename = os.path.abspath(importlib.util.find_spec(module).origin if isinstance(module, str) else module.__file__)
+        if os.path.basename(filename) == '__init__.py':
+            for root, _, files in os.walk(os.path.dirname(filename)):
+                filenames.update(os.path.join(root, f) for f in files if f.endswith('.py'))
+        else:
+            filenames.add(filename)
+
+    hasher = hashlib.sha256()
+    base_dir = os.path.commonpath(list(filenames)) if len(filenames) > 0 else ''
+    for filename in sorted(filenames):
+        hasher.update(os.path.relpath(filename, base_dir).encode())
+        with open(filename, 'rb') as f:
+            hasher.update(f.read())
+
+    return hasher.hexdigest()
+
+def atomic_pickle_dump(obj, filename):
+    '''
+    Pickle obj to filename such that readers (or a resumed run) never see a partially written file
+    '''
+    tmp_filename = '{}.tmp{}'.format(filename, os.getpid())
+    with instrumentation.span('pickle_dump'), open(tmp_filename, 'wb') as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_filename, filename)
+
+def atomic_json_dump(obj, filename):
+    '''
+    JSON counterpart of atomic_pickle_dump (e.g. for manifests)
+    '''
+    tmp_filename = '{}.tmp{}'.format(filename, os.getpid())
+    with open(tmp_filename, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_filename, filename)
+
+def checkpointed_imap(pool, func, args, checkpoint_dir, task_ids):
+    '''
+    Like pool.imap, except that each task's result is checkpointed to checkpoint_dir as it completes so that a stage
+    interrupted partway through only recomputes the tasks (e.g. environments) that hadn't finished. Results are yielded
+    in order
+    '''
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    checkpoint_filenames = [os.path.join(checkpoint_dir, 'task' + str(task_id).zfill(5) + '.pickle') for task_id in task_ids]
+
+    pending = [position for position, filename in enumerate(checkpoint_filenames) if not os.path.exists(filename)]
+    if len(pending) < len(args):
+        print(colored('Resuming from {} of {} checkpointed tasks'.format(len(args) - len(pending), len(args)), 'blue'))
+
+    results = pool.imap(func, [args[position] for position in pending])
+    pending = set(pending)
+    for position, filename in enumerate(checkpoint_filenames):
+        if position in pending:
+            result = next(results)
+            atomic_pickle_dump(result, filename)
+        else:
+            with open(filename, 'rb') as f:
+                result = pickle.load(f)
+        yield result
+
+class StageRunner():
+    '''
+    Run a pipeline of stages whose artifacts are saved under models/<data_loc>/. Each stage is keyed by a content hash
+    of its inputs, the keys of the stages it depends on and the version of the code it runs (recorded in
+    stage_manifest.json), so that up to date artifacts are loaded and stale ones are recomputed (with the reason printed)
+    rather than relying on whether an artifact happens to unpickle. Code versions are constants that are bumped
+    deliberately when a change alters a stage's results, so that unrelated edits never trigger a recomputation
+
+    :param code_version: optional version constant included in every stage's key (bump it to recompute everything)
+    '''
+    def __init__(self, data_loc, code_version=None):
+        self.data_loc = data_loc
+        self.code_version = code_version
+        self.manifest_filename = 'models/' + data_loc + '/stage_manifest.json'
+        self.timings = {}
+        self.keys = {}
+
+        if os.path.exists(self.manifest_filename):
+            with open(self.manifest_filename, 'r') as f:
+                self.manifest = json.load(f)
+            self.legacy = False
+        else:
+            # artifacts from runs predating the manifest are adopted rather than recomputed
+            self.manifest = {}
+            self.legacy = True
+
+    def artifact_filename(self, artifact):
+        return 'models/' + self.data_loc + '/' + artifact
+
+    def checkpoint_dir(self, name):
+        '''
+        Directory for the partial (e.g. per environment) results of a stage that is being computed. Checkpoints are
+        specific to the stage's key, so those of stale inputs are never resumed from
+        '''
+        return 'models/' + self.data_loc + '/stage_checkpoints/' + name + '/' + self.keys[name][:16]
+
+    def stage_key(self, name, inputs, depends_on, code_version=None):
+        upstream_keys = [self.manifest[dependency]['key'] for dependency in depends_on]
+        return content_hash((name, inputs, upstream_keys, self.code_version, code_version))
+
+    def save_manifest(self):
+        os.makedirs(os.path.dirname(self.manifest_filename), exist_ok=True)
+        atomic_json_dump(self.manifest, self.manifest_filename)
+
+    def load_artifact(self, name, artifact, validate):
+        filename = self.artifact_filename(artifact)
+        try:
+            with open(filename, 'rb') as f:
+                result = pickle.load(f)
+        except Exception as e:
+            print(colored('Recomputing stage {}: could not load {} ({!r})'.format(name, filename, e), 'red'))
+            return False, None
+
+        if validate is not None and not validate(result):
+            print(colored('Recomputing stage {}: {} has an unexpected format'.format(name, filename), 'red'))
+            return False, None
+
+        return True, result
+
+    def quarantine(self, name, old_key, owned_paths):
+        '''
+        Move the files that an invalidated stage wrote itself (e.g. per environment results that its compute function
+        resumes from) out of the way, so that they're neither trusted nor lost
+        '''
+        stale_dir = 'models/' + self.data_loc + '/stale/' + name + '/' + old_key[:16]
+        for path in owned_paths:
+            filename = self.artifact_filename(path)
+            if os.path.exists(filename):
+                os.makedirs(os.path.dirname(os.path.join(stale_dir, path)), exist_ok=True)
+                shutil.move(filename, os.path.join(stale_dir, path))
+                print(colored('Moved stale {} to {}'.format(filename, os.path.join(stale_dir, path)), 'red'))
+
+    def run(self, name, compute, inputs=None, depends_on=(), artifact=None, validate=None, owned_paths=(), code_version=None):
+        '''
+        Return the result of a stage, computing it (and saving it to artifact) only if it isn't up to date
+
+        :param compute: function of no arguments computing the stage's result
+        :param inputs: (nested) inputs that the stage's result depends on
+        :param depends_on: names of upstream stages, which must already have been run
+        :param artifact: filename (relative to models/<data_loc>/) that the result is pickled to. Stages without an
+            artifact only record that they've completed (e.g. stages that write their own files)
+        :param validate: optional function checking that a loaded artifact has the expected format
+        :param owned_paths: files or directories (relative to models/<data_loc>/) that compute writes and resumes from
+            itself. They're quarantined (see quarantine()) when the stage is recomputed because its key changed
+        :param code_version: version constant of the code computing the stage, to be bumped when a change alters its
+            result. Upstream stages' versions are already covered through their keys
+        '''
+        key = self.stage_key(name, inputs, depends_on, code_version)
+        self.keys[name] = key
+        entry = self.manifest.get(name)
+
+        if entry is not None and entry['key'] == key and entry.get('in_progress'):
+            print(colored('Resuming stage {}'.format(name), 'blue'))
+        elif entry is not None and entry['key'] == key:
+            if artifact is None:
+                print(colored('Stage {} is up to date'.format(name), 'blue'))
+                return None
+            loaded, result = self.load_artifact(name, artifact, validate)
+            if loaded:
+                print(colored('Stage {} is up to date'.format(name), 'blue'))
+                return result
+        elif entry is None and self.legacy and artifact is not None and os.path.exists(self.artifact_filename(artifact)):
+            loaded, result = self.load_artifact(name, artifact, validate)
+            if loaded:
+                print(colored('Stage {}: adopting existing {}'.format(name, self.artifact_filename(artifact)), 'blue'))
+                self.manifest[name] = {'key': key, 'artifact': artifact, 'seconds': None}
+                self.save_manifest()
+                return result
+        elif entry is not None:
+            print(colored('Recomputing stage {}: its inputs, upstream stages or code version changed'.format(name), 'red'))
+            self.quarantine(name, entry['key'], owned_paths)
+
+        if len(owned_paths) > 0:
+            # files written from here on belong to this key, which a resumed run must not quarantine
+            self.manifest[name] = {'key': key, 'artifact': artifact, 'seconds': None, 'in_progress': True}
+            self.save_manifest()
+
+        start_time = time.time()
+        with instrumentation.span('stage.' + name):
+            result = compute()
+        self.timings[name] = time.time() - start_time
+
+        if artifact is not None:
+            os.makedirs(os.path.dirname(self.artifact_filename(artifact)), exist_ok=True)
+            atomic_pickle_dump(result, self.artifact_filename(artifact))
+        self.manifest[name] = {'key': key, 'artifact': artifact, 'seconds': self.timings[name]}
+        self.save_manifest()
+
+        # the partial results are no longer needed once the stage has completed
+        shutil.rmtree('models/' + self.data_loc + '/stage_checkpoints/' + name, ignore_errors=True)
+
+        return result
+
+    def report(self):
+        '''
+        Print the time spent on each stage that was (re)computed during this run
+        '''
+        for name, entry in self.manifest.items():
+            if name in self.timings:
+                print('{:<24} {:>10.1f} s'.format(name, self.timings[name]))
+            else:
+                print('{:<24} {:>12}'.format(name, 'up to date'))
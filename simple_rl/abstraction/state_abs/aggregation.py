@@ -0,0 +1,129 @@
+''' aggregation.py: array-based clustering of states whose values (e.g. Q*(s, .)) are within epsilon of each other '''
+
+# Python imports.
+import numpy as np
+
+def q_table_array(vi, states, actions):
+    '''
+    Args:
+        vi (ValueIteration): a planner that has been run
+        states (list)
+        actions (list)
+
+    Returns:
+        (np.ndarray): |S| x |A| array of vi.get_q_value(state, action), rows ordered as @states and columns as @actions.
+    '''
+    return np.array([[vi.get_q_value(state, action) for action in actions] for state in states], dtype=float).reshape(len(states), len(actions))
+
+def eps_equivalence_clusters(values, epsilon=0.0):
+    '''
+    Args:
+        values (np.ndarray): |S| x D array (e.g. the Q table of q_table_array)
+        epsilon (float)
+
+    Returns:
+        (np.ndarray): |S| cluster labels (0, 1, ... in order of each cluster's first row).
+
+    Summary:
+        Clusters the rows of @values so that rows i and j whose values are all within @epsilon
+        (max_d |values[i, d] - values[j, d]| <= epsilon, as in indicator_funcs._q_eps_approx_indicator) are in the
+        same cluster. Clusters are the connected components of that relation (found with union-find), so for
+        epsilon > 0 two states can share a cluster through a chain of close states.
+
+        With epsilon = 0 rows are grouped by sorting. Otherwise rows are sorted by the column with the largest spread,
+        and each row is only compared (as one array operation) with the following rows whose value in that column is
+        within epsilon.
+    '''
+    values = _finite_values(np.asarray(values, dtype=float).reshape(len(values), -1), epsilon)
+    num_rows = values.shape[0]
+    if num_rows == 0:
+        return np.zeros(0, dtype=int)
+
+    if epsilon == 0.0:
+        # Identical rows.
+        return _first_seen_labels(np.unique(values, axis=0, return_inverse=True)[1].reshape(-1))
+
+    parent = np.arange(num_rows)
+    sort_col = np.argmax(values.max(axis=0) - values.min(axis=0))
+    order = np.argsort(values[:, sort_col], kind="stable")
+    sorted_values = values[order]
+    window_ends = np.searchsorted(sorted_values[:, sort_col], sorted_values[:, sort_col] + epsilon, side="right")
+
+    for i in range(num_rows):
+        if window_ends[i] <= i + 1:
+            continue
+        candidates = sorted_values[i + 1:window_ends[i]]
+        close = np.flatnonzero(np.abs(candidates - sorted_values[i]).max(axis=1) <= epsilon)
+        if len(close) == 0:
+            continue
+
+        # Union the roots of the close rows (usually already one component) with the root of row i.
+        root = _find(parent, order[i])
+        for other_root in np.unique(_find_all(parent, order[i + 1 + close])):
+            if other_root != root:
+                parent[other_root] = root
+
+    return _first_seen_labels(_find_all(parent, np.arange(num_rows)))
+
+def pairwise_clusters(states, indicator):
+    '''
+    Args:
+        states (list)
+        indicator (function): (state_x, state_y) -> bool
+
+    Returns:
+        (np.ndarray): cluster labels of @states (as in eps_equivalence_clusters) for indicator functions that have no
+        array form, by calling @indicator on every pair of states.
+    '''
+    parent = np.arange(len(states))
+    for i, state_x in enumerate(states):
+        for j in range(i + 1, len(states)):
+            if indicator(state_x, states[j]):
+                root_x, root_y = _find(parent, i), _find(parent, j)
+                if root_x != root_y:
+                    parent[root_y] = root_x
+
+    return _first_seen_labels(_find_all(parent, np.arange(len(states))))
+
+def _finite_values(values, epsilon):
+    # Replace infinite values (e.g. the -inf Q value of a self-loop) with values more than epsilon away from every
+    # finite value, so that infinities only match the same infinity.
+    infinite = np.isinf(values)
+    if not infinite.any():
+        return values
+
+    finite_values = values[~infinite]
+    low, high = (finite_values.min(), finite_values.max()) if len(finite_values) > 0 else (0.0, 0.0)
+    values = values.copy()
+    values[values == -np.inf] = low - 2 * epsilon - 1
+    values[values == np.inf] = high + 2 * epsilon + 1
+    return values
+
+def _find(parent, i):
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+
+    # Path compression.
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+
+    return root
+
+def _find_all(parent, idxs):
+    roots = parent[idxs]
+    while True:
+        next_roots = parent[roots]
+        if np.array_equal(next_roots, roots):
+            break
+        roots = next_roots
+
+    parent[idxs] = roots
+    return roots
+
+def _first_seen_labels(labels):
+    # Relabel so clusters are numbered in order of their first row.
+    _, first_rows, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    rank = np.empty(len(first_rows), dtype=int)
+    rank[np.argsort(first_rows)] = np.arange(len(first_rows))
+    return rank[inverse.reshape(-1)]
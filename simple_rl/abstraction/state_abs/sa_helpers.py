@@ -3,13 +3,14 @@ from __future__ import print_function
 from collections import defaultdict
 import sys
 import random
-import itertools
+import numpy as np
 
 # Other imports.
 from simple_rl.planning.ValueIterationClass import ValueIteration
 from simple_rl.mdp import State
 from simple_rl.mdp import MDPDistribution
 from simple_rl.abstraction.state_abs import indicator_funcs as ind_funcs
+from simple_rl.abstraction.state_abs import aggregation
 from simple_rl.abstraction.state_abs.StateAbstractionClass import StateAbstraction
 
 def merge_state_abstr(list_of_state_abstr, states):
@@ -25,35 +26,18 @@ def merge_state_abstr(list_of_state_abstr, states):
         Merges all state abstractions in @list_of_state_abstr by taking the
         intersection over safe clusterability.
     '''
-
-    safe_state_pairings = defaultdict(list)
-    # For each state pair...
-    for s_1, s_2 in itertools.product(states, repeat=2):
-        safely_clustered_pair = True
-        for state_abstr in list_of_state_abstr:
-            if state_abstr.phi(s_1) != state_abstr.phi(s_2):
-                safely_clustered_pair = False
-                break
-
-        if safely_clustered_pair:
-            safe_state_pairings[s_1] += [s_2]
-            safe_state_pairings[s_2] += [s_1]
-
-    # Now we have a dict of safe state pairs, merge them.
-    phi = defaultdict(list)
-    cluster_counter = 0
-    for state in safe_state_pairings.keys():
-        for safe_other_state in safe_state_pairings[state]:
-            if state not in phi.keys() and safe_other_state not in phi.keys():
-                phi[state] = State(cluster_counter)
-                phi[safe_other_state] = State(cluster_counter)
-            elif state in phi.keys():
-                phi[safe_other_state] = phi[state]
-            elif safe_other_state in phi.keys():
-                phi[state] = phi[safe_other_state]
-
-            # Increment counter
-            cluster_counter += 1
+    # Two states are safely clustered iff they share a cluster in every abstraction, i.e. iff their rows of
+    # cluster ids are equal. States an abstraction doesn't cover (e.g. unreachable in its MDP) get their own id.
+    cluster_ids = np.zeros((len(states), len(list_of_state_abstr)))
+    for j, state_abstr in enumerate(list_of_state_abstr):
+        abs_state_ids = {}
+        ground_states = state_abstr.get_ground_states()
+        for i, state in enumerate(states):
+            abs_state = state_abstr.phi(state) if state in ground_states else (None, i)
+            cluster_ids[i, j] = abs_state_ids.setdefault(abs_state, len(abs_state_ids))
+
+    labels = aggregation.eps_equivalence_clusters(cluster_ids, epsilon=0.0)
+    phi = {state: State(int(label)) for state, label in zip(states, labels)}
 
     return StateAbstraction(phi, states)
 
@@ -69,7 +53,6 @@ def make_sa(mdp, indic_func=ind_funcs._q_eps_approx_indicator, state_class=State
         Creates and saves a state abstraction.
     '''
     print("  Making state abstraction... ")
-    q_equiv_sa = StateAbstraction(phi={}, track_act_opt_pr=track_act_opt_pr)
     if isinstance(mdp, MDPDistribution):
         q_equiv_sa = make_multitask_sa(mdp, state_class=state_class, indic_func=indic_func, epsilon=epsilon, track_act_opt_pr=track_act_opt_pr)
     else:
@@ -104,6 +87,40 @@ def make_multitask_sa(mdp_distr, state_class=State, indic_func=ind_funcs._q_eps_
 
     return multitask_sa
 
+def indicator_values(indic_func, vi, states, actions, epsilon=0.0):
+    '''
+    Args:
+        indic_func (S x S --> {0,1})
+        vi (ValueIteration)
+        states (list)
+        actions (list)
+        epsilon (float)
+
+    Returns:
+        (tuple): (np.ndarray: |S| x D values, float: epsilon) such that two states satisfy @indic_func iff their rows
+        are within the returned epsilon (see aggregation.eps_equivalence_clusters), or None if @indic_func has no
+        array form.
+    '''
+    if indic_func not in [ind_funcs._q_eps_approx_indicator, ind_funcs._v_approx_indicator,
+                          ind_funcs._q_disc_approx_indicator, ind_funcs._v_disc_approx_indicator]:
+        return None
+
+    q_table = aggregation.q_table_array(vi, states, actions)
+    if indic_func == ind_funcs._q_eps_approx_indicator or (indic_func == ind_funcs._q_disc_approx_indicator and epsilon == 0.0):
+        return q_table, epsilon
+    elif indic_func == ind_funcs._q_disc_approx_indicator:
+        # Same bucket for every action.
+        v_max = 1
+        return np.trunc(q_table * (v_max / epsilon)), 0.0
+
+    values = q_table.max(axis=1)[:, None]
+    if indic_func == ind_funcs._v_approx_indicator or epsilon == 0.0:
+        return values, epsilon
+
+    # Same value bucket.
+    v_max = 1 / (1 - 0.95)
+    return np.trunc((values / v_max) / epsilon), 0.0
+
 def make_singletask_sa(mdp, indic_func, state_class, epsilon=0.0, aa_single_act=False, prob_of_mdp=1.0, track_act_opt_pr=False):
     '''
     Args:
@@ -114,6 +131,11 @@ def make_singletask_sa(mdp, indic_func, state_class, epsilon=0.0, aa_single_act=
 
     Returns:
         (StateAbstraction)
+
+    Summary:
+        Clusters the states that are connected by @indic_func. The indicators of indicator_funcs that compare Q or V
+        values are evaluated on the |S| x |A| Q table at once (see aggregation.py); other indicators are called on
+        every pair of states.
     '''
 
     print("\tRunning VI...",)
@@ -128,35 +150,21 @@ def make_singletask_sa(mdp, indic_func, state_class, epsilon=0.0, aa_single_act=
 
     print("\tMaking state abstraction...",)
     sys.stdout.flush()
-    sa = StateAbstraction(phi={}, state_class=state_class, track_act_opt_pr=track_act_opt_pr)
-    clusters = defaultdict(list)
-    num_states = len(vi.get_states())
-
+    states = vi.get_states()
+    num_states = len(states)
     actions = mdp.get_actions()
-    # Find state pairs that satisfy the condition.
-    for i, state_x in enumerate(vi.get_states()):
-        sys.stdout.flush()
-        clusters[state_x] = [state_x]
 
-        for state_y in vi.get_states()[i:]:
-            if not (state_x == state_y) and indic_func(state_x, state_y, vi, actions, epsilon=epsilon):
-                clusters[state_x].append(state_y)
-                clusters[state_y].append(state_x)
+    values_and_eps = indicator_values(indic_func, vi, states, actions, epsilon=epsilon)
+    if values_and_eps is not None:
+        labels = aggregation.eps_equivalence_clusters(*values_and_eps)
+    else:
+        labels = aggregation.pairwise_clusters(states, lambda state_x, state_y: indic_func(state_x, state_y, vi, actions, epsilon=epsilon))
 
-    print("making clusters...",)
-    sys.stdout.flush()
-    
     # Build SA.
-    for i, state in enumerate(clusters.keys()):
-        new_cluster = clusters[state]
-        sa.make_cluster(new_cluster)
-
-        # Destroy old so we don't double up.
-        for s in clusters[state]:
-            if s in clusters.keys():
-                clusters.pop(s)
-    
-    if aa_single_act:
+    phi = {state: state_class(int(label)) for state, label in zip(states, labels)}
+    sa = StateAbstraction(phi, states)
+
+    if aa_single_act and hasattr(sa, "set_actions_state_opt_dict"):
         # Put all optimal actions in a set associated with the ground state.
         for ground_s in sa.get_ground_states():
             a_star_set = set(vi.get_max_q_actions(ground_s))
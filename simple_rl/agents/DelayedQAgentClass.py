@@ -13,13 +13,14 @@ from collections import defaultdict
 
 # Other imports.
 from simple_rl.agents.AgentClass import Agent
+from simple_rl.utils.array_q_table import ArrayQTable, max_q_action, softmax_action_distr
 
 class DelayedQAgent(Agent):
     '''
     Delayed-Q Learning Agent (Strehl, A.L., Li, L., Wiewiora, E., Langford, J. and Littman, M.L., 2006. PAC model-free reinforcement learning).
     '''
 
-    def __init__(self, actions, init_q=None, name="Delayed-Q", gamma=0.99, m=5, epsilon1=0.1):
+    def __init__(self, actions, init_q=None, name="Delayed-Q", gamma=0.99, m=5, epsilon1=0.1, q_storage="dict"):
         '''
         Args:
             actions (list): Contains strings denoting the actions.
@@ -28,10 +29,17 @@ class DelayedQAgent(Agent):
             gamma (float): discount factor
             m (float): Number of samples for updating Q-value
             epsilon1 (float): Learning rate
+            q_storage (str): One of {dict, array}. If array, Q is stored in an ArrayQTable (see utils/array_q_table.py).
         '''
         # Set initial q func.
         self.rmax = 1  # TODO: set/get function
-        init_q = defaultdict(lambda : defaultdict(lambda: self.rmax / (1 - gamma))) if init_q is None else init_q
+        if q_storage not in ["dict", "array"]:
+            raise ValueError("(simple_rl) DelayedQAgent Error: q_storage must be one of {dict, array}.")
+        self.q_storage = q_storage
+        if q_storage == "array":
+            init_q = ArrayQTable(actions, self.rmax / (1 - gamma)) if init_q is None else self._to_array_q_table(init_q, actions, gamma)
+        else:
+            init_q = defaultdict(lambda : defaultdict(lambda: self.rmax / (1 - gamma))) if init_q is None else init_q
 
         Agent.__init__(self, name=name, actions=actions, gamma=gamma)
 
@@ -159,6 +167,9 @@ class DelayedQAgent(Agent):
         Returns:
             (tuple) --> (float, str): where the float is the Qval, str is the action.
         '''
+        if self.q_storage == "array":
+            return max_q_action(self.q_func.row_values(state), self.actions)
+
         # Grab random initial action in case all equal
         best_action = random.choice(self.actions)
         max_q_val = float("-inf")
@@ -215,6 +226,9 @@ class DelayedQAgent(Agent):
             (list of floats): The i-th float corresponds to the probability
             mass associated with the i-th action (indexing into self.actions)
         '''
+        if self.q_storage == "array":
+            return softmax_action_distr(self.q_func.row_values(state), beta)
+
         all_q_vals = []
         for i in range(len(self.actions)):
             action = self.actions[i]
@@ -244,6 +258,8 @@ class DelayedQAgent(Agent):
         Set initial Q-function.
         For PAC-MDP, initial Q(s, a) should be an upper bound of Q*(s, a).
         '''
+        if self.q_storage == "array":
+            q_func = self._to_array_q_table(q_func, self.actions, self.gamma)
         self.default_q_func = copy.deepcopy(q_func)
         self.q_func = copy.deepcopy(self.default_q_func)
 
@@ -256,3 +272,12 @@ class DelayedQAgent(Agent):
             for y in self.q_func[x]:
                 self.q_func[x][y] = vmax
                 self.default_q_func[x][y] = vmax
+
+    def _to_array_q_table(self, q_func, actions, gamma):
+        '''
+        Returns:
+            (ArrayQTable): @q_func (state -> action -> q value) as an ArrayQTable, whose other entries are Vmax.
+        '''
+        if isinstance(q_func, ArrayQTable):
+            return q_func
+        return ArrayQTable.from_dict(q_func, actions, self.rmax / (1 - gamma))
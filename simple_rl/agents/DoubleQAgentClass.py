@@ -9,16 +9,17 @@ Author: David Abel
 
 # Python imports.
 import random
-from collections import defaultdict
+import numpy
 
 # Other imports
 from simple_rl.agents.QLearningAgentClass import QLearningAgent
 from simple_rl.agents.AgentClass import Agent
+from simple_rl.utils.array_q_table import max_q_action
 
 class DoubleQAgent(QLearningAgent):
     ''' Class for an agent using Double Q Learning. '''
 
-    def __init__(self, actions, name="Double-Q", alpha=0.05, gamma=0.99, epsilon=0.1, explore="uniform", anneal=False):
+    def __init__(self, actions, name="Double-Q", alpha=0.05, gamma=0.99, epsilon=0.1, explore="uniform", anneal=False, q_storage="dict", states=None):
         '''
         Args:
             actions (list): Contains strings denoting the actions.
@@ -27,12 +28,13 @@ class DoubleQAgent(QLearningAgent):
             gamma (float): Discount factor.
             epsilon (float): Exploration term.
             explore (str): One of {softmax, uniform}. Denotes explore policy.
+            q_storage (str): One of {dict, array}. See QLearningAgent.
+            states (list): Optional states that the ArrayQTables index up front.
         '''
-        QLearningAgent.__init__(self, actions, name=name, alpha=alpha, gamma=gamma, epsilon=epsilon, explore=explore, anneal=anneal)
+        QLearningAgent.__init__(self, actions, name=name, alpha=alpha, gamma=gamma, epsilon=epsilon, explore=explore, anneal=anneal, q_storage=q_storage, states=states)
 
         # Make two q functions.
-        self.q_funcs = {"A":defaultdict(lambda : defaultdict(lambda: self.default_q)), \
-                        "B":defaultdict(lambda : defaultdict(lambda: self.default_q))}
+        self.q_funcs = {"A":self._make_q_func(), "B":self._make_q_func()}
 
     def act(self, state, reward):
         '''
@@ -126,6 +128,9 @@ class DoubleQAgent(QLearningAgent):
         Returns:
             (tuple) --> (float, str): where the float is the Qval, str is the action.
         '''
+        if self.q_storage == "array":
+            return max_q_action(self.get_q_values(state, q_func_id), self.actions)
+
         # Grab random initial action in case all equal
         best_action = random.choice(self.actions)
         max_q_val = float("-inf")
@@ -157,11 +162,25 @@ class DoubleQAgent(QLearningAgent):
         else:
             return self.q_funcs[q_func_id][state][action]
 
+    def get_q_values(self, state, q_func_id=None):
+        '''
+        Args:
+            state (State)
+            q_func_id (str): either "A", "B", or defaults to taking the average.
+
+        Returns:
+            (numpy.ndarray): the q values of @state, ordered as self.actions.
+        '''
+        if self.q_storage != "array":
+            return numpy.array([self.get_q_value(state, action, q_func_id) for action in self.actions])
+        if q_func_id is None:
+            return (self.q_funcs["A"].row_values(state) + self.q_funcs["B"].row_values(state)) / 2.0
+        return self.q_funcs[q_func_id].row_values(state)
+
     def reset(self):
         self.step_number = 0
         self.episode_number = 0
-        self.q_funcs = {"A":defaultdict(lambda : defaultdict(lambda: self.default_q)), \
-                        "B":defaultdict(lambda : defaultdict(lambda: self.default_q))}
+        self.q_funcs = {"A":self._make_q_func(), "B":self._make_q_func()}
         Agent.reset(self)
 
     # ---- DOUBLE Q NEW ----
@@ -8,11 +8,12 @@ from collections import defaultdict
 
 # Other imports.
 from simple_rl.agents.AgentClass import Agent
+from simple_rl.utils.array_q_table import ArrayQTable, max_q_action, softmax_action_distr
 
 class QLearningAgent(Agent):
     ''' Implementation for a Q Learning Agent '''
 
-    def __init__(self, actions, name="Q-learning", alpha=0.1, gamma=0.99, epsilon=0.1, explore="uniform", anneal=False, custom_q_init=None, default_q=0):
+    def __init__(self, actions, name="Q-learning", alpha=0.1, gamma=0.99, epsilon=0.1, explore="uniform", anneal=False, custom_q_init=None, default_q=0, q_storage="dict", states=None):
         '''
         Args:
             actions (list): Contains strings denoting the actions.
@@ -23,6 +24,9 @@ class QLearningAgent(Agent):
             explore (str): One of {softmax, uniform}. Denotes explore policy.
             custom_q_init (defaultdict{state, defaultdict{action, float}}): a dictionary of dictionaries storing the initial q-values. Can be used for potential shaping (Wiewiora, 2003)
             default_q (float): the default value to initialize every entry in the q-table with [by default, set to 0.0]
+            q_storage (str): One of {dict, array}. If array, Q is stored in an ArrayQTable (see utils/array_q_table.py),
+                which makes updates and action selection array operations.
+            states (list): Optional states (e.g. from MDP.get_states()) that the ArrayQTable indexes up front.
         '''
         name_ext = "-" + explore if explore != "uniform" else ""
         Agent.__init__(self, name=name + name_ext, actions=actions, gamma=gamma)
@@ -35,12 +39,13 @@ class QLearningAgent(Agent):
         self.default_q = default_q # 0 # 1 / (1 - self.gamma)
         self.explore = explore
         self.custom_q_init = custom_q_init
+        if q_storage not in ["dict", "array"]:
+            raise ValueError("(simple_rl) QLearningAgent Error: q_storage must be one of {dict, array}.")
+        self.q_storage = q_storage
+        self.q_table_states = states
 
         # Q Function:
-        if self.custom_q_init:
-            self.q_func = self.custom_q_init
-        else:
-            self.q_func = defaultdict(lambda: defaultdict(lambda: self.default_q))
+        self.q_func = self._make_q_func()
 
         # Key: state
         # Val: dict
@@ -150,6 +155,12 @@ class QLearningAgent(Agent):
             return
 
         # Update the Q Function.
+        if self.q_storage == "array":
+            max_q_curr_state = self.q_func.row_values(next_state).max()
+            row, col = self.q_func.state_row(state), self.q_func.action_index[action]
+            self.q_func.q_values[row, col] = (1 - self.alpha) * self.q_func.q_values[row, col] + self.alpha * (reward + self.gamma*max_q_curr_state)
+            return
+
         max_q_curr_state = self.get_max_q_value(next_state)
         prev_q_val = self.get_q_value(state, action)
         self.q_func[state][action] = (1 - self.alpha) * prev_q_val + self.alpha * (reward + self.gamma*max_q_curr_state)
@@ -168,6 +179,9 @@ class QLearningAgent(Agent):
         Returns:
             (tuple) --> (float, str): where the float is the Qval, str is the action.
         '''
+        if self.q_storage == "array":
+            return max_q_action(self.get_q_values(state), self.actions)
+
         # Grab random initial action in case all equal
         best_action = random.choice(self.actions)
         max_q_val = float("-inf")
@@ -224,6 +238,18 @@ class QLearningAgent(Agent):
         '''
         return self.q_func[state][action]
 
+    def get_q_values(self, state):
+        '''
+        Args:
+            state (State)
+
+        Returns:
+            (numpy.ndarray): the q values of @state, ordered as self.actions.
+        '''
+        if self.q_storage == "array":
+            return self.q_func.row_values(state)
+        return numpy.array([self.get_q_value(state, action) for action in self.actions])
+
     def get_action_distr(self, state, beta=0.2):
         '''
         Args:
@@ -234,6 +260,9 @@ class QLearningAgent(Agent):
             (list of floats): The i-th float corresponds to the probability
             mass associated with the i-th action (indexing into self.actions)
         '''
+        if self.q_storage == "array":
+            return softmax_action_distr(self.get_q_values(state), beta)
+
         all_q_vals = []
         for i, action in enumerate(self.actions):
             all_q_vals.append(self.get_q_value(state, action))
@@ -247,12 +276,23 @@ class QLearningAgent(Agent):
     def reset(self):
         self.step_number = 0
         self.episode_number = 0
-        if self.custom_q_init:
-            self.q_func = self.custom_q_init
-        else:
-            self.q_func = defaultdict(lambda : defaultdict(lambda: self.default_q))
+        self.q_func = self._make_q_func()
         Agent.reset(self)
 
+    def _make_q_func(self):
+        '''
+        Returns:
+            (dict or ArrayQTable): an initial Q function, stored according to self.q_storage.
+        '''
+        if self.q_storage == "array":
+            if self.custom_q_init:
+                return ArrayQTable.from_dict(self.custom_q_init, self.actions, self.default_q)
+            return ArrayQTable(self.actions, self.default_q, states=self.q_table_states)
+
+        if self.custom_q_init:
+            return self.custom_q_init
+        return defaultdict(lambda : defaultdict(lambda: self.default_q))
+
     def end_of_episode(self):
         '''
         Summary:
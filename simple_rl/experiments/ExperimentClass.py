@@ -15,6 +15,8 @@ from collections import defaultdict
 # Other imports.
 from simple_rl.utils import chart_utils
 from simple_rl.experiments.ExperimentParametersClass import ExperimentParameters
+from simple_rl.experiments import ResultSinkClass
+from simple_rl.experiments.ResultSinkClass import ResultSink
 
 class Experiment(object):
 
@@ -42,7 +44,8 @@ class Experiment(object):
                     dir_for_plot="",
                     experiment_name_prefix="",
                     track_success=False,
-                    success_reward=None):
+                    success_reward=None,
+                    results_format="csv"):
         '''
         Args:
             agents (list)
@@ -60,6 +63,7 @@ class Experiment(object):
             experiment_name_prefix (str)
             track_success (bool)
             success_reward (int)
+            results_format (str): "csv" or "npz" (see ResultSinkClass.py).
         '''
         # Store all relevant bools.
         self.agents = agents
@@ -85,6 +89,7 @@ class Experiment(object):
         self.is_markov_game = is_markov_game
         self.track_success = track_success
         self.success_reward = success_reward
+        self.result_sink = ResultSink(self.exp_directory, results_format)
         self._setup_files(clear_old_results)
 
         # Write experiment reproduction file.
@@ -164,12 +169,9 @@ class Experiment(object):
             os.makedirs(self.exp_directory)
         elif clear_old_results:
             for agent in self.agents:
-                if os.path.exists(os.path.join(self.exp_directory, str(agent)) + ".csv"):
-                    os.remove(os.path.join(self.exp_directory, str(agent)) + ".csv")
-                if os.path.exists(os.path.join(self.exp_directory, "times", str(agent)) + ".csv"):
-                    os.remove(os.path.join(self.exp_directory, "times", str(agent)) + ".csv")
-                if os.path.exists(os.path.join(self.exp_directory, "success", str(agent)) + ".csv"):
-                    os.remove(os.path.join(self.exp_directory, "success", str(agent)) + ".csv")
+                ResultSinkClass.remove_results(self.exp_directory, str(agent))
+                ResultSinkClass.remove_results(os.path.join(self.exp_directory, "times"), str(agent))
+                ResultSinkClass.remove_results(os.path.join(self.exp_directory, "success"), str(agent))
         self.write_exp_info_to_file()
 
     def make_plots(self, open_plot=True):
@@ -177,6 +179,8 @@ class Experiment(object):
         Summary:
             Makes plots for the current experiment.
         '''
+        self.result_sink.flush()
+
         if self.is_markov_game:
             agent_name_ls = [agent_name for agent_name in self.agents.keys()]
         else:
@@ -206,22 +210,13 @@ class Experiment(object):
                                 new_y_label="Avg. Success %")
 
     def _write_extra_datum_to_file(self, mdp_name, agent, datum, datum_name):
-        out_file = open(os.path.join(self.exp_directory, str(agent)) + "-" + datum_name + ".csv", "a+")
-        out_file.write(str(datum) + ",")
-        out_file.close()
+        self.result_sink.write_datum(str(agent) + "-" + datum_name, datum)
 
     def get_agent_avg_cumulative_rew(self, agent):
-        result_file = open(os.path.join(self.exp_directory, str(agent)) + ".csv", "r")
-        
-        total = 0
-        num_lines = 0
-        for line in result_file.readlines():
-            total += sum([float(datum) for datum in line.strip().split(",")[:-1]])
-            num_lines += 1
-
-        result_file.close()
+        self.result_sink.flush()
+        rows = ResultSinkClass.load_results(self.exp_directory, str(agent))
 
-        return total / num_lines
+        return sum([sum(row) for row in rows]) / len(rows)
 
     def add_experience(self, agent, state, action, reward, next_state, time_taken=0):
         '''
@@ -274,33 +269,24 @@ class Experiment(object):
     def end_of_instance(self, agent):
         '''
         Summary:
-            Adds a new line to indicate we're onto a new instance.
+            Ends the row of each results file to indicate we're onto a new instance.
         '''
-        #
-        out_file = open(os.path.join(self.exp_directory, str(agent)) + ".csv", "a+")
-        out_file.write("\n")
-        out_file.close()
+        self.result_sink.end_row(str(agent))
 
         if self.track_success:
-            out_file = open(os.path.join(self.exp_directory, "success", str(agent)) + ".csv", "a+")
-            out_file.write("\n")
-            out_file.close()
+            self.result_sink.end_row(str(agent), extra_dir="success")
 
         if os.path.isdir(os.path.join(self.exp_directory, "times", "")):
-            out_file = open(os.path.join(self.exp_directory, "times", str(agent)) + ".csv", "a+")
-            out_file.write("\n")
-            out_file.close()
+            self.result_sink.end_row(str(agent), extra_dir="times")
 
     def write_datum_to_file(self, agent, datum, extra_dir=""):
         '''
         Summary:
-            Writes datum to file.
+            Buffers datum in the result sink, which writes it to file.
         '''
         if extra_dir != "" and not os.path.isdir(self.exp_directory + "/" + extra_dir):
             os.makedirs(os.path.join(self.exp_directory, extra_dir))
-        out_file = open(os.path.join(self.exp_directory, extra_dir, str(agent)) + ".csv", "a+")
-        out_file.write(str(datum) + ",")
-        out_file.close()
+        self.result_sink.write_datum(str(agent), datum, extra_dir=extra_dir)
 
     def write_exp_info_to_file(self):
         '''
@@ -0,0 +1,172 @@
+'''
+ResultSinkClass.py: Contains the ResultSink Class, which buffers an Experiment's results in memory and writes them in blocks.
+
+Purpose:
+    - Avoids opening, appending to and closing a results file for every datum.
+    - Stores results either as csv files (one line per instance, as before) or as blocks of npz files.
+    - Results flushed before a crash stay readable, since each block is written in full.
+'''
+
+# Python imports.
+from __future__ import print_function
+import atexit
+import glob
+import os
+import shutil
+import time
+from collections import defaultdict
+import numpy as np
+
+class ResultSink(object):
+
+    FORMATS = ["csv", "npz"]
+    BLOCK_DIR_SUFFIX = ".blocks"
+
+    ''' Buffered writer of per-instance rows of results '''
+
+    def __init__(self, directory, results_format="csv", block_size=10000, flush_interval=30):
+        '''
+        Args:
+            directory (str): the experiment directory.
+            results_format (str): one of ResultSink.FORMATS.
+            block_size (int): number of buffered data after which the buffers are flushed.
+            flush_interval (float): seconds after which the buffers are flushed (when the next datum is written).
+        '''
+        if results_format not in ResultSink.FORMATS:
+            raise ValueError("(simple_rl) ResultSink Error: results_format must be one of " + str(ResultSink.FORMATS) + ".")
+
+        self.directory = directory
+        self.results_format = results_format
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.values = defaultdict(list)
+        self.row_ends = defaultdict(list)
+        self.block_counts = defaultdict(int)
+        self.num_buffered = 0
+        self.last_flush = time.time()
+
+        # Flush whatever is buffered if the run exits early (e.g. on an exception).
+        atexit.register(self.flush)
+
+    def write_datum(self, name, datum, extra_dir=""):
+        '''
+        Args:
+            name (str): file name (without extension), e.g. the agent's name.
+            datum (float)
+            extra_dir (str)
+
+        Summary:
+            Adds datum to the current row of the file.
+        '''
+        self.values[os.path.join(extra_dir, name)].append(datum)
+        self._buffered()
+
+    def end_row(self, name, extra_dir=""):
+        '''
+        Summary:
+            Ends the current row of the file (e.g. at the end of an instance).
+        '''
+        key = os.path.join(extra_dir, name)
+        self.row_ends[key].append(len(self.values[key]))
+        self._buffered()
+
+    def _buffered(self):
+        self.num_buffered += 1
+        if self.num_buffered >= self.block_size or time.time() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        '''
+        Summary:
+            Writes the buffered data of every file.
+        '''
+        for key in set(self.values.keys()) | set(self.row_ends.keys()):
+            values, row_ends = self.values[key], self.row_ends[key]
+            if len(values) == 0 and len(row_ends) == 0:
+                continue
+
+            if self.results_format == "csv":
+                self._flush_csv(key, values, row_ends)
+            else:
+                self._flush_npz(key, values, row_ends)
+
+        self.values.clear()
+        self.row_ends.clear()
+        self.num_buffered = 0
+        self.last_flush = time.time()
+
+    def _flush_csv(self, key, values, row_ends):
+        # Rows end with a newline, and each datum with a comma (as read by load_results).
+        text = ""
+        start = 0
+        for end in row_ends:
+            text += "".join(str(datum) + "," for datum in values[start:end]) + "\n"
+            start = end
+        text += "".join(str(datum) + "," for datum in values[start:])
+
+        out_file = open(os.path.join(self.directory, key) + ".csv", "a+")
+        out_file.write(text)
+        out_file.close()
+
+    def _flush_npz(self, key, values, row_ends):
+        block_dir = os.path.join(self.directory, key) + ResultSink.BLOCK_DIR_SUFFIX
+        if not os.path.isdir(block_dir):
+            os.makedirs(block_dir)
+        if key not in self.block_counts:
+            # Append to the blocks of earlier runs (when old results aren't cleared).
+            self.block_counts[key] = len(glob.glob(os.path.join(block_dir, "block_*.npz")))
+
+        # Write to a temporary file and rename it, so a crash never leaves a partially written block.
+        block_file = os.path.join(block_dir, "block_" + str(self.block_counts[key]).zfill(6) + ".npz")
+        tmp_file = block_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez(f, values=np.array(values, dtype=float), row_ends=np.array(row_ends, dtype=int))
+        os.replace(tmp_file, block_file)
+        self.block_counts[key] += 1
+
+def remove_results(directory, name):
+    '''
+    Summary:
+        Removes the results (in either format) for @name in @directory.
+    '''
+    if os.path.exists(os.path.join(directory, name) + ".csv"):
+        os.remove(os.path.join(directory, name) + ".csv")
+    shutil.rmtree(os.path.join(directory, name) + ResultSink.BLOCK_DIR_SUFFIX, ignore_errors=True)
+
+def list_result_names(directory):
+    '''
+    Returns:
+        (list): names of the results files (in either format) in @directory.
+    '''
+    names = []
+    for file_name in sorted(os.listdir(directory)):
+        if os.path.isfile(os.path.join(directory, file_name)) and file_name.endswith(".csv"):
+            names.append(file_name[:-len(".csv")])
+        elif os.path.isdir(os.path.join(directory, file_name)) and file_name.endswith(ResultSink.BLOCK_DIR_SUFFIX):
+            names.append(file_name[:-len(ResultSink.BLOCK_DIR_SUFFIX)])
+    return names
+
+def load_results(directory, name):
+    '''
+    Args:
+        directory (str)
+        name (str)
+
+    Returns:
+        (list): A 2d matrix of the results of @name, where the dimensions are [row (instance)][datum]. Empty rows are
+        omitted.
+    '''
+    block_dir = os.path.join(directory, name) + ResultSink.BLOCK_DIR_SUFFIX
+    if os.path.isdir(block_dir):
+        values, row_ends = [], []
+        for block_file in sorted(glob.glob(os.path.join(block_dir, "block_*.npz"))):
+            with np.load(block_file) as block:
+                row_ends += [len(values) + end for end in block["row_ends"].tolist()]
+                values += block["values"].tolist()
+        rows = [values[start:end] for start, end in zip([0] + row_ends, row_ends + [len(values)])]
+    else:
+        results_file = open(os.path.join(directory, name) + ".csv", "r")
+        rows = [[float(datum) for datum in line.split(",")[:-1] if len(datum) > 0] for line in results_file.readlines()]
+        results_file.close()
+
+    return [row for row in rows if len(row) > 0]
@@ -0,0 +1,232 @@
+''' CompiledDynamicsClass.py: Contains the CompiledDynamics class, integer tables of an MDP's dynamics. '''
+
+# Python imports.
+import copy
+from collections import defaultdict
+import numpy as np
+
+class CompiledDynamics(object):
+    '''
+    Summary:
+        The dynamics of an MDP over its reachable states as integer tables, so that planners (e.g. MCTS) can simulate
+        many transitions at once with array operations instead of calling the transition and reward functions on
+        state objects. States are indexed by their order in self.states and actions by their order in self.actions.
+
+        Tables (S states, A actions, K = the max number of distinct next states of a (state, action) pair):
+            next_states (S x A x K int): the possible next states of each (state, action) pair
+            next_state_probs (S x A x K float): their probabilities (0 for padding)
+            rewards (S x A x K float): the reward of each transition
+            terminal (S bool): terminal states, which transition to themselves with a reward of 0
+            features (S x A x K x F float, optional): the reward features of each transition (e.g. from the MDP's
+                compute_reward_features), so that the rewards of other reward weights are a dot product away
+
+        check() compares the tables against the MDP's object-level transition and reward functions.
+    '''
+
+    def __init__(self, states, actions, next_states, next_state_probs, rewards, terminal, features=None):
+        self.states = states
+        self.state_index = {state: i for i, state in enumerate(states)}
+        self.actions = list(actions)
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+        self.next_states = next_states
+        self.next_state_probs = next_state_probs
+        self.cumulative_probs = np.cumsum(next_state_probs, axis=2)
+        self.rewards = rewards
+        self.terminal = terminal
+        self.features = features
+
+    @classmethod
+    def from_mdp(cls, mdp, sample_rate=None, max_states=None, features_func=None):
+        '''
+        Args:
+            mdp (MDP)
+            sample_rate (int): Number of samples of each transition used to estimate T(s' | s, a) (as in
+                ValueIteration). Defaults to the MDP's sample rate (1 suffices for deterministic MDPs).
+            max_states (int): If set, raises a ValueError if more than @max_states states are reachable.
+            features_func (function): (state, action, next_state) -> reward features, tabulated in self.features
+
+        Returns:
+            (CompiledDynamics)
+
+        Summary:
+            Lists the states reachable from the MDP's initial state (breadth first) and tabulates their transitions
+            and rewards.
+        '''
+        sample_rate = mdp.sample_rate if sample_rate is None else sample_rate
+        actions = mdp.get_actions()
+        transition_func, reward_func = mdp.get_transition_func(), mdp.get_reward_func()
+
+        states = [mdp.get_init_state()]
+        state_index = {states[0]: 0}
+        transitions = []  # per state, per action: dict next state index -> [prob, reward, features]
+        queue_pos = 0
+        while queue_pos < len(states):
+            state = states[queue_pos]
+            queue_pos += 1
+            state_transitions = [defaultdict(lambda: [0.0, 0.0, None]) for _ in actions]
+            transitions.append(state_transitions)
+            if state.is_terminal():
+                continue
+
+            for a, action in enumerate(actions):
+                for sample in range(sample_rate):
+                    # Transition functions may modify the state they're given.
+                    next_state = transition_func(copy.deepcopy(state), action)
+                    if next_state not in state_index:
+                        if max_states is not None and len(states) == max_states:
+                            raise ValueError("(simple_rl) CompiledDynamics Error: more than " + str(max_states) + " reachable states.")
+                        state_index[next_state] = len(states)
+                        states.append(next_state)
+                    transition = state_transitions[a][state_index[next_state]]
+                    transition[0] += 1.0 / sample_rate
+                    transition[1] = _to_float(reward_func(state, action, next_state))
+                    if features_func is not None:
+                        transition[2] = np.asarray(features_func(state, action, next_state), dtype=float).reshape(-1)
+
+        num_successors = max([1] + [len(action_transitions) for state_transitions in transitions for action_transitions in state_transitions])
+        next_states = np.zeros((len(states), len(actions), num_successors), dtype=int)
+        next_state_probs = np.zeros((len(states), len(actions), num_successors))
+        rewards = np.zeros((len(states), len(actions), num_successors))
+        terminal = np.array([state.is_terminal() for state in states], dtype=bool)
+        features = None
+        if features_func is not None:
+            num_features = len(next((transition[2] for state_transitions in transitions for action_transitions in state_transitions
+                                     for transition in action_transitions.values()), np.zeros(0)))
+            features = np.zeros((len(states), len(actions), num_successors, num_features))
+        for s, state_transitions in enumerate(transitions):
+            if terminal[s]:
+                next_states[s, :, 0] = s
+                next_state_probs[s, :, 0] = 1.0
+                continue
+            for a, action_transitions in enumerate(state_transitions):
+                for k, (next_s, (prob, reward, transition_features)) in enumerate(sorted(action_transitions.items())):
+                    next_states[s, a, k] = next_s
+                    next_state_probs[s, a, k] = prob
+                    rewards[s, a, k] = reward
+                    if features is not None:
+                        features[s, a, k] = transition_features
+
+        return cls(states, actions, next_states, next_state_probs, rewards, terminal, features=features)
+
+    def get_num_states(self):
+        return len(self.states)
+
+    def lookup_state_idx(self, state):
+        '''
+        Returns:
+            (int): the index of @state, or None if it isn't one of the compiled states.
+        '''
+        return self.state_index.get(state)
+
+    def sample_transition(self, state_idx, action_idx, rng=np.random):
+        '''
+        Returns:
+            (tuple): (int: next state index, float: reward) of a single (state, action) pair.
+        '''
+        k = 0
+        if self.next_states.shape[2] > 1:
+            cumulative_probs = self.cumulative_probs[state_idx, action_idx]
+            k = min(int(np.searchsorted(cumulative_probs, rng.random() * cumulative_probs[-1], side="right")), len(cumulative_probs) - 1)
+        return int(self.next_states[state_idx, action_idx, k]), float(self.rewards[state_idx, action_idx, k])
+
+    def sample_transitions(self, state_idxs, action_idxs, rng=np.random):
+        '''
+        Args:
+            state_idxs (np.ndarray of int)
+            action_idxs (np.ndarray of int)
+            rng (np.random.Generator or np.random)
+
+        Returns:
+            (tuple): (np.ndarray of int: next state indices, np.ndarray of float: rewards), one per (state, action) pair.
+        '''
+        cumulative_probs = self.cumulative_probs[state_idxs, action_idxs]
+        samples = rng.random(len(state_idxs)) * cumulative_probs[:, -1]
+        ks = np.minimum((cumulative_probs <= samples[:, None]).sum(axis=1), cumulative_probs.shape[1] - 1)
+        return self.next_states[state_idxs, action_idxs, ks], self.rewards[state_idxs, action_idxs, ks]
+
+    def reward_table(self, weights):
+        '''
+        Args:
+            weights (np.ndarray): reward weights (F, or 1 x F as in the OOMDPs)
+
+        Returns:
+            (np.ndarray): S x A x K rewards of each transition under @weights, from the feature table.
+        '''
+        if self.features is None:
+            raise ValueError("(simple_rl) CompiledDynamics Error: no feature table (compile with a features_func).")
+        return self.features.dot(np.asarray(weights, dtype=float).reshape(-1))
+
+    def solve(self, gamma, rewards=None, delta=1e-10, max_iterations=1000):
+        '''
+        Args:
+            gamma (float)
+            rewards (np.ndarray): S x A x K rewards to solve for (e.g. from reward_table()). Defaults to self.rewards.
+            delta (float): Stops once no value changes by more than @delta.
+            max_iterations (int)
+
+        Returns:
+            (tuple): (np.ndarray: S values, np.ndarray: S x A q values), by value iteration over the tables.
+                Terminal states have a value of 0.
+        '''
+        rewards = self.rewards if rewards is None else rewards
+        expected_rewards = (self.next_state_probs * rewards).sum(axis=2)
+        values = np.zeros(self.get_num_states())
+        q_values = expected_rewards
+        for i in range(max_iterations):
+            q_values = expected_rewards + gamma * (self.next_state_probs * values[self.next_states]).sum(axis=2)
+            q_values[self.terminal] = 0.0
+            next_values = q_values.max(axis=1)
+            max_diff = np.abs(next_values - values).max()
+            values = next_values
+            if max_diff <= delta:
+                break
+
+        return values, q_values
+
+    def check(self, mdp, features_func=None, sample_rate=1, atol=1e-8):
+        '''
+        Args:
+            mdp (MDP): the MDP the tables were compiled from
+            features_func (function): as given to from_mdp, to also check self.features
+            sample_rate (int): Number of transitions sampled from the MDP per (state, action) pair.
+            atol (float): Tolerance of reward and feature comparisons.
+
+        Returns:
+            (list of str): a description of each (state, action) pair whose sampled transitions disagree with the tables
+                (the next state isn't a possible next state, or its terminal flag, reward or features differ). Empty if
+                the tables match the MDP.
+
+        Summary:
+            Runs the MDP's transition and reward functions on every non-terminal compiled state.
+        '''
+        mismatches = []
+        if mdp.get_init_state() != self.states[0]:
+            mismatches.append("initial state " + str(mdp.get_init_state()) + " isn't the first compiled state")
+
+        transition_func, reward_func = mdp.get_transition_func(), mdp.get_reward_func()
+        for s, state in enumerate(self.states):
+            if self.terminal[s]:
+                continue
+            for a, action in enumerate(self.actions):
+                possible = self.next_state_probs[s, a] > 0
+                for sample in range(sample_rate):
+                    next_state = transition_func(copy.deepcopy(state), action)
+                    ks = np.flatnonzero(possible & (self.next_states[s, a] == self.state_index.get(next_state, -1)))
+                    description = "(" + str(state) + ", " + str(action) + ") -> " + str(next_state)
+                    if len(ks) == 0:
+                        mismatches.append(description + ": not a compiled next state")
+                        continue
+                    k = ks[0]
+                    if next_state.is_terminal() != self.terminal[self.next_states[s, a, k]]:
+                        mismatches.append(description + ": terminal flag differs")
+                    if abs(_to_float(reward_func(state, action, next_state)) - self.rewards[s, a, k]) > atol:
+                        mismatches.append(description + ": reward differs")
+                    if features_func is not None and self.features is not None and not np.allclose(
+                            np.asarray(features_func(state, action, next_state), dtype=float).reshape(-1), self.features[s, a, k], atol=atol):
+                        mismatches.append(description + ": features differ")
+
+        return mismatches
+
+def _to_float(reward):
+    # Feature-based reward functions return 1 x 1 arrays.
+    return float(np.asarray(reward, dtype=float).reshape(-1)[0])
@@ -3,3 +3,4 @@ from simple_rl.mdp.oomdp.OOMDPClass import OOMDP
 from simple_rl.mdp.MDPDistributionClass import MDPDistribution
 from simple_rl.mdp.MDPClass import MDP
 from simple_rl.mdp.StateClass import State
+from simple_rl.mdp.CompiledDynamicsClass import CompiledDynamics
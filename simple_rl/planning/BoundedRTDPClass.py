@@ -2,7 +2,7 @@
 
 # Python imports.
 from collections import defaultdict
-import copy
+import numpy as np
 
 # Other imports.
 from simple_rl.planning import Planner, ValueIteration
@@ -36,6 +36,7 @@ class BoundedRTDP(Planner):
         self.states = vi.get_states()
         vi._compute_matrix_from_trans_func()
         self.trans_dict = vi.trans_dict
+        self.successors = self._compute_successors()
 
         self.max_diff = (self.upper_values[self.mdp.init_state] - self.lower_values[self.mdp.init_state]) / tau
 
@@ -83,21 +84,21 @@ class BoundedRTDP(Planner):
     # ------------------
 
     def run_sample_trial(self, verbose=False):
-        init_state = self.mdp.init_state
-        state = copy.deepcopy(init_state)
+        # States are never modified during a trial, so the initial state needn't be copied.
+        state = self.mdp.init_state
         trajectory = SimpleRLStack()
         while not state.is_terminal():
             trajectory.push(state)
             self.upper_values[state] = self._best_qvalue(state, self.upper_values)
             action = self._greedy_action(state, self.lower_values)
             self.lower_values[state] = self._qvalue(state, action, self.lower_values)
-            expected_gap_distribution = self._expected_gap_distribution(state, action)
-            expected_gap = sum(expected_gap_distribution.values())
+            next_states, expected_gaps = self._expected_gap_distribution(state, action)
+            expected_gap = expected_gaps.sum()
             if verbose: print('{}\tAction: {}\tGap: {}\tMaxDiff: {}'.format(state, action, expected_gap, self.max_diff))
             if expected_gap < self.max_diff:
                 if verbose: print('Ending rollouts with gap {} and max_diff {}'.format(expected_gap, self.max_diff))
                 break
-            state = BoundedRTDP._pick_next_state(expected_gap_distribution, expected_gap)
+            state = BoundedRTDP._pick_next_state(next_states, expected_gaps)
         while not trajectory.is_empty():
             state = trajectory.pop()
             self.upper_values[state] = self._best_qvalue(state, self.upper_values)
@@ -107,8 +108,9 @@ class BoundedRTDP(Planner):
         return max([(self._qvalue(state, action, values), action) for action in self.actions])[1]
 
     def _qvalue(self, state, action, values):
-        return self.mdp.reward_func(state, action) + sum([self.trans_dict[state][action][next_state] * values[next_state] \
-                                                      for next_state in self.states])
+        expected_reward, next_states, probs = self.successors[state][action]
+        next_values = np.fromiter((values[next_state] for next_state in next_states), dtype=float, count=len(next_states))
+        return expected_reward + self.gamma * probs.dot(next_values)
 
     def _best_qvalue(self, state, values):
         return max([self._qvalue(state, action, values) for action in self.actions])
@@ -117,6 +119,28 @@ class BoundedRTDP(Planner):
     # -- Convenience Methods --
     # -------------------------
 
+    def _compute_successors(self):
+        '''
+        Returns:
+            successors (dict): state -> action -> (expected reward, next states, transition probabilities), where the
+                next states are the non-terminal states (ordered as self.states) with nonzero probability in trans_dict
+
+        Summary:
+            Sparse form of trans_dict, so that each backup only touches the states reachable in one step. Terminal
+            next states (which aren't in self.states) contribute their reward, but no value.
+        '''
+        state_idxs = {state: i for i, state in enumerate(self.states)}
+        successors = defaultdict(dict)
+        for state in self.states:
+            for action in self.actions:
+                next_state_probs = [(next_state, prob) for next_state, prob in self.trans_dict[state][action].items() if prob > 0]
+                expected_reward = sum([prob * self.reward_func(state, action, next_state) for next_state, prob in next_state_probs])
+                next_state_probs = sorted([(state_idxs[next_state], next_state, prob) for next_state, prob in next_state_probs if next_state in state_idxs],
+                                          key=lambda idx_state_prob: idx_state_prob[0])
+                successors[state][action] = (expected_reward, [next_state for _, next_state, _ in next_state_probs],
+                                             np.array([prob for _, _, prob in next_state_probs]))
+        return successors
+
     def _expected_gap_distribution(self, state, action):
         '''
         Weight the distribution representing our uncertainty over state values by the
@@ -126,27 +150,21 @@ class BoundedRTDP(Planner):
             action (str)
 
         Returns:
-            expected_gaps (defaultdict): weighted distribution over states of difference b/w upper and lower values
+            next_states (list): the states reachable by taking `action` from `state`
+            expected_gaps (np.ndarray): weighted difference b/w upper and lower values of each of next_states
         '''
-        expected_gaps = defaultdict()
-        for next_state in self.states:
-            gap = self.upper_values[next_state] - self.lower_values[next_state]
-            expected_gaps[next_state] = self.trans_dict[state][action][next_state] * gap
-        return expected_gaps
+        _, next_states, probs = self.successors[state][action]
+        gaps = np.fromiter((self.upper_values[next_state] - self.lower_values[next_state] for next_state in next_states), dtype=float, count=len(next_states))
+        return next_states, probs * gaps
 
     @staticmethod
-    def _pick_next_state(distribution, expected_gap):
+    def _pick_next_state(next_states, expected_gaps):
         '''
         Args:
-            distribution (defaultdict)
-            expected_gap (float)
+            next_states (list)
+            expected_gaps (np.ndarray)
 
         Returns:
-            state (State): sampled from a scaled version of `distribution`
+            state (State): the next state with the largest expected gap
         '''
-        def _scale_distribution(_distribution, scaling_factor):
-            for state in _distribution:
-                _distribution[state] *= scaling_factor
-            return _distribution
-        scaled_distribution = _scale_distribution(distribution, expected_gap)
-        return max(scaled_distribution, key=scaled_distribution.get)
+        return next_states[int(np.argmax(expected_gaps))]
@@ -1,23 +1,51 @@
 ''' MCTSClass.py: Class for a basic Monte Carlo Tree Search Planner. '''
 
 # Python imports.
+import copy
 import math
-import random
-from collections import defaultdict
+import numpy as np
 
 # Other imports.
 from simple_rl.planning.PlannerClass import Planner
 
 class MCTS(Planner):
-
-    def __init__(self, mdp, name="mcts", explore_param=math.sqrt(2), rollout_depth=20, num_rollouts_per_step=10):
+    '''
+    Summary:
+        UCT planner whose search statistics are kept in a transposition table keyed by state, so that identical
+        states reached along different paths share their visit counts and values. The table can be kept between
+        calls to plan() / policy() (@reuse_tree).
+
+        Given CompiledDynamics (see mdp/CompiledDynamicsClass.py), the search steps through its integer tables, and the
+        random rollouts from the leaves of @rollout_batch_size simulations are run together as array operations.
+        Otherwise each step of a simulation calls the MDP's transition and reward functions.
+    '''
+
+    def __init__(self, mdp, name="mcts", explore_param=math.sqrt(2), rollout_depth=20, num_rollouts_per_step=10,
+                 reuse_tree=False, compiled_dynamics=None, rollout_batch_size=1, seed=None):
+        '''
+        Args:
+            mdp (MDP)
+            name (str)
+            explore_param (float): UCT exploration constant.
+            rollout_depth (int): Max number of steps of each simulation (tree descent and rollout).
+            num_rollouts_per_step (int): Number of simulations run before each action is chosen.
+            reuse_tree (bool): If true, the transposition table is kept between calls to plan() and policy().
+            compiled_dynamics (CompiledDynamics): If set, simulations use its tables.
+            rollout_batch_size (int): Number of simulations whose rollouts are run together (with compiled dynamics).
+            seed (int)
+        '''
         Planner.__init__(self, mdp, name=name)
+        if compiled_dynamics is not None and list(compiled_dynamics.actions) != list(self.actions):
+            raise ValueError("(simple_rl) MCTS Error: the compiled dynamics' actions don't match the MDP's.")
 
         self.rollout_depth = rollout_depth
         self.num_rollouts_per_step = num_rollouts_per_step
-        self.value_total = defaultdict(lambda : defaultdict(float))
         self.explore_param = explore_param
-        self.visitation_counts = defaultdict(lambda : defaultdict(lambda : 0))
+        self.reuse_tree = reuse_tree
+        self.compiled_dynamics = compiled_dynamics
+        self.rollout_batch_size = rollout_batch_size if compiled_dynamics is not None else 1
+        self.rng = np.random.default_rng(seed)
+        self.table = {}
 
     def plan(self, cur_state, horizon=20):
         '''
@@ -28,13 +56,15 @@ class MCTS(Planner):
         Returns:
             (list): List of actions
         '''
+        if not self.reuse_tree:
+            self.table = {}
+
         action_seq = []
         state_seq = [cur_state]
         steps = 0
         while not cur_state.is_terminal() and steps < horizon:
-            action = self._next_action(cur_state)
-            # Do the rollouts...
-            cur_state = self.transition_func(cur_state, action)
+            action = self._search(cur_state)
+            cur_state = self.transition_func(copy.deepcopy(cur_state), action)
             action_seq.append(action)
             state_seq.append(cur_state)
             steps += 1
@@ -51,78 +81,153 @@ class MCTS(Planner):
         Returns:
             (str)
         '''
-        if not self.has_planned:
-            self.plan(state)
+        if not self.reuse_tree:
+            self.table = {}
+        self.has_planned = True
 
-        return self._next_action(state)
+        return self._search(state)
 
-    def _next_action(self, state):
+    def get_q_value(self, state, action):
         '''
-        Args;
-            state (State)
-
         Returns:
-            (str)
-
-        Summary:
-            Performs a single step of the MCTS rollout.
+            (float): the mean simulated return of (@state, @action), or 0 if it hasn't been simulated.
         '''
-        best_action = self.actions[0]
-        best_score = 0
-        total_visits = [self.visitation_counts[state][a] for a in self.actions]
-
-        if 0 in total_visits:
-            # Insufficient stats, return a random action.
-            unsampled_actions = [self.actions[i] for i, x in enumerate(total_visits) if x == 0]
-            next_action = random.choice(unsampled_actions)
-            self.visitation_counts[state][next_action] += 1
-            return next_action
+        key = self._state_key(state)
+        if key not in self.table:
+            return 0.0
+        visits, value_total = self.table[key]
+        a = self.actions.index(action)
+        return value_total[a] / visits[a] if visits[a] > 0 else 0.0
+
+    # ------------
+    # -- Search --
+    # ------------
+
+    def _state_key(self, state):
+        # With compiled dynamics, the table is keyed by state index.
+        if self.compiled_dynamics is None:
+            return state
+        state_idx = self.compiled_dynamics.lookup_state_idx(state)
+        if state_idx is None:
+            raise ValueError("(simple_rl) MCTS Error: " + str(state) + " isn't one of the compiled states.")
+        return state_idx
+
+    def _is_terminal(self, key):
+        if self.compiled_dynamics is None:
+            return key.is_terminal()
+        return self.compiled_dynamics.terminal[key]
+
+    def _step(self, key, action_idx):
+        '''
+        Returns:
+            (tuple): (next state key, reward)
+        '''
+        if self.compiled_dynamics is None:
+            action = self.actions[action_idx]
+            next_state = self.transition_func(copy.deepcopy(key), action)
+            return next_state, self.reward_func(key, action, next_state)
+        return self.compiled_dynamics.sample_transition(key, action_idx, self.rng)
 
-        total = sum(total_visits)
+    def _search(self, state):
+        '''
+        Args:
+            state (State)
 
-        # Else choose according to the UCT explore method.
-        for cur_action in self.actions:
-            s_a_value_tot = self.value_total[state][cur_action]
-            s_a_visit = self.visitation_counts[state][cur_action]
-            score = s_a_value_tot / s_a_visit + self.explore_param * math.sqrt(math.log(total) / s_a_visit)
+        Returns:
+            (str): the most simulated action of @state after self.num_rollouts_per_step simulations.
+        '''
+        root = self._state_key(state)
+        if self._is_terminal(root):
+            return self.actions[0]
+
+        num_simulations = 0
+        while num_simulations < self.num_rollouts_per_step:
+            batch_size = min(self.rollout_batch_size, self.num_rollouts_per_step - num_simulations)
+            paths, leaves = zip(*[self._descend(root) for _ in range(batch_size)])
+            returns = self._rollout(list(leaves))
+            for path, leaf_return in zip(paths, returns):
+                self._backup(path, leaf_return)
+            num_simulations += batch_size
+
+        visits, value_total = self.table[root]
+        mean_values = np.where(visits > 0, value_total / np.maximum(visits, 1), -np.inf)
+        most_visited = np.flatnonzero(visits == visits.max())
+        return self.actions[most_visited[np.argmax(mean_values[most_visited])]]
+
+    def _descend(self, key):
+        '''
+        Summary:
+            Descends the tree from @key with UCT until it expands a new (state, action) pair, reaches a terminal state
+            or reaches the max depth. Visit counts are incremented on the way down, so that other simulations of the
+            same batch are steered elsewhere.
 
-            if score > best_score:
-                best_action = cur_action
-                best_score = score
+        Returns:
+            (tuple): (list of (state key, action index, reward), (leaf state key, depth))
+        '''
+        path = []
+        while len(path) < self.rollout_depth and not self._is_terminal(key):
+            if key not in self.table:
+                self.table[key] = (np.zeros(len(self.actions)), np.zeros(len(self.actions)))
+            visits, value_total = self.table[key]
+
+            unvisited = np.flatnonzero(visits == 0)
+            if len(unvisited) > 0:
+                action_idx = unvisited[self.rng.integers(len(unvisited))]
+            else:
+                scores = value_total / visits + self.explore_param * np.sqrt(math.log(visits.sum()) / visits)
+                action_idx = np.argmax(scores)
+
+            visits[action_idx] += 1
+            next_key, reward = self._step(key, action_idx)
+            path.append((key, action_idx, reward))
+            key = next_key
+
+            if len(unvisited) > 0:
+                break
 
-        return best_action
+        return path, (key, len(path))
 
-    def _rollout(self, cur_state, action):
+    def _rollout(self, leaves):
         '''
         Args:
-            cur_state (State)
-            action (str)
+            leaves (list): (state key, depth) of the leaf of each simulation.
 
         Returns:
-            (float): Discounted reward from the rollout.
+            (list): the discounted return of a uniformly random rollout from each leaf (to the max depth).
         '''
-        trajectory = []
-        total_discounted_reward = []
-        for i in range(self.rollout_depth):
-
-            # Simulate next state.
-            next_action = self._next_action(cur_state)
-            cur_state = self.transition_func(cur_state, next_action)
-            next_reward = self.reward_func(cur_state, next_action)
-
-            # Track rewards and states.
-            total_discounted_reward.append(self.gamma**i * next_reward)
-            trajectory.append((cur_state, next_action))
-
-            if cur_state.is_terminal():
-                # Break terminal.
+        if self.compiled_dynamics is None:
+            returns = []
+            for key, depth in leaves:
+                total_discounted_reward = 0.0
+                for i in range(self.rollout_depth - depth):
+                    if key.is_terminal():
+                        break
+                    key, reward = self._step(key, self.rng.integers(len(self.actions)))
+                    total_discounted_reward += self.gamma**i * reward
+                returns.append(total_discounted_reward)
+            return returns
+
+        # Simulate all of the rollouts together, each for as many steps as its leaf has left.
+        dynamics = self.compiled_dynamics
+        state_idxs = np.array([key for key, depth in leaves], dtype=int)
+        steps_left = self.rollout_depth - np.array([depth for key, depth in leaves])
+        returns = np.zeros(len(leaves))
+        for i in range(steps_left.max() if len(leaves) > 0 else 0):
+            active = (steps_left > i) & ~dynamics.terminal[state_idxs]
+            if not active.any():
                 break
+            action_idxs = self.rng.integers(len(self.actions), size=len(leaves))
+            next_state_idxs, rewards = dynamics.sample_transitions(state_idxs, action_idxs, self.rng)
+            returns += active * self.gamma**i * rewards
+            state_idxs = np.where(active, next_state_idxs, state_idxs)
+        return returns.tolist()
 
-        # Update all visited nodes.
-        for i, experience in enumerate(trajectory):
-            s, a = experience
-            self.visitation_counts[s][a] += 1
-            self.value_total[s][a] += sum(total_discounted_reward[i:])
-
-        return total_discounted_reward
-
+    def _backup(self, path, leaf_return):
+        '''
+        Summary:
+            Adds the discounted return from each (state, action) pair of @path to its value total.
+        '''
+        discounted_return = leaf_return
+        for key, action_idx, reward in reversed(path):
+            discounted_return = reward + self.gamma * discounted_return
+            self.table[key][1][action_idx] += discounted_return
@@ -34,22 +34,20 @@ class BeliefMDP(MDP):
         next_belief_distribution = self.belief_updater_func(belief_state.distribution, action, observation)
         return BeliefState(next_belief_distribution)
 
-    def _belief_reward_function(self, belief_state, action):
+    def _belief_reward_function(self, belief_state, action, next_belief_state=None):
         '''
         The belief MDP reward function R(b, a) is the expected reward from the POMDP reward function
-        over the belief state distribution.
+        over the belief state distribution (and the POMDP's transition probabilities).
         Args:
             belief_state (BeliefState)
             action (str)
+            next_belief_state (BeliefState): unused, for compatibility with MDP.execute_agent_action
 
         Returns:
             reward (float)
         '''
-        belief = belief_state.distribution
-        reward = 0.
-        for state in belief:
-            reward += belief[state] * self.state_reward_func(state, action)
-        return reward
+        belief_updater = self.pomdp.belief_updater
+        return float(belief_updater.expected_rewards(belief_updater.belief_to_vector(belief_state.distribution), action))
 
     def _get_observation_from_environment(self, action):
         '''
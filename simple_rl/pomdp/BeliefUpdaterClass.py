@@ -1,17 +1,19 @@
 from collections import defaultdict
+import numpy as np
 from simple_rl.planning.ValueIterationClass import ValueIteration
 
 class BeliefUpdater(object):
     ''' Wrapper class for different methods for belief state updates in POMDPs. '''
 
-    def __init__(self, mdp, transition_func, reward_func, observation_func, updater_type='discrete'):
+    def __init__(self, mdp, transition_func, reward_func, observation_func, updater_type='discrete', sparse=False):
         '''
         Args:
             mdp (POMDP)
             transition_func: T(s, a) --> s'
-            reward_func: R(s, a) --> float
+            reward_func: R(s, a, s') --> float
             observation_func: O(s, a) --> z
             updater_type (str)
+            sparse (bool): store the transition matrices as scipy.sparse matrices (for large state spaces)
         '''
         self.reward_func = reward_func
         self.updater_type = updater_type
@@ -21,6 +23,7 @@ class BeliefUpdater(object):
 
         self.transition_probs = self.construct_transition_matrix(transition_func)
         self.observation_probs = self.construct_observation_matrix(observation_func, transition_func)
+        self.construct_belief_arrays(mdp, sparse)
 
         if updater_type == 'discrete':
             self.updater = self.discrete_filter_updater
@@ -32,22 +35,96 @@ class BeliefUpdater(object):
             raise AttributeError('updater_type {} did not conform to expected type'.format(updater_type))
 
     def discrete_filter_updater(self, belief, action, observation):
-        def _compute_normalization_factor(bel):
-            return sum(bel.values())
+        '''
+        Args:
+            belief (defaultdict): probability distribution over states
+            action (str)
+            observation (str)
+
+        Returns:
+            new_belief (defaultdict): the updated distribution over the states of @belief
+        '''
+        # The updated belief is restricted to (and normalized over) the states of the given belief.
+        belief_states = list(belief.keys())
+        belief_idxs = [self.state_index[state] for state in belief_states]
+        new_belief_vector = self.update_belief_vectors(self.belief_to_vector(belief), action, observation, normalize=False)[belief_idxs]
 
-        def _update_belief_for_state(b, sp, T, O, a, z):
-            return O[sp][z] * sum([T[s][a][sp] * b[s] for s in b])
+        normalization = new_belief_vector.sum()
+        if normalization > 0: new_belief_vector /= normalization
 
         new_belief = defaultdict()
-        for sprime in belief:
-            new_belief[sprime] = _update_belief_for_state(belief, sprime, self.transition_probs, self.observation_probs, action, observation)
+        for state, prob in zip(belief_states, new_belief_vector.tolist()):
+            new_belief[state] = prob
+        return new_belief
+
+    def update_belief_vectors(self, beliefs, action, observations, normalize=True):
+        '''
+        Update many beliefs at once: b'(s') ∝ O(s', z) * sum_s T(s, a, s') b(s)
+        Args:
+            beliefs (np.ndarray): belief vector (S) or matrix of belief vectors (N x S), indexed as self.states
+            action (str)
+            observations (str or list): the observation, or one observation per belief
+            normalize (bool)
 
-        normalization = _compute_normalization_factor(new_belief)
+        Returns:
+            new_beliefs (np.ndarray): updated beliefs, shaped like @beliefs (beliefs that are inconsistent with their
+                observation are all zeros)
+        '''
+        beliefs = np.asarray(beliefs, dtype=float)
+        single_belief = beliefs.ndim == 1
+        beliefs = np.atleast_2d(beliefs)
+
+        if isinstance(observations, str):
+            observations = [observations] * beliefs.shape[0]
+        observation_idxs = np.array([self.observation_index.get(observation, -1) for observation in observations])
+        observation_likelihoods = np.where(observation_idxs[:, None] >= 0, self.observation_matrix[:, observation_idxs].T, 0.)
+
+        action_idx = self.action_index[action]
+        if self.sparse:
+            predicted_beliefs = np.asarray(self.transition_matrices[action_idx].T.dot(beliefs.T)).T
+        else:
+            predicted_beliefs = beliefs.dot(self.transition_matrices[action_idx])
+        new_beliefs = observation_likelihoods * predicted_beliefs
 
-        for sprime in belief:
-            if normalization > 0: new_belief[sprime] /= normalization
+        if normalize:
+            normalization = new_beliefs.sum(axis=1, keepdims=True)
+            new_beliefs = np.divide(new_beliefs, normalization, out=np.zeros_like(new_beliefs), where=normalization > 0)
 
-        return new_belief
+        return new_beliefs[0] if single_belief else new_beliefs
+
+    def expected_rewards(self, beliefs, action):
+        '''
+        Args:
+            beliefs (np.ndarray): belief vector (S) or matrix of belief vectors (N x S)
+            action (str)
+
+        Returns:
+            (float or np.ndarray): sum_s b(s) sum_s' T(s, a, s') R(s, a, s') for each belief
+        '''
+        return np.asarray(beliefs, dtype=float).dot(self.reward_matrix[self.action_index[action]])
+
+    def belief_to_vector(self, belief):
+        '''
+        Args:
+            belief (defaultdict): probability distribution over states
+
+        Returns:
+            (np.ndarray): the belief as a vector indexed as self.states
+        '''
+        vector = np.zeros(len(self.states))
+        for state, prob in belief.items():
+            vector[self.state_index[state]] = prob
+        return vector
+
+    def vector_to_belief(self, vector):
+        '''
+        Returns:
+            belief (defaultdict): the distribution of a belief vector, over the states with nonzero probability
+        '''
+        belief = defaultdict()
+        for state_idx in np.flatnonzero(vector):
+            belief[self.states[state_idx]] = float(vector[state_idx])
+        return belief
 
     def kalman_filter_updater(self, belief, action, observation):
         pass
@@ -95,3 +172,50 @@ class BeliefUpdater(object):
         for state in self.vi.get_states():
             obs_dict[state] = normalize_probabilities(obs_dict[state])
         return obs_dict
+
+    def construct_belief_arrays(self, mdp, sparse=False):
+        '''
+        Index the states, actions and observations with integers and store the estimated transition probabilities,
+        observation probabilities and expected rewards as arrays, so that beliefs can be updated as matrix products.
+        Args:
+            mdp (POMDP)
+            sparse (bool)
+        '''
+        states = list(mdp.init_belief.keys()) + self.vi.get_states()
+        for state in list(self.transition_probs.keys()):
+            for action in self.transition_probs[state]:
+                states += list(self.transition_probs[state][action].keys())
+        states += list(self.observation_probs.keys())
+        self.states = list(dict.fromkeys(states))
+        self.state_index = {state: i for i, state in enumerate(self.states)}
+        self.action_index = {action: i for i, action in enumerate(mdp.actions)}
+        observations = list(mdp.observations)
+        for state in self.observation_probs:
+            observations += list(self.observation_probs[state].keys())
+        self.observations = list(dict.fromkeys(observations))
+        self.observation_index = {observation: i for i, observation in enumerate(self.observations)}
+
+        num_states = len(self.states)
+        transitions = [([], [], []) for _ in mdp.actions]  # per action: rows, columns, probabilities
+        self.reward_matrix = np.zeros((len(mdp.actions), num_states))
+        for state in list(self.transition_probs.keys()):
+            for action in self.transition_probs[state]:
+                for next_state, prob in self.transition_probs[state][action].items():
+                    s, a, sp = self.state_index[state], self.action_index[action], self.state_index[next_state]
+                    for values, value in zip(transitions[a], (s, sp, prob)):
+                        values.append(value)
+                    self.reward_matrix[a, s] += prob * self.reward_func(state, action, next_state)
+
+        self.observation_matrix = np.zeros((num_states, len(self.observations)))
+        for state in self.observation_probs:
+            for observation, prob in self.observation_probs[state].items():
+                self.observation_matrix[self.state_index[state], self.observation_index[observation]] = prob
+
+        self.sparse = sparse
+        if sparse:
+            from scipy import sparse as sp_sparse
+            self.transition_matrices = [sp_sparse.csr_matrix((probs, (rows, cols)), shape=(num_states, num_states)) for rows, cols, probs in transitions]
+        else:
+            self.transition_matrices = np.zeros((len(mdp.actions), num_states, num_states))
+            for a, (rows, cols, probs) in enumerate(transitions):
+                self.transition_matrices[a, rows, cols] = probs
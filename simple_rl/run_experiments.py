@@ -21,6 +21,7 @@ import os
 import math
 import sys
 import copy
+import multiprocessing
 import numpy as np
 from collections import defaultdict
 
@@ -56,7 +57,7 @@ def play_markov_game(agent_ls, markov_game_mdp, instances=10, episodes=100, step
 
     # Record how long each agent spends learning.
     print("Running experiment: \n" + str(experiment))
-    start = time.clock()
+    start = time.perf_counter()
 
     # For each instance of the agent.
     for instance in range(1, instances + 1):
@@ -115,7 +116,7 @@ def play_markov_game(agent_ls, markov_game_mdp, instances=10, episodes=100, step
             a.reset()
 
     # Time stuff.
-    print("Experiment took " + str(round(time.clock() - start, 2)) + " seconds.")
+    print("Experiment took " + str(round(time.perf_counter() - start, 2)) + " seconds.")
 
     experiment.make_plots(open_plot=open_plot)
 
@@ -131,7 +132,10 @@ def run_agents_lifelong(agents,
                             reset_at_terminal=False,
                             resample_at_terminal=False,
                             cumulative_plot=True,
-                            dir_for_plot="results"):
+                            dir_for_plot="results",
+                            n_jobs=1,
+                            seed=None,
+                            results_format="csv"):
     '''
     Args:
         agents (list)
@@ -148,13 +152,16 @@ def run_agents_lifelong(agents,
         resample_at_terminal (bool)
         cumulative_plot (bool)
         dir_for_plot (str)
+        n_jobs (int): Number of worker processes that the (agent, sample) pairs are spread across.
+        seed (int): If set (or if n_jobs > 1), seeds random and numpy.random per (agent, sample) pair.
+        results_format (str): "csv" or "npz" (see experiments/ResultSinkClass.py).
 
     Summary:
         Runs each agent on the MDP distribution according to the given parameters.
         If @mdp_distr has a non-zero horizon, then gamma is set to 1 and @steps is ignored.
     '''
     # Experiment (for reproducibility, plotting).
-    exp_params = {"samples":samples, "episodes":episodes, "steps":steps}
+    exp_params = {"samples":samples, "episodes":episodes, "steps":steps, "results_format":results_format}
     experiment = Experiment(agents=agents,
                     mdp=mdp_distr,
                     params=exp_params,
@@ -163,41 +170,37 @@ def run_agents_lifelong(agents,
                     clear_old_results=clear_old_results,
                     track_disc_reward=track_disc_reward,
                     cumulative_plot=cumulative_plot,
-                    dir_for_plot=dir_for_plot)
+                    dir_for_plot=dir_for_plot,
+                    results_format=results_format)
 
     # Record how long each agent spends learning.
     print("Running experiment: \n" + str(experiment))
-    start = time.clock()
 
-    times = defaultdict(float)
-
-    # Learn.
-    for agent in agents:
-        print(str(agent) + " is learning.")
-        start = time.clock()
-
-        # --- SAMPLE NEW MDP ---
-        for new_task in range(samples):
-            print("  Sample " + str(new_task + 1) + " of " + str(samples) + ".")
+    run_args = (episodes, steps, verbose, track_disc_reward, reset_at_terminal, resample_at_terminal)
+    if n_jobs > 1:
+        times = _run_tasks_in_parallel(agents, mdp_distr, samples, run_args, experiment, n_jobs, seed, lifelong=True)
+    else:
+        times = defaultdict(float)
 
-            # Sample the MDP.
-            mdp = mdp_distr.sample()
+        # Learn.
+        for agent_idx, agent in enumerate(agents):
+            print(str(agent) + " is learning.")
+            start = time.perf_counter()
 
-            # Run the agent.
-            hit_terminal, total_steps_taken, _ = run_single_agent_on_mdp(agent, mdp, episodes, steps, experiment, verbose, track_disc_reward, reset_at_terminal, resample_at_terminal)
+            # --- SAMPLE NEW MDP ---
+            for new_task in range(samples):
+                print("  Sample " + str(new_task + 1) + " of " + str(samples) + ".")
+                if seed is not None:
+                    _seed_task(seed, agent_idx, new_task)
 
-            # If we resample at terminal, keep grabbing MDPs until we're done.
-            while resample_at_terminal and hit_terminal and total_steps_taken < steps:
-                mdp = mdp_distr.sample()
-                hit_terminal, steps_taken, _ = run_single_agent_on_mdp(agent, mdp, episodes, steps - total_steps_taken, experiment, verbose, track_disc_reward, reset_at_terminal, resample_at_terminal)
-                total_steps_taken += steps_taken
+                _run_lifelong_sample(agent, mdp_distr, experiment, *run_args)
 
-            # Reset the agent.
-            agent.reset()
+                # Reset the agent.
+                agent.reset()
 
-        # Track how much time this agent took.
-        end = time.clock()
-        times[agent] = round(end - start, 3)
+            # Track how much time this agent took.
+            end = time.perf_counter()
+            times[agent] = round(end - start, 3)
 
 
     # Time stuff.
@@ -208,6 +211,24 @@ def run_agents_lifelong(agents,
 
     experiment.make_plots(open_plot=open_plot)
 
+def _run_lifelong_sample(agent, mdp_distr, experiment, episodes, steps, verbose, track_disc_reward, reset_at_terminal, resample_at_terminal):
+    '''
+    Summary:
+        Runs @agent on one MDP sampled from @mdp_distr (and, if @resample_at_terminal, on further samples until
+        @steps steps have been taken).
+    '''
+    # Sample the MDP.
+    mdp = mdp_distr.sample()
+
+    # Run the agent.
+    hit_terminal, total_steps_taken, _ = run_single_agent_on_mdp(agent, mdp, episodes, steps, experiment, verbose, track_disc_reward, reset_at_terminal, resample_at_terminal)
+
+    # If we resample at terminal, keep grabbing MDPs until we're done.
+    while resample_at_terminal and hit_terminal and total_steps_taken < steps:
+        mdp = mdp_distr.sample()
+        hit_terminal, steps_taken, _ = run_single_agent_on_mdp(agent, mdp, episodes, steps - total_steps_taken, experiment, verbose, track_disc_reward, reset_at_terminal, resample_at_terminal)
+        total_steps_taken += steps_taken
+
 def run_agents_on_mdp(agents,
                         mdp,
                         instances=5,
@@ -223,7 +244,10 @@ def run_agents_on_mdp(agents,
                         dir_for_plot="results",
                         experiment_name_prefix="",
                         track_success=False,
-                        success_reward=None):
+                        success_reward=None,
+                        n_jobs=1,
+                        seed=None,
+                        results_format="csv"):
     '''
     Args:
         agents (list of Agents): See agents/AgentClass.py (and friends).
@@ -242,6 +266,11 @@ def run_agents_on_mdp(agents,
         experiment_name_prefix (str): Adds this to the end of the usual experiment name.
         track_success (bool): If true, tracks whether each run is successful and generates an additional success plot at the end.
         success_reward (int): If set, determines the success criteria.
+        n_jobs (int): Number of worker processes that the (agent, instance) pairs are spread across.
+        seed (int): If set (or if n_jobs > 1), seeds random and numpy.random per (agent, instance) pair, so that
+            the results don't depend on @n_jobs.
+        results_format (str): "csv" or "npz" (see experiments/ResultSinkClass.py). The npz format is faster to write
+            for long runs.
 
     Summary:
         Runs each agent on the given mdp according to the given parameters.
@@ -252,7 +281,7 @@ def run_agents_on_mdp(agents,
         raise ValueError("(simple_rl): run_agents_on_mdp must set param @success_reward when @track_success=True.")
 
     # Experiment (for reproducibility, plotting).
-    exp_params = {"instances":instances, "episodes":episodes, "steps":steps}
+    exp_params = {"instances":instances, "episodes":episodes, "steps":steps, "results_format":results_format}
     experiment = Experiment(agents=agents,
                             mdp=mdp,
                             params=exp_params,
@@ -264,31 +293,39 @@ def run_agents_on_mdp(agents,
                             dir_for_plot=dir_for_plot,
                             experiment_name_prefix=experiment_name_prefix,
                             track_success=track_success,
-                            success_reward=success_reward)
+                            success_reward=success_reward,
+                            results_format=results_format)
 
     # Record how long each agent spends learning.
     print("Running experiment: \n" + str(experiment))
-    time_dict = defaultdict(float)
 
-    # Learn.
-    for agent in agents:
-        print(str(agent) + " is learning.")
+    if n_jobs > 1:
+        run_args = (episodes, steps, verbose, track_disc_reward, reset_at_terminal)
+        time_dict = _run_tasks_in_parallel(agents, mdp, instances, run_args, experiment, n_jobs, seed)
+    else:
+        time_dict = defaultdict(float)
 
-        start = time.clock()
+        # Learn.
+        for agent_idx, agent in enumerate(agents):
+            print(str(agent) + " is learning.")
 
-        # For each instance.
-        for instance in range(1, instances + 1):
-            print("  Instance " + str(instance) + " of " + str(instances) + ".")
-            sys.stdout.flush()
-            run_single_agent_on_mdp(agent, mdp, episodes, steps, experiment, verbose, track_disc_reward, reset_at_terminal=reset_at_terminal)
+            start = time.perf_counter()
 
-            # Reset the agent.
-            agent.reset()
-            mdp.end_of_instance()
-        # Track how much time this agent took.
-        end = time.clock()
-        time_dict[agent] = round(end - start, 3)
-        print()
+            # For each instance.
+            for instance in range(1, instances + 1):
+                print("  Instance " + str(instance) + " of " + str(instances) + ".")
+                sys.stdout.flush()
+                if seed is not None:
+                    _seed_task(seed, agent_idx, instance)
+                run_single_agent_on_mdp(agent, mdp, episodes, steps, experiment, verbose, track_disc_reward, reset_at_terminal=reset_at_terminal)
+
+                # Reset the agent.
+                agent.reset()
+                mdp.end_of_instance()
+            # Track how much time this agent took.
+            end = time.perf_counter()
+            time_dict[agent] = round(end - start, 3)
+            print()
 
 
     # Time stuff.
@@ -299,6 +336,114 @@ def run_agents_on_mdp(agents,
 
     experiment.make_plots(open_plot=open_plot)
 
+class _ExperimentRecorder(object):
+    '''
+    Summary:
+        Stands in for the Experiment in a worker process, recording the calls made by one (agent, instance) pair
+        so that they can be replayed into the Experiment in a fixed order. States and actions aren't recorded,
+        since the Experiment doesn't use them.
+    '''
+
+    def __init__(self):
+        self.calls = []
+
+    def add_experience(self, agent, state, action, reward, next_state, time_taken=0):
+        self.calls.append(("add_experience", (None, None, reward, None), {"time_taken":time_taken}))
+
+    def end_of_episode(self, agent, num_times_to_write=1):
+        self.calls.append(("end_of_episode", (), {"num_times_to_write":num_times_to_write}))
+
+    def end_of_instance(self, agent):
+        self.calls.append(("end_of_instance", (), {}))
+
+    def replay(self, experiment, agent):
+        for func_name, args, kwargs in self.calls:
+            getattr(experiment, func_name)(agent, *args, **kwargs)
+
+def _seed_task(seed, agent_idx, instance):
+    '''
+    Summary:
+        Seeds random and numpy.random with a stream that only depends on @seed and the (agent, instance) pair.
+    '''
+    # Imported here since simple_rl.tasks (star imported above) has a module named random.
+    import random
+
+    task_seed = int(np.random.SeedSequence([seed, agent_idx, instance]).generate_state(1)[0])
+    random.seed(task_seed)
+    np.random.seed(task_seed)
+
+def _run_task(serialized_task):
+    '''
+    Summary:
+        Runs one (agent, instance) pair in a worker process.
+
+    Returns:
+        (tuple): (_ExperimentRecorder, float: seconds taken)
+    '''
+    import dill
+    agent, mdp, seed, agent_idx, instance, run_args, lifelong = dill.loads(serialized_task)
+    _seed_task(seed, agent_idx, instance)
+
+    recorder = _ExperimentRecorder()
+    start = time.perf_counter()
+    if lifelong:
+        _run_lifelong_sample(agent, mdp, recorder, *run_args)
+    else:
+        episodes, steps, verbose, track_disc_reward, reset_at_terminal = run_args
+        run_single_agent_on_mdp(agent, mdp, episodes, steps, recorder, verbose, track_disc_reward, reset_at_terminal=reset_at_terminal)
+
+    return recorder, time.perf_counter() - start
+
+def _run_tasks_in_parallel(agents, mdp, instances, run_args, experiment, n_jobs, seed=None, lifelong=False):
+    '''
+    Args:
+        agents (list)
+        mdp (MDP or MDPDistribution)
+        instances (int): Number of instances (or samples, if @lifelong) per agent.
+        run_args (tuple): Arguments of run_single_agent_on_mdp (or _run_lifelong_sample) after the experiment.
+        experiment (Experiment)
+        n_jobs (int)
+        seed (int)
+        lifelong (bool)
+
+    Summary:
+        Runs each (agent, instance) pair on a fresh copy of the agent and MDP in a pool of @n_jobs processes. The
+        experiment calls of each pair are replayed into @experiment in the same (agent, instance) order as the
+        serial loop, so the results files (and plots) have the same format.
+
+    Returns:
+        (dict): Seconds each agent took, summed over its instances.
+    '''
+    # Agents and MDPs often hold lambdas, which pickle can't serialize.
+    import dill
+
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    first_instance = 0 if lifelong else 1
+
+    tasks = []
+    for agent_idx, agent in enumerate(agents):
+        for instance in range(first_instance, instances + first_instance):
+            tasks.append(dill.dumps((agent, mdp, seed, agent_idx, instance, run_args, lifelong)))
+
+    time_dict = defaultdict(float)
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+        for task_idx, (recorder, seconds) in enumerate(pool.imap(_run_task, tasks)):
+            agent = agents[task_idx // instances]
+            print(str(agent) + (" sample " if lifelong else " instance ") + str(task_idx % instances + 1) + " of " + str(instances) + " done.")
+            sys.stdout.flush()
+            recorder.replay(experiment, agent)
+            time_dict[agent] += seconds
+    finally:
+        pool.close()
+        pool.join()
+
+    for agent in time_dict:
+        time_dict[agent] = round(time_dict[agent], 3)
+
+    return time_dict
+
 def run_single_agent_on_mdp(agent, mdp, episodes, steps, experiment=None, verbose=False, track_disc_reward=False, reset_at_terminal=False, resample_at_terminal=False):
     '''
     Summary:
@@ -327,7 +472,7 @@ def run_single_agent_on_mdp(agent, mdp, episodes, steps, experiment=None, verbos
         # Compute initial state/reward.
         state = mdp.get_init_state()
         reward = 0
-        episode_start_time = time.clock()
+        episode_start_time = time.perf_counter()
 
         # Extra printing if verbose.
         if verbose:
@@ -340,7 +485,7 @@ def run_single_agent_on_mdp(agent, mdp, episodes, steps, experiment=None, verbos
                 _increment_bar()
 
             # step time
-            step_start = time.clock()
+            step_start = time.perf_counter()
 
             # Compute the agent's policy.
             action = agent.act(state, reward)
@@ -353,7 +498,7 @@ def run_single_agent_on_mdp(agent, mdp, episodes, steps, experiment=None, verbos
 
                 if episodes == 1 and not reset_at_terminal and experiment is not None and action != "terminate":
                     # Self loop if we're not episodic or resetting and in a terminal state.
-                    experiment.add_experience(agent, state, action, 0, state, time_taken=time.clock()-step_start)
+                    experiment.add_experience(agent, state, action, 0, state, time_taken=time.perf_counter()-step_start)
                     continue
                 break
 
@@ -368,7 +513,7 @@ def run_single_agent_on_mdp(agent, mdp, episodes, steps, experiment=None, verbos
             if experiment is not None:
                 reward_to_track = mdp.get_gamma()**(step + 1 + episode*steps) * reward if track_disc_reward else reward
                 reward_to_track = round(reward_to_track, 5)
-                experiment.add_experience(agent, state, action, reward_to_track, next_state, time_taken=time.clock() - step_start)
+                experiment.add_experience(agent, state, action, reward_to_track, next_state, time_taken=time.perf_counter() - step_start)
 
             if next_state.is_terminal():
                 if reset_at_terminal:
@@ -41,7 +41,7 @@ class AugmentedNavigationState(OOMDPState):
 
         try:
             hs = self.objects["hotswap_station"][0]
-            state_hash = str(hs["x"]) + str(hs["y"])
+            state_hash += str(hs["x"]) + str(hs["y"])
         except:
             state_hash += '00'
 
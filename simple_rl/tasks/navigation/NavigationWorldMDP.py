@@ -248,7 +248,7 @@ class NavigationWorldMDP(MDP):
 
     def __reset_state_map(self):
         self.map_state_cell_id = -1 * np.ones((self.height, self.width),
-                                              dtype=np.int)
+                                              dtype=int)
         self.xy_to_cell_kind = defaultdict(lambda: "<Undefined>")
 
     def __check_state_map(self):
@@ -600,11 +600,35 @@ class NavigationWorldMDP(MDP):
                 traj_states: [s1, s2, ..., sT]
                 traj_actions: [a1, a2, ..., aT]
         """
-        assert len(init_cell_types) >= 1
+        traj_init_states = self._sample_traj_init_states(
+            n_traj, init_states, init_cell_types, init_unique,
+            rand_init_to_match_n_traj)
+
+        if policy is None:
+            if len(self.goal_cell_locs) == 0:
+                print("Running value iteration with no goals assigned..")
+            policy = self.run_value_iteration().policy
 
-        self.set_traj_init_cell_types(init_cell_types)
         traj_states_list = []
         traj_action_list = []
+        for init_state in traj_init_states:
+            action_seq, state_seq = self.policy_propagate(init_state, policy=policy,
+                                              horizon=horizon)
+            traj_states_list.append(state_seq)
+            traj_action_list.append(action_seq)
+
+        return traj_states_list, traj_action_list
+
+    def _sample_traj_init_states(self, n_traj, init_states, init_cell_types,
+                                 init_unique, rand_init_to_match_n_traj):
+        """Init states of sample_trajectories() (see its arguments).
+
+        Returns:
+            (list): NavigationWorldState init states.
+        """
+        assert len(init_cell_types) >= 1
+
+        self.set_traj_init_cell_types(init_cell_types)
         traj_init_states = []
 
         if init_states is None:
@@ -631,18 +655,107 @@ class NavigationWorldMDP(MDP):
                 traj_init_states += self.sample_init_states(n_traj,
                                                             init_unique=False)
 
+        return traj_init_states
+
+    def sample_trajectories_batch(self, n_traj, horizon, init_states=None,
+                                  init_cell_types=None, init_unique=False,
+                                  policy=None, rand_init_to_match_n_traj=True,
+                                  feature_type="indicator",
+                                  incl_cell_distances=False,
+                                  incl_goal_indicator=True,
+                                  incl_goal_distances=False,
+                                  normalize_distance=False, dtype=np.float32):
+        """Samples trajectories (as sample_trajectories()) and their features
+        as arrays.
+
+        All trajectories are stepped together on the (row, col) grid: the
+        policy is evaluated once per cell (so it should be deterministic, e.g.
+        the default value iteration policy), and walls, goals and features are
+        looked up in grids built from @self.map_state_cell_id.
+
+        Args:
+            n_traj, horizon, init_states, init_cell_types, init_unique, policy,
+            rand_init_to_match_n_traj: See sample_trajectories().
+            feature_type, incl_cell_distances, incl_goal_indicator,
+            incl_goal_distances, normalize_distance, dtype: See
+                feature_at_loc().
+        Returns:
+            (traj_rowcols, traj_actions, traj_lengths, traj_features) where
+                traj_rowcols: (n_traj, horizon + 1, 2) int array of the
+                    (row, col) of each state (-1 after the trajectory ends)
+                traj_actions: (n_traj, horizon) int array of indices into
+                    @self.ACTIONS (-1 after the trajectory ends)
+                traj_lengths: (n_traj,) number of states of each trajectory
+                traj_features: (n_traj, horizon + 1, n_features) features of
+                    each state (0 after the trajectory ends)
+        """
+        traj_init_states = self._sample_traj_init_states(
+            n_traj, init_states, init_cell_types, init_unique,
+            rand_init_to_match_n_traj)
+
         if policy is None:
             if len(self.goal_cell_locs) == 0:
                 print("Running value iteration with no goals assigned..")
             policy = self.run_value_iteration().policy
 
-        for init_state in traj_init_states:
-            action_seq, state_seq = self.policy_propagate(init_state, policy=policy,
-                                              horizon=horizon)
-            traj_states_list.append(state_seq)
-            traj_action_list.append(action_seq)
-
-        return traj_states_list, traj_action_list
+        is_wall = np.isin(self.map_state_cell_id, self.wall_cell_ids)
+        is_terminal = np.isin(self.map_state_cell_id, self.goal_cell_ids) \
+            & self.is_goal_terminal
+        policy_grid = np.zeros((self.height, self.width), dtype=int)
+        for row, col in zip(*np.where(~is_wall)):
+            state = NavigationWorldState(*self._rowcol_to_xy(row, col))
+            policy_grid[row, col] = self.ACTIONS.index(policy(state))
+
+        # (drow, dcol) of up, down, left, right and the two directions each
+        # action slips to.
+        action_deltas = np.array([[-1, 0], [1, 0], [0, -1], [0, 1]])
+        slip_actions = np.array([[2, 3], [2, 3], [0, 1], [0, 1]])
+
+        n = len(traj_init_states)
+        rows = np.array([self._xy_to_rowcol(s.x, s.y)[0]
+                         for s in traj_init_states], dtype=int)
+        cols = np.array([self._xy_to_rowcol(s.x, s.y)[1]
+                         for s in traj_init_states], dtype=int)
+        traj_rowcols = -np.ones((n, horizon + 1, 2), dtype=int)
+        traj_actions = -np.ones((n, horizon), dtype=int)
+        traj_lengths = np.ones(n, dtype=int)
+        traj_rowcols[:, 0, 0], traj_rowcols[:, 0, 1] = rows, cols
+
+        # As in policy_propagate(), init states are never terminal.
+        active = np.ones(n, dtype=bool)
+        for step in range(horizon):
+            if not active.any():
+                break
+            actions = policy_grid[rows, cols]
+            slipped = np.random.random(n) < self.slip_prob
+            slip_choice = np.random.randint(2, size=n)
+            moves = np.where(slipped, slip_actions[actions, slip_choice],
+                             actions)
+            next_rows = rows + action_deltas[moves, 0]
+            next_cols = cols + action_deltas[moves, 1]
+            in_grid = (next_rows >= 0) & (next_rows < self.height) \
+                & (next_cols >= 0) & (next_cols < self.width)
+            can_move = in_grid.copy()
+            can_move[in_grid] = ~is_wall[next_rows[in_grid],
+                                         next_cols[in_grid]]
+            can_move &= active
+
+            traj_actions[active, step] = actions[active]
+            rows = np.where(can_move, next_rows, rows)
+            cols = np.where(can_move, next_cols, cols)
+            traj_rowcols[active, step + 1, 0] = rows[active]
+            traj_rowcols[active, step + 1, 1] = cols[active]
+            traj_lengths += active
+            active &= ~is_terminal[rows, cols]
+
+        feature_grid = self.feature_grid(feature_type, incl_cell_distances,
+                                         incl_goal_indicator,
+                                         incl_goal_distances,
+                                         normalize_distance, dtype)
+        traj_features = feature_grid[traj_rowcols[:, :, 0],
+                                     traj_rowcols[:, :, 1]]
+        traj_features[traj_rowcols[:, :, 0] == -1] = 0
+        return traj_rowcols, traj_actions, traj_lengths, traj_features
 
     # ---------------------
     # -- Value Iteration --
@@ -748,14 +861,17 @@ class NavigationWorldMDP(MDP):
         self.feature_cell_dist = np.zeros(
             self.map_state_cell_id.shape + (len(dist_cell_ids),), np.float32)
 
-        for row in range(self.height):
-            for col in range(self.width):
-                # Note: if particular cell type is missing in the grid, this
-                # will assign distance -1 to it
-                # Ord=1: Manhattan, Ord=2: Euclidean and so on
-                self.feature_cell_dist[row, col] = [
-                    np.linalg.norm([row, col] - loc_cell, ord=1, axis=1).min()
-                    if len(loc_cell) != 0 else -1 for loc_cell in loc_cells]
+        grid_rows, grid_cols = np.indices(self.map_state_cell_id.shape)
+        for idx, loc_cell in enumerate(loc_cells):
+            # Note: if particular cell type is missing in the grid, this
+            # will assign distance -1 to it
+            if len(loc_cell) == 0:
+                self.feature_cell_dist[:, :, idx] = -1
+                continue
+            # Manhattan distance from every cell to the nearest such cell.
+            self.feature_cell_dist[:, :, idx] = (
+                np.abs(grid_rows[:, :, None] - loc_cell[:, 0])
+                + np.abs(grid_cols[:, :, None] - loc_cell[:, 1])).min(axis=2)
 
         self.feature_cell_dist_kind = feature_kind
         return self.__transfrom(self.feature_cell_dist,
@@ -823,6 +939,36 @@ class NavigationWorldMDP(MDP):
         else:
             return phi.astype(dtype)
 
+    def feature_grid(self, feature_type="indicator",
+                     incl_cell_distances=False, incl_goal_indicator=True,
+                     incl_goal_distances=False, normalize_distance=False,
+                     dtype=np.float32):
+        """Returns the feature vectors of every cell (as feature_at_loc()).
+
+        Returns:
+            3D array (row, col, feature)
+        """
+        assert feature_type in ["indicator", "cartesian", "rowcol"]
+
+        if feature_type == "indicator":
+            phi = np.array([self.cell_id_ind_feature(cell_id,
+                                                     incl_goal_indicator)
+                            for cell_id in range(self.n_unique_cells)])
+            phi = phi[self.map_state_cell_id]
+        else:
+            grid_rows, grid_cols = np.indices(self.map_state_cell_id.shape)
+            if feature_type == "cartesian":
+                phi = np.stack(self._rowcol_to_xy(grid_rows, grid_cols),
+                               axis=2)
+            else:
+                phi = np.stack((grid_rows, grid_cols), axis=2)
+
+        if incl_cell_distances or incl_goal_distances:
+            phi = np.concatenate((phi, self.compute_grid_distance_features(
+                incl_cell_distances, incl_goal_distances,
+                normalize_distance)), axis=2)
+        return phi.astype(dtype)
+
     def feature_at_state(self, mdp_state, feature_type="indicator",
                          incl_cell_distances=False, incl_goal_indicator=True,
                          incl_goal_distances=False, normalize_distance=False,
@@ -18,6 +18,7 @@ import numpy as np
 # Other imports.
 from simple_rl.mdp.oomdp.OOMDPClass import OOMDP
 from simple_rl.mdp.oomdp.OOMDPObjectClass import OOMDPObject
+from simple_rl.mdp.CompiledDynamicsClass import CompiledDynamics
 from simple_rl.tasks.skateboard.SkateboardStateClass import SkateboardState
 from simple_rl.tasks.skateboard import skateboard_helpers
 
@@ -169,6 +170,19 @@ class Skateboard2OOMDP(OOMDP):
 
         return reward_features
 
+    def compile_dynamics(self, max_states=None):
+        '''
+        Args:
+            max_states (int): If set, raises a ValueError if more than @max_states states are reachable.
+
+        Returns:
+            (CompiledDynamics): the integer transition, reward and reward feature tables of the reachable states, e.g.
+            for CompiledDynamics.solve() or MCTS rollouts. CompiledDynamics.check(self, self.compute_reward_features)
+            compares them against this class's transitions.
+        '''
+        sample_rate = 1 if self.slip_prob == 0 else self.sample_rate
+        return CompiledDynamics.from_mdp(self, sample_rate=sample_rate, max_states=max_states, features_func=self.compute_reward_features)
+
     def _skateboard_transition_func(self, state, action):
         '''
         Args:
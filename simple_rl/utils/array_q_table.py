@@ -0,0 +1,142 @@
+''' array_q_table.py: a Q-table backed by a NumPy array, with integer rows for states and columns for actions '''
+
+# Python imports.
+import random
+import numpy as np
+
+class ArrayQTable(object):
+    '''
+    Summary:
+        Dense alternative to the nested defaultdicts (state -> action -> q value) of the tabular agents. States are
+        assigned rows lazily, the first time they're looked up (or up front, e.g. from MDP.get_states()), so that
+        updates and greedy/softmax action selection are array operations on a row.
+
+        Indexing (q_table[state][action], reads and writes), iteration over states and items() behave like the nested
+        defaultdicts, so code written against those keeps working.
+    '''
+
+    def __init__(self, actions, default_q=0.0, states=None, init_num_rows=64):
+        '''
+        Args:
+            actions (list)
+            default_q (float): the value of every (state, action) pair that hasn't been updated
+            states (list): optional states to index up front
+            init_num_rows (int)
+        '''
+        self.actions = list(actions)
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+        self.default_q = default_q
+        self.states = []
+        self.state_index = {}
+        self.q_values = np.full((max(init_num_rows, len(states) if states is not None else 0), len(self.actions)), default_q, dtype=float)
+
+        if states is not None:
+            for state in states:
+                self.state_row(state)
+
+    @classmethod
+    def from_dict(cls, q_func, actions, default_q=0.0):
+        '''
+        Args:
+            q_func (dict): state -> action -> q value, e.g. a custom initial Q function
+
+        Returns:
+            (ArrayQTable)
+        '''
+        q_table = cls(actions, default_q=default_q, states=list(q_func.keys()))
+        for state, action_q_vals in q_func.items():
+            for action, q_val in action_q_vals.items():
+                q_table.q_values[q_table.state_index[state], q_table.action_index[action]] = q_val
+        return q_table
+
+    def state_row(self, state):
+        '''
+        Returns:
+            (int): the row of @state, which is added to the table if it isn't in it yet
+        '''
+        row = self.state_index.get(state)
+        if row is None:
+            row = len(self.states)
+            if row == self.q_values.shape[0]:
+                # Double the number of rows.
+                self.q_values = np.vstack((self.q_values, np.full(self.q_values.shape, self.default_q, dtype=float)))
+            self.state_index[state] = row
+            self.states.append(state)
+        return row
+
+    def row_values(self, state):
+        '''
+        Returns:
+            (np.ndarray): the q values of @state, ordered as self.actions (a view, valid until the next state is added)
+        '''
+        return self.q_values[self.state_row(state)]
+
+    def get(self, state, action):
+        return self.q_values[self.state_row(state), self.action_index[action]]
+
+    def set(self, state, action, q_val):
+        self.q_values[self.state_row(state), self.action_index[action]] = q_val
+
+    def __getitem__(self, state):
+        return _ArrayQRow(self, state)
+
+    def __contains__(self, state):
+        return state in self.state_index
+
+    def __iter__(self):
+        return iter(list(self.states))
+
+    def __len__(self):
+        return len(self.states)
+
+    def keys(self):
+        return list(self.states)
+
+    def items(self):
+        return [(state, _ArrayQRow(self, state)) for state in self.states]
+
+class _ArrayQRow(object):
+    ''' The action -> q value mapping of one state of an ArrayQTable '''
+
+    def __init__(self, q_table, state):
+        self.q_table = q_table
+        self.state = state
+
+    def __getitem__(self, action):
+        return self.q_table.get(self.state, action)
+
+    def __setitem__(self, action, q_val):
+        self.q_table.set(self.state, action, q_val)
+
+    def __iter__(self):
+        return iter(self.q_table.actions)
+
+    def __len__(self):
+        return len(self.q_table.actions)
+
+    def keys(self):
+        return list(self.q_table.actions)
+
+    def items(self):
+        return list(zip(self.q_table.actions, self.q_table.row_values(self.state).tolist()))
+
+def max_q_action(q_vals, actions):
+    '''
+    Args:
+        q_vals (np.ndarray): the q value of each action
+        actions (list)
+
+    Returns:
+        (tuple) --> (float, str): the max q value and an action (chosen uniformly at random among ties) that attains it.
+    '''
+    max_q_val = q_vals.max()
+    best_action_idxs = np.flatnonzero(q_vals == max_q_val)
+    return max_q_val, actions[best_action_idxs[random.randrange(len(best_action_idxs))]]
+
+def softmax_action_distr(q_vals, beta):
+    '''
+    Returns:
+        (list of floats): The i-th float corresponds to the probability mass associated with the i-th q value.
+    '''
+    exp_q_vals = np.exp(beta * q_vals)
+    return (exp_q_vals / exp_q_vals.sum()).tolist()
@@ -2,7 +2,7 @@
 chart_utils.py: Charting utilities for RL experiments.
 
 Functions:
-    load_data: Loads data from csv files into lists.
+    load_data: Loads data from csv (or npz) results files into lists.
     average_data: Averages data across instances.
     compute_conf_intervals: Confidence interval computation.
     compute_single_conf_interval: Helper function for above.
@@ -66,20 +66,13 @@ def load_data(experiment_dir, experiment_agents):
         result (list): A 3d matrix containing rewards, where the dimensions are [algorithm][instance][episode].
     '''
 
+    from simple_rl.experiments.ResultSinkClass import load_results
+
     result = []
     for alg in experiment_agents:
 
-        # Load the reward for all instances of each agent
-        all_reward = open(os.path.join(experiment_dir, str(alg)) + ".csv", "r")
-        all_instances = []
-
-        # Put the reward instances into a list of floats.
-        for instance in all_reward.readlines():
-            all_episodes_for_instance = [float(r) for r in instance.split(",")[:-1] if len(r) > 0]
-            if len(all_episodes_for_instance) > 0:
-                all_instances.append(all_episodes_for_instance)
-
-        result.append(all_instances)
+        # Load the reward for all instances of each agent (from csv or npz results).
+        result.append(load_results(experiment_dir, str(alg)))
 
     return result
 
@@ -321,7 +314,7 @@ def make_plots(experiment_dir, experiment_agents, plot_file_name="", cumulative=
     '''
     Args:
         experiment_dir (str): path to results.
-        experiment_agents (list): agent names (looks for "<agent-name>.csv").
+        experiment_agents (list): agent names (looks for "<agent-name>.csv" or "<agent-name>.blocks/").
         plot_file_name (str)
         cumulative (bool): If true, plots show cumulative trr
         use_cost (bool): If true, plots are in terms of cost. Otherwise, plots are in terms of reward.
@@ -395,12 +388,13 @@ def _get_agent_names(data_dir):
         (list)
     '''
     from simple_rl.experiments import Experiment
+    from simple_rl.experiments.ResultSinkClass import list_result_names
 
     try:
         params_file = open(os.path.join(data_dir, Experiment.EXP_PARAM_FILE_NAME), "r")
     except IOError:
         # No param file.
-        return [agent_file.replace(".csv", "") for agent_file in os.listdir(data_dir) if os.path.isfile(os.path.join(data_dir, agent_file)) and ".csv" in agent_file]
+        return list_result_names(data_dir)
 
     agent_names = []
     agent_flag = False
@@ -511,7 +505,7 @@ def format_and_make_plot(data_dir, avg_plot=False, add_legend=True):
     # Grab agents.
     agent_names = _get_agent_names(data_dir)
     if len(agent_names) == 0:
-        raise ValueError("Error: no csv files found.")
+        raise ValueError("Error: no results files found.")
 
     if data_dir[-1] != "/":
         data_dir = data_dir + "/"
@@ -0,0 +1,204 @@
+''' optimal_action_dag.py: the equally-optimal trajectories of an agent's policy as a compact graph '''
+
+# Python imports.
+import random
+
+class OptimalActionDAG(object):
+    '''
+    Summary:
+        All of the equally-optimal roll outs of an agent's policy from a start state (i.e. the trajectories enumerated
+        by mdp_helpers.rollout_policy_recursive), stored as a graph over the reachable states whose edges are the max Q
+        actions. Sub-paths shared between trajectories are only stored (and transitions only computed) once, so the
+        paths can be counted, uniformly sampled, and checked for membership without enumerating them.
+
+        A path ends when it reaches a terminal state or max_depth actions, and actions that leave the state unchanged
+        are skipped, as in rollout_policy_recursive.
+    '''
+
+    def __init__(self, mdp, agent, start_state, max_depth=25):
+        '''
+        Args:
+            mdp (MDP)
+            agent (Agent): exposes get_max_q_actions(state), e.g. a ValueIteration object
+            start_state (State)
+            max_depth (int)
+        '''
+        self.max_depth = max_depth
+        self.states = [start_state]
+        self.terminal = [start_state.is_terminal()]
+        self.edges = [{}]   # per state, max Q action -> index of the next state
+        self._count_cache = {}
+
+        state_idxs = {start_state: 0}
+        frontier = [0]
+        while len(frontier) > 0:
+            state_idx = frontier.pop()
+            state = self.states[state_idx]
+            if self.terminal[state_idx]:
+                continue
+
+            for action in agent.get_max_q_actions(state):
+                # the transition function deep copies the state
+                next_state = mdp.transition_func(state, action)
+                if next_state == state:
+                    continue
+
+                if next_state not in state_idxs:
+                    state_idxs[next_state] = len(self.states)
+                    self.states.append(next_state)
+                    self.terminal.append(next_state.is_terminal())
+                    self.edges.append({})
+                    frontier.append(state_idxs[next_state])
+                self.edges[state_idx][action] = state_idxs[next_state]
+
+    def _count(self, state_idx, depth):
+        # number of paths from state_idx that start after depth actions have already been taken
+        if self.terminal[state_idx] or depth >= self.max_depth:
+            return 1
+
+        key = (state_idx, depth)
+        if key not in self._count_cache:
+            # a state is revisited at most once per depth, so the recursion is bounded by max_depth
+            self._count_cache[key] = sum(self._count(next_state_idx, depth + 1) for next_state_idx in self.edges[state_idx].values())
+
+        return self._count_cache[key]
+
+    def count_paths(self):
+        '''
+        Returns:
+            (int): the exact number of equally-optimal trajectories
+        '''
+        return self._count(0, 0)
+
+    def _to_trajectory(self, path):
+        return [(self.states[state_idx], action, self.states[next_state_idx]) for state_idx, action, next_state_idx in path]
+
+    def sample_trajectory(self, rng=random):
+        '''
+        Returns:
+            (list): a uniformly sampled equally-optimal trajectory (list of state, action, state tuples), or None if there
+            are none
+        '''
+        if self.count_paths() == 0:
+            return None
+
+        path = []
+        state_idx = 0
+        while not (self.terminal[state_idx] or len(path) >= self.max_depth):
+            # choose each next state in proportion to the number of paths that pass through it
+            threshold = rng.randrange(self._count(state_idx, len(path)))
+            for action, next_state_idx in self.edges[state_idx].items():
+                threshold -= self._count(next_state_idx, len(path) + 1)
+                if threshold < 0:
+                    break
+            path.append((state_idx, action, next_state_idx))
+            state_idx = next_state_idx
+
+        return self._to_trajectory(path)
+
+    def contains(self, action_seq):
+        '''
+        Args:
+            action_seq (list of str)
+
+        Returns:
+            (bool): whether action_seq is one of the equally-optimal trajectories (in O(len(action_seq)) time)
+        '''
+        state_idx = 0
+        for depth, action in enumerate(action_seq):
+            if self.terminal[state_idx] or depth >= self.max_depth or action not in self.edges[state_idx]:
+                return False
+            state_idx = self.edges[state_idx][action]
+
+        return self.terminal[state_idx] or len(action_seq) >= self.max_depth
+
+    def trajectories(self, max_num_of_trajs=None):
+        '''
+        Summary:
+            Enumerate the equally-optimal trajectories in the order of rollout_policy_recursive (only recommended
+            when count_paths() is small)
+        '''
+        n_trajs = 0
+        stack = [(0, [])]
+        while len(stack) > 0 and (max_num_of_trajs is None or n_trajs < max_num_of_trajs):
+            state_idx, path = stack.pop()
+            if self.terminal[state_idx] or len(path) >= self.max_depth:
+                n_trajs += 1
+                yield self._to_trajectory(path)
+                continue
+
+            for action, next_state_idx in reversed(list(self.edges[state_idx].items())):
+                stack.append((next_state_idx, path + [(state_idx, action, next_state_idx)]))
+
+    def best_trajectory(self, edge_value):
+        '''
+        Args:
+            edge_value (function): (state, action, next_state, depth) -> float, e.g. the discounted reward of a transition
+
+        Returns:
+            (list): the equally-optimal trajectory that maximizes the sum of edge_value (the first one in the order of
+            trajectories(), in case of ties), or None if there are none
+        '''
+        values = {}
+
+        def value(state_idx, depth):
+            if self.terminal[state_idx] or depth >= self.max_depth:
+                return 0., None
+            if (state_idx, depth) not in values:
+                best = (float('-inf'), None)
+                for action, next_state_idx in self.edges[state_idx].items():
+                    next_value = value(next_state_idx, depth + 1)[0]
+                    candidate_value = edge_value(self.states[state_idx], action, self.states[next_state_idx], depth) + next_value
+                    if candidate_value > best[0]:
+                        best = (candidate_value, (action, next_state_idx))
+                values[(state_idx, depth)] = best
+
+            return values[(state_idx, depth)]
+
+        if self.count_paths() == 0:
+            return None
+
+        path = []
+        state_idx = 0
+        while not (self.terminal[state_idx] or len(path) >= self.max_depth):
+            action, next_state_idx = value(state_idx, len(path))[1]
+            path.append((state_idx, action, next_state_idx))
+            state_idx = next_state_idx
+
+        return self._to_trajectory(path)
+
+    def to_dict(self):
+        '''
+        Returns:
+            (dict): JSON-serializable representation of the graph (without the states), e.g. for checking whether a
+            human's actions were optimal with contains_action_seq()
+        '''
+        dag_dict = {
+            'max_depth': self.max_depth,
+            'terminal': [bool(terminal) for terminal in self.terminal],
+            'edges': [[[action, next_state_idx] for action, next_state_idx in edges.items()] for edges in self.edges],
+            'n_paths': self.count_paths(),
+        }
+
+        return dag_dict
+
+def contains_action_seq(dag_dict, action_seq):
+    '''
+    Args:
+        dag_dict (dict): as returned by OptimalActionDAG.to_dict()
+        action_seq (list of str)
+
+    Returns:
+        (bool): whether action_seq is one of the equally-optimal trajectories encoded by dag_dict
+    '''
+    state_idx = 0
+    for depth, action in enumerate(action_seq):
+        if dag_dict['terminal'][state_idx] or depth >= dag_dict['max_depth']:
+            return False
+
+        next_state_idxs = [next_state_idx for edge_action, next_state_idx in dag_dict['edges'][state_idx] if edge_action == action]
+        if len(next_state_idxs) == 0:
+            return False
+        state_idx = next_state_idxs[0]
+
+    return dag_dict['terminal'][state_idx] or len(action_seq) >= dag_dict['max_depth']